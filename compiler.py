@@ -3,90 +3,694 @@
 """Compiler module
 
 Acts as the command line interface to the compiler components. When given a
-source file, the compilation process will be executed.
+source file, the compilation process will be executed. When given several
+source files (or a manifest of them), they are compiled as a batch by a pool
+of long-lived worker processes. With --watch, the source files are compiled
+again whenever they change. The compiler may also run as a resident compile
+server, and the command line hand its compiles to that server. The run
+subcommand compiles programs and runs them, checking the output of test
+programs against the output they are expected to print. The stages of a
+compile are in build.py, and the batch, run and watch modes in batch.py,
+runner.py and watcher.py.
 
 Author: Evan Sneath
 License: Open Software License v3.0
 
 Functions:
+    parse_size: Parses a number with an optional binary suffix.
+    parse_memory_size: Parses a main memory size given in cells.
+    parse_cache_size: Parses the size cap of the build cache.
+    parse_memory_limit: Parses the address space limit of a program run.
+    parse_flags: Parses a string of extra C compiler flags.
+    expand_sources: Expands source globs and manifests to source paths.
     parse_arguments: Parses incoming command line arguments.
-    run_compiler: Executes the complete compilation process.
+    run_server: Runs the compiler as a resident compile server.
+    main: Runs the compiler command line.
 """
 
 # Import standard libraries
-import argparse
-import subprocess
+import os
 import sys
 
+# A compile handed to a running compile server saves every import below
+from lib.client import DEFAULT_SOCKET, run_client
+
+if __name__ == '__main__':
+    status = run_client(sys.argv[1:])
+
+    if status is not None:
+        sys.exit(status)
+
+import argparse
+
 # Import custom compiler libraries
-from lib.parser import Parser
+from lib.build import run_compiler
+from lib.codegenerator import DEFAULT_BUDGET, DEFAULT_MEMORY
+from lib.toolchain import DEFAULT_CACHE_DIR, DEFAULT_CACHE_SIZE, DEFAULT_CC
+from lib.toolchain import PROFILES, Toolchain
+
+# The modules used only by some commands (the worker pools, the build cache,
+# the server, the watch and run modes, the time report and source globs) are
+# imported where they are used, keeping them out of the start-up of a single
+# compile (see tools/startupbench.py)
+
+
+def parse_size(text):
+    """Parse Size
+
+    Parses a number with an optional K, M or G (binary) suffix.
+
+    Arguments:
+        text: The size to parse (65536, 64K, 16M, ...).
+
+    Returns:
+        The number.
+
+    Raises:
+        ValueError if the size is not valid.
+    """
+    shifts = {'k': 10, 'm': 20, 'g': 30}
+    suffix = text[-1:].lower()
+
+    if suffix in shifts:
+        return int(text[:-1]) << shifts[suffix]
+
+    return int(text)
+
+
+def parse_memory_size(text):
+    """Parse Memory Size
+
+    Parses a number of main memory cells with an optional K, M or G suffix,
+    in the same format as the MM_CELLS environment variable of programs.
+
+    Arguments:
+        text: The size to parse (65536, 64K, 16M, ...).
+
+    Returns:
+        The number of cells.
+
+    Raises:
+        argparse.ArgumentTypeError if the size is not valid.
+    """
+    try:
+        cells = parse_size(text)
+    except ValueError:
+        raise argparse.ArgumentTypeError('invalid memory size "%s"' % text)
+
+    if cells < 16:
+        raise argparse.ArgumentTypeError('memory size must be at least 16 '
+                                         'cells')
+
+    return cells
+
+
+def parse_cache_size(text):
+    """Parse Cache Size
+
+    Parses a size cap of the build cache in bytes with an optional K, M or G
+    suffix.
+
+    Arguments:
+        text: The size to parse (64M, 1G, ...).
+
+    Returns:
+        The number of bytes.
+
+    Raises:
+        argparse.ArgumentTypeError if the size is not valid.
+    """
+    try:
+        size = parse_size(text)
+    except ValueError:
+        raise argparse.ArgumentTypeError('invalid cache size "%s"' % text)
+
+    if size < 1:
+        raise argparse.ArgumentTypeError('cache size must be positive')
+
+    return size
+
+
+def parse_memory_limit(text):
+    """Parse Memory Limit
+
+    Parses an address space limit of a program run in bytes with an optional
+    K, M or G suffix.
+
+    Arguments:
+        text: The size to parse (256M, 1G, ...).
+
+    Returns:
+        The number of bytes.
+
+    Raises:
+        argparse.ArgumentTypeError if the size is not valid.
+    """
+    try:
+        size = parse_size(text)
+    except ValueError:
+        raise argparse.ArgumentTypeError('invalid memory limit "%s"' % text)
+
+    if size < 1:
+        raise argparse.ArgumentTypeError('memory limit must be positive')
+
+    return size
+
+
+def parse_flags(text):
+    """Parse Flags
+
+    Splits a string of extra C compiler flags the way a shell would.
+
+    Arguments:
+        text: The flags to parse ('-O3 -DNDEBUG', ...).
+
+    Returns:
+        The list of flags.
+
+    Raises:
+        argparse.ArgumentTypeError if the flags are not valid.
+    """
+    import shlex
+
+    try:
+        return shlex.split(text)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError('invalid flags "%s": %s' % (text, e))
+
+
+def expand_sources(patterns, manifest=None):
+    """Expand Sources
+
+    Expands the glob patterns among the given source files and adds the
+    source files listed in a manifest file, one per line. Blank lines and
+    lines starting with '#' are skipped, and relative paths are taken from
+    the directory of the manifest.
+
+    Arguments:
+        patterns: A list of source paths or glob patterns.
+        manifest: The path of a manifest file, or None. (Default: None)
+
+    Returns:
+        A (sources, error) tuple. Error is a message if a pattern matched no
+        file or the manifest could not be read, None otherwise.
+    """
+    sources = []
+
+    for pattern in patterns:
+        if any(c in pattern for c in '*?['):
+            import glob
+
+            matches = sorted(glob.glob(pattern))
 
+            if not matches:
+                return sources, 'no source file matches "%s"' % pattern
 
-def parse_arguments():
+            sources.extend(matches)
+        else:
+            sources.append(pattern)
+
+    if manifest is not None:
+        try:
+            with open(manifest) as f:
+                lines = [line.strip() for line in f]
+        except IOError as e:
+            return sources, 'could not read manifest "%s": %s' % (
+                manifest, e.strerror)
+
+        root = os.path.dirname(manifest)
+        sources.extend(os.path.join(root, line) for line in lines
+                       if line and not line.startswith('#'))
+
+    return sources, None
+
+
+def parse_arguments(argv=None, cc=None):
     """Parse Arguments
 
-    Parses all command line arguments for the compiler program.
+    Parses all command line arguments for the compiler program. Arguments
+    starting with the run subcommand are those of a program run instead.
+
+    Arguments:
+        argv: The list of arguments to parse, or None for those of this
+            process. (Default: None)
+        cc: The default C compiler, or None for DEFAULT_CC. (Default: None)
 
     Returns:
         An object containing all expected command line arguments.
     """
+    if argv is None:
+        argv = sys.argv[1:]
+
+    run = argv[:1] == ['run']
+
     # Parse the command line arguments
-    parser = argparse.ArgumentParser()
+    if run:
+        from lib.runner import DEFAULT_TIME_LIMIT
+
+        argv = argv[1:]
+        parser = argparse.ArgumentParser(
+            prog='%s run' % os.path.basename(sys.argv[0]),
+            description='Compiles programs and runs them. A single program '
+                        'is given the stdin of the command and its output '
+                        'printed. Several programs (or a directory of them) '
+                        'are run as tests: each is given its .in file as '
+                        'stdin and must print its .expected file, a program '
+                        'with no .expected file is only compiled, and a '
+                        'program named *_bad must fail to compile.')
+        parser.set_defaults(watch=False, poll=False, serve=False,
+                            client=False, socket=DEFAULT_SOCKET,
+                            time_report=False, time_report_json=None,
+                            out=None, out_dir='.')
+    else:
+        parser = argparse.ArgumentParser(
+            epilog='Run "%(prog)s run --help" for compiling and running '
+                   'programs.')
+        parser.set_defaults(stdin=None, time_limit=None, memory_limit=None,
+                            update_expected=False, results=None)
+
     parser.add_argument('-d', '--debug',
                         help='print comments in generated code',
                         action='store_true')
-    parser.add_argument('source',
-                        help='source file to compile')
-    parser.add_argument('-o', '--out',
-                        help='target path for the compiled code',
-                        action='store',
-                        default='a.out')
-    args = parser.parse_args()
+    parser.add_argument('-p', '--peephole',
+                        help='run the peephole optimizer on generated code',
+                        action='store_true')
+    parser.add_argument('-i', '--ir-opt',
+                        help='run the IR optimization passes',
+                        action='store_true')
+    parser.add_argument('-n', '--inline',
+                        help='inline small non-recursive procedures',
+                        action='store_true')
+    parser.add_argument('--inline-budget',
+                        help='maximum instructions of an inlined procedure '
+                             '(default: %d)' % DEFAULT_BUDGET,
+                        type=int,
+                        default=DEFAULT_BUDGET)
+    parser.add_argument('--dump-ir',
+                        help='print the IR of the program after optimization',
+                        action='store_true')
+    parser.add_argument('-t', '--target',
+                        help='code model of the generated code (default: 32)',
+                        choices=['32', '64'],
+                        default='32')
+    parser.add_argument('-c', '--call-model',
+                        help='procedure call model (default: goto)',
+                        choices=['goto', 'native'],
+                        default='goto')
+    parser.add_argument('-j', '--jobs',
+                        help='split the code into this many translation '
+                             'units compiled in parallel (native call model '
+                             'only, default: 1)',
+                        type=int,
+                        default=1)
+    parser.add_argument('-m', '--memory',
+                        help='default main memory cells, also set at run time '
+                             'by MM_CELLS (default: 16M)',
+                        type=parse_memory_size,
+                        default=DEFAULT_MEMORY)
+    parser.add_argument('--io',
+                        help='I/O layer of the runtime routines '
+                             '(default: stdio)',
+                        choices=['stdio', 'buffered'],
+                        default='stdio')
+    parser.add_argument('--io-object',
+                        help='link the buffered I/O layer as a precompiled '
+                             'object',
+                        action='store_true')
+    parser.add_argument('--profile',
+                        help='build profile setting the optimizers and C '
+                             'flags: %s' % ', '.join(
+                                 '%s (%s)' % (name, PROFILES[name].description)
+                                 for name in sorted(PROFILES)),
+                        choices=sorted(PROFILES))
+    parser.add_argument('--cc',
+                        help='C compiler building the generated code '
+                             '(default: $CC or gcc)',
+                        default=cc or DEFAULT_CC)
+    parser.add_argument('-O',
+                        help='optimization level of the C compiler (default: '
+                             'none, or set by the profile)',
+                        dest='opt_level',
+                        choices=['0', '1', '2', '3', 's'])
+    parser.add_argument('--march',
+                        help='processor to generate C code for, such as '
+                             'native')
+    parser.add_argument('--lto',
+                        help='link split units and the I/O object with link '
+                             'time optimization',
+                        action='store_true')
+    parser.add_argument('--cflags',
+                        help='extra C compiler flags, given as --cflags="..."',
+                        type=parse_flags,
+                        default=[])
+    parser.add_argument('--ldflags',
+                        help='extra C linker flags, given as --ldflags="..."',
+                        type=parse_flags,
+                        default=[])
+    parser.add_argument('--keep-ir',
+                        help='write the generated C code to this path and '
+                             'compile it from there (default: stream it to '
+                             'the C compiler)',
+                        metavar='PATH')
+    parser.add_argument('--cache',
+                        help='reuse and store generated code and programs in '
+                             'the build cache',
+                        action='store_true')
+    parser.add_argument('--cache-dir',
+                        help='directory of the build cache (default: %s)' %
+                             DEFAULT_CACHE_DIR.replace(
+                                 os.path.expanduser('~'), '~'),
+                        default=DEFAULT_CACHE_DIR)
+    parser.add_argument('--cache-size',
+                        help='size cap of the build cache, least recently '
+                             'used entries are evicted (default: %dM)' %
+                             (DEFAULT_CACHE_SIZE >> 20),
+                        type=parse_cache_size,
+                        default=DEFAULT_CACHE_SIZE)
+    parser.add_argument('--cache-stats',
+                        help='print the hit and miss counts of the build '
+                             'cache, also without a source file',
+                        action='store_true')
+    if not run:
+        parser.add_argument('--watch',
+                            help='compile the source files again whenever '
+                                 'they change, until interrupted',
+                            action='store_true')
+        parser.add_argument('--poll',
+                            help='watch the source files by polling instead '
+                                 'of with inotify',
+                            action='store_true')
+        parser.add_argument('--serve',
+                            help='run as a compile server, keeping the '
+                                 'compiler loaded for --client compiles',
+                            action='store_true')
+        parser.add_argument('--client',
+                            help='hand the compile to the compile server, or '
+                                 'compile here if none is running',
+                            action='store_true')
+        parser.add_argument('--socket',
+                            help='socket of the compile server (default: '
+                                 'evansneath-compiler-<uid>.sock in '
+                                 '$XDG_RUNTIME_DIR, or else /tmp)',
+                            default=DEFAULT_SOCKET)
+
+    parser.add_argument('-s', '--stats',
+                        help='print optimization statistics',
+                        action='store_true')
+
+    if not run:
+        parser.add_argument('--time-report',
+                            help='print the time and peak memory of each '
+                                 'phase of the compile',
+                            action='store_true')
+        parser.add_argument('--time-report-json',
+                            help='write the time report as JSON to this '
+                                 'path, or - for stdout',
+                            metavar='PATH')
+        parser.add_argument('source',
+                            help='source files or glob patterns to compile, '
+                                 'several are compiled as a batch',
+                            nargs='*')
+        parser.add_argument('-o', '--out',
+                            help='target path for the compiled code '
+                                 '(default: a.out)',
+                            action='store')
+        parser.add_argument('--manifest',
+                            help='file listing source files to compile as a '
+                                 'batch, one per line')
+        parser.add_argument('--out-dir',
+                            help='directory of the programs of a batch, each '
+                                 'named after its source (default: .)',
+                            default='.')
+        parser.add_argument('-w', '--workers',
+                            help='worker processes compiling a batch '
+                                 '(default: the number of cores)',
+                            type=int,
+                            default=os.cpu_count() or 1)
+    else:
+        parser.add_argument('source',
+                            help='source files, glob patterns or directories '
+                                 'of programs to run, several are run as '
+                                 'tests',
+                            nargs='*')
+        parser.add_argument('--manifest',
+                            help='file listing programs to run as tests, one '
+                                 'per line')
+        parser.add_argument('-w', '--workers',
+                            help='worker processes running tests (default: '
+                                 'the number of cores)',
+                            type=int,
+                            default=os.cpu_count() or 1)
+        parser.add_argument('--stdin',
+                            help='file given to a single program as stdin, '
+                                 'or - for the stdin of the command '
+                                 '(default: -)',
+                            metavar='FILE',
+                            default='-')
+        parser.add_argument('--time-limit',
+                            help='seconds a program may run before it is '
+                                 'stopped (default: %g)' % DEFAULT_TIME_LIMIT,
+                            type=float,
+                            default=DEFAULT_TIME_LIMIT)
+        parser.add_argument('--memory-limit',
+                            help='address space limit of a program, such as '
+                                 '512M (default: none)',
+                            type=parse_memory_limit)
+        parser.add_argument('--update-expected',
+                            help='write the output of each test program '
+                                 'which exits with status 0 to its .expected '
+                                 'file',
+                            action='store_true')
+        parser.add_argument('--results',
+                            help='write the status and times of each test '
+                                 'as JSON to this path',
+                            metavar='PATH')
+
+    args = parser.parse_args(argv)
+    args.run = run
+
+    # A directory given to the run subcommand holds the programs to run
+    patterns = [os.path.join(pattern, '*.src')
+                if run and os.path.isdir(pattern) else pattern
+                for pattern in args.source]
+
+    args.sources, error = expand_sources(patterns, args.manifest)
+
+    if error is not None:
+        parser.error(error)
+
+    if args.serve and args.client:
+        parser.error('argument --client: not allowed with --serve')
+
+    if args.watch and (args.serve or args.client):
+        parser.error('argument --watch: not allowed with --serve or '
+                     '--client')
+
+    if args.poll and not args.watch:
+        parser.error('argument --poll: only allowed with --watch')
+
+    if args.serve and args.sources:
+        parser.error('argument --serve: a server is given no source file')
+
+    if not args.sources and not args.cache_stats and not args.serve:
+        parser.error('no source file given')
+
+    args.batch = len(args.sources) > 1 or args.manifest is not None
+
+    # The programs of the run subcommand are tests rather than a batch
+    args.tests = run and (args.batch or patterns != args.source or
+                          args.update_expected or args.results is not None)
+    args.batch = args.batch and not run
+
+    if args.tests and args.stdin != '-':
+        parser.error('argument --stdin: test programs are given their .in '
+                     'file')
+
+    if args.tests and args.keep_ir is not None:
+        parser.error('argument --keep-ir: not allowed with tests')
+
+    if run and args.time_limit <= 0:
+        parser.error('argument --time-limit: must be positive')
+
+    if args.batch and args.out is not None:
+        parser.error('argument -o/--out: a batch is written to --out-dir')
+
+    if args.batch and args.keep_ir is not None:
+        parser.error('argument --keep-ir: not allowed with a batch')
+
+    args.timed = args.time_report or args.time_report_json is not None
+
+    if args.timed and (args.batch or args.watch or args.serve):
+        parser.error('argument --time-report: only allowed with a single '
+                     'compile')
+
+    if args.workers < 1:
+        parser.error('argument -w/--workers: must be at least 1')
+
+    names = [os.path.splitext(os.path.basename(source))[0]
+             for source in args.sources]
+
+    if not run and len(set(names)) != len(names):
+        parser.error('source files of a batch must have distinct names')
+
+    if args.jobs < 1:
+        parser.error('argument -j/--jobs: must be at least 1')
+
+    if args.jobs > 1 and args.call_model != 'native':
+        parser.error('argument -j/--jobs: procedures must be C functions '
+                     'to be split, use -c native')
 
     return args
 
 
-def run_compiler(source, target, debug=False):
-    """Run Compiler
+def run_server(socket_path, toolchain):
+    """Run Server
 
-    Executes the compilation process given a source file path.
+    Runs the compiler as a resident compile server until it is interrupted
+    or terminated. The C compiler is probed, the compiler hashed for the
+    build cache and the runtime sources read before serving, so every request
+    starts warm.
 
     Arguments:
-        source: The source file to compile.
-        target: The destination binary executable file.
-        debug: If True, verbose parsing details are shown. (Default: False)
+        socket_path: The path of the socket to listen on.
+        toolchain: The Toolchain object of the server, to probe.
 
     Returns:
-        True on success, False otherwise.
+        True if the server stopped cleanly, False if it could not start.
     """
-    # Define a temporary location for the intermediate C code
-    TMP_CODE_FILE = './ir.c'
+    from lib.api import compile_source
+    from lib.cache import compiler_digest, compiler_files
+    from lib.server import serve
 
-    # Create a Parser object to parse the inputted source file
-    parser = Parser(debug)
+    toolchain.capabilities()
+    compiler_digest()
 
-    # Parse the source file to the temporary code file
-    if not parser.parse(source, TMP_CODE_FILE):
-        print('Error while parsing "%s"' % source)
-        return False
+    for io in ['stdio', 'buffered']:
+        compile_source('program warm is begin end program', io=io)
 
-    # Set up gcc compilation command
-    gcc_cmd = ['gcc', '-m32', '-o', target, TMP_CODE_FILE]
+    # The server refuses requests once any of these files change
+    watched = [os.path.abspath(__file__)] + compiler_files()
 
-    # Compile the temporary file with gcc. Output to the target location
-    if subprocess.call(gcc_cmd) != 0:
-        print('Error while compiling "%s"' % target)
-        return False
+    return serve(socket_path, main, watched)
 
-    return True
 
+def main(argv=None, cc=None):
+    """Main
 
-if __name__ == '__main__':
+    Runs the compiler command line. A compile server runs this for each
+    request.
+
+    Arguments:
+        argv: The list of command line arguments, or None for those of this
+            process. (Default: None)
+        cc: The default C compiler, or None for DEFAULT_CC. (Default: None)
+
+    Returns:
+        True if the command succeeded, False otherwise.
+    """
     # Parse compiler arguments
-    args = parse_arguments()
+    args = parse_arguments(argv, cc)
+
+    # Optimizers enabled by the profile are added to those given
+    if args.profile is not None:
+        profile = PROFILES[args.profile]
+        args.peephole = args.peephole or profile.peephole
+        args.ir_opt = args.ir_opt or profile.ir_opt
+        args.inline = args.inline or profile.inline
+
+    toolchain = Toolchain(args.cc, profile=args.profile,
+                          opt_level=args.opt_level, march=args.march,
+                          lto=args.lto, cflags=args.cflags,
+                          ldflags=args.ldflags)
+
+    options = dict(debug=args.debug, peephole=args.peephole,
+                   stats=args.stats, ir_opt=args.ir_opt, dump_ir=args.dump_ir,
+                   code_model=args.target, call_model=args.call_model,
+                   inline=args.inline, inline_budget=args.inline_budget,
+                   io=args.io, io_object=args.io_object, memory=args.memory,
+                   jobs=args.jobs, toolchain=toolchain)
+
+    cache = None
+
+    if args.cache or args.cache_stats:
+        from lib.cache import BuildCache
+
+        cache = BuildCache(args.cache_dir, args.cache_size)
+        since = cache.stats()
+
+    if args.cache:
+        options['cache'] = cache
 
     # Run compilation process
-    result = run_compiler(args.source, args.out, debug=args.debug)
+    if args.serve:
+        result = run_server(args.socket, toolchain)
+    elif not args.sources:
+        result = True
+    elif args.watch:
+        from lib.watcher import run_watch
+
+        result = run_watch(args.sources, args.out or 'a.out', args.out_dir,
+                           args.workers, use_inotify=not args.poll,
+                           keep_ir=args.keep_ir, **options)
+    elif args.batch:
+        from lib.batch import run_batch
+
+        result = run_batch(args.sources, args.out_dir, args.workers,
+                           **options)
+    elif args.tests:
+        from lib.runner import run_tests
+
+        result = run_tests(args.sources, args.workers, args.time_limit,
+                           args.memory_limit, args.update_expected,
+                           args.results, **options)
+    elif args.run:
+        from lib.runner import run_source
+
+        result = run_source(args.sources[0], args.stdin, args.time_limit,
+                            args.memory_limit, keep_ir=args.keep_ir,
+                            **options)
+    elif args.timed:
+        import json
+        from lib.timereport import TimeReport
+
+        time_report = TimeReport()
+        time_report.start()
 
+        try:
+            result = run_compiler(args.sources[0], args.out or 'a.out',
+                                  keep_ir=args.keep_ir,
+                                  time_report=time_report, **options)
+        finally:
+            time_report.stop()
+
+        if args.time_report:
+            print(time_report.table())
+
+        if args.time_report_json is not None:
+            report = dict(time_report.as_dict(), source=args.sources[0],
+                          succeeded=result)
+
+            if args.time_report_json == '-':
+                print(json.dumps(report, indent=2))
+            else:
+                try:
+                    with open(args.time_report_json, 'w') as f:
+                        json.dump(report, f, indent=2)
+                        f.write('\n')
+                except OSError as e:
+                    print('Error: could not write "%s": %s' % (
+                        args.time_report_json, e.strerror))
+                    result = False
+    else:
+        result = run_compiler(args.sources[0], args.out or 'a.out',
+                              keep_ir=args.keep_ir, **options)
+
+    if args.cache_stats:
+        print(cache.report(since))
+
+    return result
+
+
+if __name__ == '__main__':
     # Terminate program
-    sys.exit(not result)
+    sys.exit(not main())
@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+
+"""API module
+
+Compiles source text held in memory to C code, for programs embedding the
+compiler such as services receiving source over the network. Nothing is
+printed and no file is read or written, apart from the runtime C sources of
+the compiler which a process reads once. Errors and warnings are returned as
+Diagnostic objects (see datatypes.py) along with the code and statistics of
+the compile. Each compile has parser and optimizer objects of its own, so
+compiles may be repeated, and run on several threads, in one process.
+
+Author: Evan Sneath
+License: Open Software License v3.0
+
+Classes:
+    CompileResult: The code, diagnostics and statistics of a compile.
+
+Functions:
+    compile_source: Compiles source text to C code.
+"""
+
+from lib.codegenerator import DEFAULT_MEMORY
+from lib.datatypes import Diagnostic
+from lib.inliner import Inliner, DEFAULT_BUDGET
+from lib.parser import Parser
+from lib.passes import PassManager
+from lib.peephole import PeepholeOptimizer
+
+
+"""The number of characters of code in each chunk yielded by iter_code()."""
+CHUNK_SIZE = 65536
+
+
+class _CodeSink:
+    """_CodeSink class
+
+    A text stream collecting the lines of code written by a commit.
+    """
+    def __init__(self):
+        super().__init__()
+
+        self.lines = []
+
+        return
+
+    def write(self, text):
+        self.lines.append(text)
+
+        return len(text)
+
+
+class CompileResult:
+    """CompileResult class
+
+    The code, diagnostics and statistics of a compile.
+
+    Attributes:
+        succeeded: True if the source compiled, False otherwise.
+        code: The generated C code as a string, or None if the compile
+            failed.
+        diagnostics: A list of the errors and warnings of the compile as
+            Diagnostic objects, in the order they were found.
+        stats: A dictionary of the statistics of the compile. Empty if it
+            failed.
+
+    Methods:
+        errors: Returns the error diagnostics.
+        iter_code: Returns an iterator over chunks of the code.
+    """
+    def __init__(self, succeeded, code, diagnostics, stats):
+        super().__init__()
+
+        self.succeeded = succeeded
+        self.code = code
+        self.diagnostics = diagnostics
+        self.stats = stats
+
+        return
+
+    def errors(self):
+        """Get Errors
+
+        Returns:
+            A list of the diagnostics of the compile which are errors.
+        """
+        return [d for d in self.diagnostics if d.severity == 'error']
+
+    def iter_code(self, size=CHUNK_SIZE):
+        """Iterate Code
+
+        Arguments:
+            size: The most characters of each chunk. (Default: CHUNK_SIZE)
+
+        Returns:
+            An iterator over successive chunks of the code, for sending it on
+            without building another copy of it. Empty if the compile failed.
+        """
+        code = self.code or ''
+
+        return (code[start:start + size] for start in range(0, len(code),
+                                                            size))
+
+
+def compile_source(source, name='<source>', debug=False, peephole=False,
+                   ir_opt=False, code_model='32', call_model='goto',
+                   inline=False, inline_budget=DEFAULT_BUDGET, io='stdio',
+                   memory=DEFAULT_MEMORY):
+    """Compile Source
+
+    Compiles source text to C code in memory. The options are those of
+    run_compiler() in build.py, apart from the C compiler and the files a
+    compile writes.
+
+    Arguments:
+        source: The source code, as a string or as UTF-8 encoded bytes.
+        name: The name of the source in diagnostics. (Default: '<source>')
+        debug: If True, comments are written in the generated code.
+            (Default: False)
+        peephole: If True, the peephole optimizer is run on the generated
+            code. (Default: False)
+        ir_opt: If True, the IR optimization passes are run. (Default: False)
+        code_model: The target code model, '32' or '64'. (Default: '32')
+        call_model: The procedure call model, 'goto' or 'native'.
+            (Default: 'goto')
+        inline: If True, small non-recursive procedures are inlined.
+            (Default: False)
+        inline_budget: The maximum number of IR instructions of an inlined
+            procedure body. (Default: DEFAULT_BUDGET)
+        io: The I/O layer of the runtime routines, 'stdio' or 'buffered'.
+            (Default: 'stdio')
+        memory: The default number of main memory cells of the program.
+            (Default: DEFAULT_MEMORY)
+
+    Returns:
+        A CompileResult object.
+
+    Raises:
+        ValueError: If an option has an invalid value.
+    """
+    for option, value, choices in [('code_model', code_model, ['32', '64']),
+                                   ('call_model', call_model,
+                                    ['goto', 'native']),
+                                   ('io', io, ['stdio', 'buffered'])]:
+        if value not in choices:
+            raise ValueError('%s must be one of %s, not %r' % (
+                option, ', '.join(choices), value))
+
+    if isinstance(source, bytes):
+        try:
+            source = source.decode('utf-8')
+        except UnicodeDecodeError as e:
+            line = source.count(b'\n', 0, e.start) + 1
+            diagnostic = Diagnostic('error', 'Source is not valid UTF-8: %s' %
+                                    e.reason, name, line, None, None)
+            return CompileResult(False, None, [diagnostic], {})
+
+    parser = Parser(debug)
+    parser.target = code_model
+    parser.call_model = call_model
+    parser.memory = memory
+    parser.io = io
+    parser.diagnostics = []
+
+    if inline:
+        parser.inliner = Inliner(inline_budget)
+
+    if peephole:
+        parser.peephole = PeepholeOptimizer()
+
+    if ir_opt:
+        parser.pass_manager = PassManager()
+
+    sink = _CodeSink()
+
+    if not parser.parse_text(source, sink, name):
+        return CompileResult(False, None, parser.diagnostics, {})
+
+    code = ''.join(sink.lines)
+    stats = dict(parser.code_counts(), c_lines=len(sink.lines),
+                 c_bytes=len(code.encode()),
+                 procedures=parser.reachability['procedures'],
+                 runtime=parser.reachability['runtime'])
+
+    if parser.inliner is not None:
+        inlined = sum(1 for d in parser.inliner.decisions if d[3] is None)
+        stats['inlined_calls'] = inlined
+        stats['kept_calls'] = len(parser.inliner.decisions) - inlined
+
+    if parser.pass_manager is not None:
+        stats['ir_changes'] = dict(parser.pass_manager.changes)
+
+    if parser.peephole is not None:
+        stats['peephole'] = dict(parser.peephole.stats)
+
+    return CompileResult(True, code, parser.diagnostics, stats)
@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+
+"""Batch module
+
+Compiles many source files over a pool of long-lived worker processes, for
+the batch mode of the command line, the first compile of the watch mode and
+the tests of the run mode. Each worker compiles chunks of the batch, leaving
+the C compilers of a few programs running while it parses the next.
+
+Author: Evan Sneath
+License: Open Software License v3.0
+
+Functions:
+    compile_chunk: Compiles a chunk of a batch in a worker process.
+    run_batch: Compiles many source files over a pool of workers.
+"""
+
+import os
+import sys
+import tempfile
+import time
+
+from lib.build import prepare_toolchain, run_compiler
+
+
+"""The number of C compiles a batch worker leaves running while it parses."""
+PIPELINE_DEPTH = 2
+
+"""The largest number of source files handed to a batch worker at once."""
+MAX_CHUNK = 16
+
+
+def compile_chunk(jobs, options):
+    """Compile Chunk
+
+    Compiles a chunk of a batch in a worker process. The output of each
+    compile, including that of its C compiler, is captured separately. The
+    C compilers of up to PIPELINE_DEPTH programs are left running while the
+    next programs are parsed.
+
+    Arguments:
+        jobs: A list of (source, target) tuples.
+        options: A dictionary of run_compiler() arguments.
+
+    Returns:
+        A list of (source, succeeded, output, seconds) tuples, one per job.
+    """
+    results = [None] * len(jobs)
+    running = []
+    saved = [os.dup(1), os.dup(2)]
+
+    def finish(index, succeeded, log, start, streamed=False):
+        # run_compiler() reports its own errors, but not those of a stream
+        if streamed and not succeeded:
+            log.seek(0, os.SEEK_END)
+            log.write(('Error while compiling "%s"\n' %
+                       jobs[index][1]).encode())
+
+        log.seek(0)
+        output = log.read().decode(errors='replace')
+        log.close()
+
+        results[index] = (jobs[index][0], succeeded, output,
+                          time.perf_counter() - start)
+
+    try:
+        for index, (source, target) in enumerate(jobs):
+            log = tempfile.TemporaryFile()
+            start = time.perf_counter()
+            pending = []
+
+            # The C compiler inherits the redirected output when started
+            sys.stdout.flush()
+            os.dup2(log.fileno(), 1)
+            os.dup2(log.fileno(), 2)
+
+            try:
+                succeeded = run_compiler(source, target, pending=pending,
+                                         **options)
+            finally:
+                sys.stdout.flush()
+                os.dup2(saved[0], 1)
+                os.dup2(saved[1], 2)
+
+            if pending:
+                running.append((index, pending[0], log, start))
+            else:
+                finish(index, succeeded, log, start)
+
+            while len(running) > PIPELINE_DEPTH:
+                index, wait, log, start = running.pop(0)
+                finish(index, wait(), log, start, True)
+
+        for index, wait, log, start in running:
+            finish(index, wait(), log, start, True)
+    finally:
+        os.close(saved[0])
+        os.close(saved[1])
+
+    return results
+
+
+def run_batch(sources, out_dir, workers, **options):
+    """Run Batch
+
+    Compiles many source files over a pool of worker processes, each of
+    which lives for the whole batch and so imports the compiler and probes
+    the C compiler only once. Programs are named after their source file in
+    the output directory. The result of each source file is printed as it
+    completes, followed by a summary.
+
+    Arguments:
+        sources: A list of source file paths.
+        out_dir: The directory to write the programs to.
+        workers: The number of worker processes.
+        options: The run_compiler() arguments of every compile.
+
+    Returns:
+        True if every source file was compiled, False otherwise.
+    """
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+
+    jobs = [(source, os.path.join(out_dir, os.path.splitext(
+        os.path.basename(source))[0])) for source in sources]
+
+    try:
+        os.makedirs(out_dir, exist_ok=True)
+    except OSError as e:
+        print('Error: could not create "%s": %s' % (out_dir, e.strerror))
+        return False
+
+    if not prepare_toolchain(options):
+        return False
+
+    size = max(1, min(MAX_CHUNK, len(jobs) // (workers * 4)))
+    chunks = [jobs[i:i + size] for i in range(0, len(jobs), size)]
+    failed = 0
+    start = time.perf_counter()
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(compile_chunk, chunk, options)
+                   for chunk in chunks]
+
+        for future in as_completed(futures):
+            for source, succeeded, output, seconds in future.result():
+                failed += not succeeded
+                print('%-6s %7.3fs  %s' % ('ok' if succeeded else 'FAILED',
+                                           seconds, source))
+
+                for line in output.splitlines():
+                    print('    %s' % line)
+
+    seconds = time.perf_counter() - start
+    print('Batch: %d compiled, %d failed in %.3fs (%.1f programs/s, %d '
+          'workers)' % (len(jobs) - failed, failed, seconds,
+                        len(jobs) / seconds, workers))
+
+    return failed == 0
@@ -0,0 +1,917 @@
+#!/usr/bin/env python3
+
+"""Build module
+
+Builds a program from a source file, for the command line and its batch,
+run and watch modes and for the tools. A build runs in three stages, each
+with its own functions below:
+
+    generate: The source file is parsed and its C code written to the C
+        compiler as a stream, to a file or to split translation units.
+    cache: With a build cache, a stored program is copied to the target, or
+        stored code is written in place of parsing the source, and the code
+        and program of a build are stored.
+    C compile: The C compiler reads the streamed code or compiles the files,
+        and links the program with the runtime object.
+
+Author: Evan Sneath
+License: Open Software License v3.0
+
+Classes:
+    TeeStream: A text stream writing to another one and keeping a copy.
+
+Functions:
+    make_parser: Creates the parser of a compile and its optimizers.
+    generate_code: Parses a source file to the code destination.
+    report_stats: Prints the optimization statistics of a compile.
+    read_source: Reads a source file once for the build cache.
+    cache_keys: Computes the build cache keys of a compile.
+    fetch_program: Copies a cached program to the target.
+    print_messages: Prints the warnings of cached code again.
+    write_units: Writes cached code to its destination.
+    read_units: Reads back the code written by a parse.
+    store_build: Stores the code and program of a build in the cache.
+    prepare_toolchain: Probes the C compiler before a pool is forked.
+    build_runtime_object: Compiles the buffered runtime I/O layer once.
+    open_code: Opens the destination of the generated code.
+    compile_units: Compiles split translation units in parallel.
+    update_units: Keeps the changed translation units of a compile.
+    finish_stream: Waits for a C compiler reading the code from stdin.
+    compile_code: Builds a program from code written to files.
+    close_code: Stops the C compiler and removes the files of a compile.
+    run_compiler: Executes the complete compilation process.
+"""
+
+import os
+import subprocess
+
+from lib.codegenerator import DEFAULT_BUDGET, DEFAULT_MEMORY, runtime_path
+from lib.parser import Parser
+from lib.toolchain import CACHE_ROOT, STDIN, Toolchain
+
+# The optimizers, the time report and the file utilities of split units are
+# imported where they are used, keeping them out of the start-up of a single
+# compile (see tools/startupbench.py)
+
+
+def make_parser(debug=False, peephole=False, ir_opt=False, code_model='32',
+                call_model='goto', inline=False,
+                inline_budget=DEFAULT_BUDGET, io='stdio', io_object=False,
+                memory=DEFAULT_MEMORY, jobs=1):
+    """Make Parser
+
+    Creates the parser of a compile, with the optimizers it runs. The
+    arguments are those of run_compiler().
+
+    Returns:
+        A Parser object.
+    """
+    parser = Parser(debug)
+    parser.target = code_model
+    parser.call_model = call_model
+    parser.memory = memory
+    parser.units = jobs
+    parser.io = io
+    parser.io_object = io_object
+
+    if inline:
+        from lib.inliner import Inliner
+
+        parser.inliner = Inliner(inline_budget)
+
+    if peephole:
+        from lib.peephole import PeepholeOptimizer
+
+        parser.peephole = PeepholeOptimizer()
+
+    if ir_opt:
+        from lib.passes import PassManager
+
+        parser.pass_manager = PassManager()
+
+    return parser
+
+
+def generate_code(parser, source, source_text, code_path, target,
+                  process=None):
+    """Generate Code
+
+    Parses a source file and writes its code to the destination.
+
+    Arguments:
+        parser: The Parser object of the compile.
+        source: The source file to compile.
+        source_text: The text of the source file already read, or None for
+            the parser to read it.
+        code_path: The destination file path, or a stream.
+        target: The destination binary executable file.
+        process: The Popen object of a C compiler reading the code from
+            code_path, or None. (Default: None)
+
+    Returns:
+        The list of paths of the C files written, empty for a stream, or None
+        if the source could not be compiled.
+    """
+    if source_text is None:
+        parsed = parser.parse(source, code_path)
+    else:
+        parsed = parser.parse_text(source_text, code_path, source)
+
+    if parsed:
+        return parser.unit_paths
+
+    # The streamed code is not read once the C compiler has failed
+    if process is not None and process.poll() is not None:
+        print('Error while compiling "%s"' % target)
+    else:
+        print('Error while parsing "%s"' % source)
+
+    return None
+
+
+def report_stats(parser, toolchain, parsed):
+    """Report Statistics
+
+    Prints the C compiler of a compile and, if the source was parsed, the
+    statistics of the parser and of each optimizer it ran.
+
+    Arguments:
+        parser: The Parser object of the compile.
+        toolchain: The Toolchain object building the generated code.
+        parsed: If True, the source was parsed rather than its code taken
+            from the build cache.
+    """
+    print(toolchain.describe())
+
+    # The parser statistics are only known if the source was parsed
+    if parsed:
+        print(parser.reachability_report())
+
+        if parser.inliner is not None:
+            print(parser.inliner.report())
+
+        if parser.pass_manager is not None:
+            print(parser.pass_manager.report())
+
+        if parser.peephole is not None:
+            print(parser.peephole.report())
+
+    return
+
+
+def read_source(source):
+    """Read Source
+
+    Reads a source file once for the build cache, so the code stored under a
+    key is always generated from the bytes of that key.
+
+    Arguments:
+        source: The source file to compile.
+
+    Returns:
+        A (data, text) tuple of the bytes and the text of the file, or
+        (None, None) if it could not be read or decoded, which the parser
+        then reports.
+    """
+    try:
+        with open(source, 'rb') as f:
+            data = f.read()
+
+        return data, data.decode('utf-8')
+    except (OSError, UnicodeDecodeError):
+        return None, None
+
+
+def cache_keys(cache, data, toolchain, options):
+    """Cache Keys
+
+    Arguments:
+        cache: The BuildCache object.
+        data: The bytes of the source file.
+        toolchain: The Toolchain object building the generated code.
+        options: A dictionary of the options of the compile changing its
+            generated code, with its 'code_model' and its 'units'.
+
+    Returns:
+        A (code key, binary key) tuple, the keys of the generated code and
+        of the program in the build cache.
+    """
+    code_key = cache.code_key(data, options)
+
+    return code_key, cache.binary_key(
+        code_key, [toolchain.identity(options['code_model']),
+                   options['units']])
+
+
+def fetch_program(cache, keys, target):
+    """Fetch Program
+
+    Copies a cached program to the target and prints the warnings of the
+    code it was built from again. A program whose code is no longer cached
+    is not used, since its warnings are lost with the code.
+
+    Arguments:
+        cache: The BuildCache object.
+        keys: The (code key, binary key) tuple of the compile.
+        target: The destination binary executable file.
+
+    Returns:
+        True if the program was in the cache and copied to the target, False
+        otherwise.
+    """
+    messages = cache.get_messages(keys[0])
+
+    if messages is None:
+        return False
+
+    try:
+        if not cache.get_binary(keys[1], target):
+            return False
+    except OSError:
+        return False
+
+    print_messages(messages)
+
+    return True
+
+
+def print_messages(messages):
+    """Print Messages
+
+    Prints the warnings of cached code again, so a build reports the same
+    warnings whether or not it parsed the source.
+
+    Arguments:
+        messages: The list of warnings printed while generating the code.
+    """
+    for message in messages:
+        print(message)
+
+    return
+
+
+class TeeStream:
+    """TeeStream class
+
+    A text stream which writes everything to another stream and keeps a copy
+    of it, so streamed code can also be stored.
+
+    Attributes:
+        stream: The stream written to.
+
+    Methods:
+        write: Writes text to the stream and the copy.
+        getvalue: Returns all text written so far.
+    """
+    def __init__(self, stream):
+        super().__init__()
+
+        self.stream = stream
+        self._chunks = []
+
+        return
+
+    def write(self, text):
+        """Write Text
+
+        Arguments:
+            text: The text to write.
+        """
+        self.stream.write(text)
+        self._chunks.append(text)
+
+        return
+
+    def getvalue(self):
+        """Get Value
+
+        Returns:
+            All text written so far.
+        """
+        return ''.join(self._chunks)
+
+
+def write_units(units, code_path):
+    """Write Units
+
+    Writes cached code to its destination. The main unit is written to the
+    destination and any other files next to it.
+
+    Arguments:
+        units: A list of (file name, code) tuples, the main unit first.
+        code_path: The destination file path, or a stream.
+
+    Returns:
+        The list of paths of the C files written, empty for a stream, or None
+        if the code could not be written.
+    """
+    if hasattr(code_path, 'write'):
+        try:
+            code_path.write(units[0][1])
+        except IOError:
+            return None
+
+        return []
+
+    paths = []
+
+    for index, (name, code) in enumerate(units):
+        path = code_path if index == 0 else \
+            os.path.join(os.path.dirname(code_path), name)
+
+        try:
+            with open(path, 'w') as f:
+                f.write(code)
+        except IOError as e:
+            print('Error: "%s"' % path)
+            print('    Could not write to destination file: %s' % e.strerror)
+            return None
+
+        if not name.endswith('.h'):
+            paths.append(path)
+
+    return paths
+
+
+def read_units(code_path, unit_paths, header):
+    """Read Units
+
+    Arguments:
+        code_path: The destination file path, or the TeeStream the code was
+            streamed to.
+        unit_paths: The paths of the C files written, the main unit first.
+        header: If True, the header shared by split units is read as well.
+
+    Returns:
+        A list of (file name, code) tuples, the main unit first.
+    """
+    if isinstance(code_path, TeeStream):
+        return [('ir.c', code_path.getvalue())]
+
+    paths = list(unit_paths)
+
+    if header:
+        paths.append(os.path.splitext(unit_paths[0])[0] + '.h')
+
+    units = []
+
+    for path in paths:
+        with open(path) as f:
+            units.append((os.path.basename(path), f.read()))
+
+    return units
+
+
+def store_build(cache, keys, units, messages, target, new_code):
+    """Store Build
+
+    Stores the code and program of a build. The cache only speeds up
+    builds, so failing to update it is only a warning.
+
+    Arguments:
+        cache: The BuildCache object.
+        keys: The (code key, binary key) tuple of the compile.
+        units: A list of (file name, code) tuples, the main unit first.
+        messages: The list of warnings printed while generating the code.
+        target: The program built.
+        new_code: If True, the code was generated rather than taken from the
+            cache, and is stored as well.
+    """
+    try:
+        if new_code:
+            cache.put_code(keys[0], units, messages)
+
+        cache.put_binary(keys[1], target)
+    except OSError as e:
+        print('Warning: could not update the build cache: %s' % e.strerror)
+
+    return
+
+
+def prepare_toolchain(options):
+    """Prepare Toolchain
+
+    Probes the C compiler and builds the runtime object before a pool of
+    workers is forked, so they all start warm.
+
+    Arguments:
+        options: A dictionary of run_compiler() arguments, which is given a
+            Toolchain object if it has none.
+
+    Returns:
+        True if the C compiler can build programs, False otherwise.
+    """
+    toolchain = options.setdefault('toolchain', Toolchain())
+    error = toolchain.check(options.get('code_model', '32'))
+
+    if error is not None:
+        print('Error: %s' % error)
+        return False
+
+    if options.get('io_object') and options.get('io') == 'buffered':
+        if build_runtime_object(options.get('code_model', '32'),
+                                toolchain) is None:
+            return False
+
+    return True
+
+
+def build_runtime_object(code_model, toolchain):
+    """Build Runtime Object
+
+    Compiles the buffered runtime I/O layer to an object in the objects
+    directory of the compiler's cache, with -O2 unless the toolchain sets an
+    optimization level. The object is named after its compile command and is
+    reused until its source changes. It is compiled to a private file in the
+    same directory and then renamed, so concurrent builds never link a partly
+    written object.
+
+    Arguments:
+        code_model: The target code model, '32' or '64'.
+        toolchain: The Toolchain object building the program.
+
+    Returns:
+        The path of the object file, or None if it could not be compiled.
+    """
+    import hashlib
+    import tempfile
+
+    sources = [runtime_path(name) for name in ['rtio.c', 'rtio.h']]
+    gcc_cmd = toolchain.object_command(code_model, sources[0], '', '2')
+    digest = hashlib.sha1(' '.join(gcc_cmd).encode()).hexdigest()[:8]
+    directory = os.path.join(CACHE_ROOT, 'objects')
+    obj = os.path.join(directory, 'rtio_m%s_%s.o' % (code_model, digest))
+
+    if os.path.isfile(obj) and all(os.path.getmtime(obj) >=
+                                   os.path.getmtime(src) for src in sources):
+        return obj
+
+    try:
+        os.makedirs(directory, exist_ok=True)
+        fd, temp_obj = tempfile.mkstemp(suffix='.o', prefix='.rtio_',
+                                        dir=directory)
+    except OSError as e:
+        print('Error while creating the runtime object "%s": %s' % (obj, e))
+        return None
+
+    os.close(fd)
+    gcc_cmd[gcc_cmd.index('-o') + 1] = temp_obj
+
+    try:
+        if subprocess.call(gcc_cmd) != 0:
+            print('Error while compiling the runtime object "%s"' % obj)
+            os.remove(temp_obj)
+            return None
+
+        os.replace(temp_obj, obj)
+    except BaseException:
+        if os.path.exists(temp_obj):
+            os.remove(temp_obj)
+        raise
+
+    return obj
+
+
+def open_code(toolchain, code_model, target, objects, keep_ir=None, jobs=1,
+              unit_dir=None):
+    """Open Code
+
+    Opens the destination of the generated code. Code which is neither kept
+    nor split is streamed to a C compiler started now, in a process group of
+    its own so it can be stopped as a whole.
+
+    Arguments:
+        toolchain: The Toolchain object building the generated code.
+        code_model: The target code model, '32' or '64'.
+        target: The destination binary executable file.
+        objects: The object files linked with the program.
+        keep_ir: The path to write the generated code to, or None.
+            (Default: None)
+        jobs: The number of translation units the code is split into.
+            (Default: 1)
+        unit_dir: The directory to make the private directory of split units
+            in, or None for the system default. (Default: None)
+
+    Returns:
+        A (code path, process, work directory) tuple. The code path is the
+        destination file path or the stdin stream of the C compiler, the
+        process the Popen object of the C compiler or None, and the work
+        directory the private directory of split units or None.
+    """
+    if keep_ir is not None:
+        return keep_ir, None, None
+
+    if jobs > 1:
+        import tempfile
+
+        # Split units are files, kept in a private directory
+        work_dir = tempfile.mkdtemp(prefix='compiler-', dir=unit_dir)
+
+        return os.path.join(work_dir, 'ir.c'), None, work_dir
+
+    gcc_cmd = toolchain.compile_command(code_model, [STDIN] + objects,
+                                        target)
+    process = subprocess.Popen(gcc_cmd, stdin=subprocess.PIPE, text=True,
+                               start_new_session=True)
+
+    return process.stdin, process, None
+
+
+def compile_units(paths, code_model, jobs, toolchain, reuse=False):
+    """Compile Units
+
+    Compiles each translation unit to an object next to it, running up to
+    the given number of gcc processes at once.
+
+    Arguments:
+        paths: The paths of the C files of the translation units.
+        code_model: The target code model, '32' or '64'.
+        jobs: The number of gcc processes to run at once.
+        toolchain: The Toolchain object building the program.
+        reuse: If True, an object newer than its unit and the unit header is
+            kept instead of compiled again. (Default: False)
+
+    Returns:
+        The list of object file paths, or None if a unit could not be
+        compiled.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    objects = [os.path.splitext(path)[0] + '.o' for path in paths]
+    header = os.path.splitext(paths[0])[0] + '.h'
+
+    def compile_unit(unit):
+        path, obj = unit
+
+        if reuse:
+            try:
+                if os.stat(obj).st_mtime_ns > max(
+                        os.stat(path).st_mtime_ns,
+                        os.stat(header).st_mtime_ns):
+                    return 0
+            except OSError:
+                pass
+
+        return subprocess.call(toolchain.object_command(code_model, path,
+                                                        obj))
+
+    # Each thread only waits on its gcc process
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        results = list(executor.map(compile_unit, zip(paths, objects)))
+
+    for path, result in zip(paths, results):
+        if result != 0:
+            print('Error while compiling the translation unit "%s"' % path)
+            return None
+
+    return objects
+
+
+def update_units(paths, unit_dir):
+    """Update Units
+
+    Moves newly written translation units and their header into a directory
+    kept between compiles. Only the files whose code changed are replaced,
+    so the objects of the other units stay newer than their code and are
+    reused by compile_units().
+
+    Arguments:
+        paths: The paths of the C files of the translation units, on the
+            file system of the directory.
+        unit_dir: The directory kept between compiles.
+
+    Returns:
+        The list of the paths of the units in the directory, or None if they
+        could not be moved.
+    """
+    header = os.path.splitext(paths[0])[0] + '.h'
+    kept = []
+
+    for path in paths + [header]:
+        kept_path = os.path.join(unit_dir, os.path.basename(path))
+
+        try:
+            with open(path, 'rb') as new, open(kept_path, 'rb') as old:
+                unchanged = new.read() == old.read()
+        except IOError:
+            unchanged = False
+
+        try:
+            if not unchanged:
+                os.replace(path, kept_path)
+        except OSError as e:
+            print('Error: "%s"' % kept_path)
+            print('    Could not write to destination file: %s' % e.strerror)
+            return None
+
+        kept.append(kept_path)
+
+    return kept[:-1]
+
+
+def finish_stream(process):
+    """Finish Stream
+
+    Closes the stdin stream of a C compiler reading the generated code and
+    waits for it to exit.
+
+    Arguments:
+        process: The Popen object of the C compiler.
+
+    Returns:
+        True if the C compiler succeeded, False otherwise.
+    """
+    # The C compiler may already have exited on an error
+    try:
+        process.stdin.close()
+    except BrokenPipeError:
+        pass
+
+    return process.wait() == 0
+
+
+def compile_code(toolchain, code_model, target, code_path, unit_paths,
+                 objects, jobs=1, reuse=False):
+    """Compile Code
+
+    Builds a program from generated code written to files. Split units are
+    compiled to objects first and then linked to the target location.
+
+    Arguments:
+        toolchain: The Toolchain object building the generated code.
+        code_model: The target code model, '32' or '64'.
+        target: The destination binary executable file.
+        code_path: The path of the C file of unsplit code.
+        unit_paths: The paths of the C files of split units.
+        objects: The object files linked with the program.
+        jobs: The number of units the code is split into. (Default: 1)
+        reuse: If True, the objects of units which did not change are reused
+            (see compile_units()). (Default: False)
+
+    Returns:
+        True if the program was built, False otherwise.
+    """
+    if jobs > 1:
+        unit_objects = compile_units(unit_paths, code_model, jobs, toolchain,
+                                     reuse)
+
+        if unit_objects is None:
+            return False
+
+        return subprocess.call(toolchain.link_command(
+            code_model, unit_objects + objects, target)) == 0
+
+    return subprocess.call(toolchain.compile_command(
+        code_model, [code_path] + objects, target)) == 0
+
+
+def close_code(process, work_dir):
+    """Close Code
+
+    Stops a C compiler still reading the code, which was given no complete
+    program, and removes the private directory of split units.
+
+    Arguments:
+        process: The Popen object of the C compiler, or None.
+        work_dir: The private directory of split units, or None.
+    """
+    if process is not None and process.returncode is None:
+        import signal
+
+        os.killpg(process.pid, signal.SIGKILL)
+        finish_stream(process)
+
+    if work_dir is not None:
+        import shutil
+
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    return
+
+
+def run_compiler(source, target, debug=False, peephole=False, stats=False,
+                 ir_opt=False, dump_ir=False, code_model='32',
+                 call_model='goto', inline=False,
+                 inline_budget=DEFAULT_BUDGET, io='stdio', io_object=False,
+                 memory=DEFAULT_MEMORY, jobs=1, toolchain=None,
+                 keep_ir=None, pending=None, cache=None, unit_dir=None,
+                 time_report=None):
+    """Run Compiler
+
+    Executes the compilation process given a source file path. The
+    generated C code is streamed to the C compiler as it is written, unless
+    it is kept in a file or split into translation units. With a build
+    cache, a cached program is copied to the target, or else cached code is
+    compiled without parsing the source, and the results of a build are
+    stored.
+
+    Arguments:
+        source: The source file to compile.
+        target: The destination binary executable file.
+        debug: If True, verbose parsing details are shown. (Default: False)
+        peephole: If True, the peephole optimizer is run on the generated
+            code. (Default: False)
+        stats: If True, optimization statistics are printed. (Default: False)
+        ir_opt: If True, the IR optimization passes are run before the IR is
+            lowered to C. (Default: False)
+        dump_ir: If True, the program IR is printed. (Default: False)
+        code_model: The target code model, '32' or '64'. The 64-bit model
+            does not require 32-bit multilib support. (Default: '32')
+        call_model: The procedure call model, 'goto' (one C function using
+            labels as values) or 'native' (one C function per procedure).
+            (Default: 'goto')
+        inline: If True, small non-recursive procedures are inlined into
+            their call sites. (Default: False)
+        inline_budget: The maximum number of IR instructions of an inlined
+            procedure body. (Default: DEFAULT_BUDGET)
+        io: The I/O layer of the runtime routines, 'stdio' or 'buffered'.
+            (Default: 'stdio')
+        io_object: If True, the buffered I/O layer is linked as a separate
+            precompiled object instead of being included in the generated
+            code. (Default: False)
+        memory: The default number of main memory cells of the program.
+            (Default: DEFAULT_MEMORY)
+        jobs: The number of translation units the code is split into and
+            compiled in parallel. More than one requires the native call
+            model. (Default: 1)
+        toolchain: The Toolchain object building the generated code, or None
+            for $CC or gcc with no extra flags. (Default: None)
+        keep_ir: The path to write the generated C code to, which is then
+            compiled from that file. Split units are written next to it. If
+            None, no code is left behind. (Default: None)
+        pending: A list which a function finishing the compile is
+            appended to once the code is streamed to the C compiler, instead
+            of the C compiler being waited for. The caller must then call it,
+            it returns True if the C compiler succeeded. (Default: None)
+        cache: The BuildCache object to use, or None. (Default: None)
+        unit_dir: A directory kept between compiles for split units which are
+            not kept with keep_ir. The object of a unit whose code did not
+            change since an earlier compile is reused. (Default: None)
+        time_report: The TimeReport object recording the phases of the
+            compile, or None. (Default: None)
+
+    Returns:
+        True on success, False otherwise.
+    """
+    if toolchain is None:
+        toolchain = Toolchain()
+
+    if time_report is not None:
+        phase = time_report.phase
+    else:
+        from contextlib import nullcontext
+
+        def phase(name, children=False):
+            return nullcontext()
+
+    # Make sure the C compiler can build the program before parsing it
+    with phase('setup'):
+        error = toolchain.check(code_model)
+
+    if error is not None:
+        print('Error: %s' % error)
+        return False
+
+    io_object = io_object and io == 'buffered'
+    parser = make_parser(debug, peephole, ir_opt, code_model, call_model,
+                         inline, inline_budget, io, io_object, memory, jobs)
+
+    if time_report is not None:
+        time_report.instrument(parser)
+
+    # The keys of the generated code and of the program in the build cache
+    keys = None
+    source_text = None
+
+    if cache is not None:
+        data, source_text = read_source(source)
+
+    if source_text is not None:
+        keys = cache_keys(cache, data, toolchain, dict(
+            debug=debug, peephole=peephole, ir_opt=ir_opt,
+            code_model=code_model, call_model=call_model, inline=inline,
+            inline_budget=inline_budget, io=io, io_object=io_object,
+            memory=memory, units=jobs,
+            name=os.path.basename(keep_ir or 'ir.c') if jobs > 1 else None))
+
+    # Code is only reused if it need not be inspected. The warnings of the
+    # parse are stored with it and printed again on a hit
+    cached_code = None
+    messages = None
+
+    if keys is not None and not dump_ir:
+        if keep_ir is None and fetch_program(cache, keys, target):
+            if stats:
+                print('Build cache: program hit')
+
+            return True
+
+        cached = cache.get_code(keys[0])
+
+        if cached is not None:
+            cached_code, messages = cached
+
+    # The runtime object is linked by every C compilation command
+    objects = []
+
+    if io_object:
+        with phase('setup', children=True):
+            runtime_obj = build_runtime_object(code_model, toolchain)
+
+        if runtime_obj is None:
+            return False
+
+        objects.append(runtime_obj)
+
+    code_path, process, work_dir = open_code(toolchain, code_model, target,
+                                             objects, keep_ir, jobs,
+                                             unit_dir)
+
+    # Keep a copy of the streamed code for the build cache
+    if process is not None and keys is not None and cached_code is None:
+        code_path = TeeStream(code_path)
+
+    try:
+        if cached_code is not None:
+            # Write the cached code in place of parsing the source file
+            print_messages(messages)
+            unit_paths = write_units(cached_code, code_path)
+
+            if unit_paths is None:
+                print('Error while compiling "%s"' % target)
+                return False
+
+            if stats:
+                print('Build cache: generated code hit')
+        else:
+            unit_paths = generate_code(parser, source, source_text,
+                                       code_path, target, process)
+
+            if unit_paths is None:
+                return False
+
+            messages = parser.printed
+
+            if time_report is not None:
+                time_report.count_code(parser)
+
+        # Read back the code to cache before any private files are removed
+        units = cached_code
+
+        if keys is not None and units is None:
+            units = read_units(code_path, unit_paths, jobs > 1)
+
+        # Only the changed units replace those of an earlier compile
+        reuse = unit_dir is not None and work_dir is not None
+
+        if reuse:
+            unit_paths = update_units(unit_paths, unit_dir)
+
+            if unit_paths is None:
+                return False
+
+        def store():
+            if keys is not None:
+                store_build(cache, keys, units, messages, target,
+                            cached_code is None)
+
+            return
+
+        if dump_ir:
+            print(parser.dump_ir())
+
+        if stats:
+            report_stats(parser, toolchain, cached_code is None)
+
+        if process is not None:
+            def finish(process=process):
+                compiled = finish_stream(process)
+
+                if compiled:
+                    store()
+
+                return compiled
+
+            if pending is not None:
+                pending.append(finish)
+                process = None
+                compiled = True
+            else:
+                with phase('gcc', children=True):
+                    compiled = finish()
+        else:
+            with phase('gcc', children=True):
+                compiled = compile_code(toolchain, code_model, target,
+                                        code_path, unit_paths, objects,
+                                        jobs, reuse)
+
+            if compiled:
+                store()
+    finally:
+        close_code(process, work_dir)
+
+    if not compiled:
+        print('Error while compiling "%s"' % target)
+        return False
+
+    return True
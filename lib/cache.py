@@ -0,0 +1,547 @@
+#!/usr/bin/env python3
+
+"""Cache module
+
+Provides a content addressed cache of build results shared by every compile
+of a user. A build is cached in two stages with separate keys:
+
+    code:   the generated C files and the warnings printed while generating
+            them, keyed on the source bytes, the compiler itself (its modules
+            and runtime sources) and the options which change the generated
+            code.
+    binary: the final program, keyed on the code key and the identity of the
+            C toolchain (compiler executable and every flag).
+
+So an unchanged source built with new C flags skips straight to the C
+compiler, and an unchanged build is just copied.
+
+Entries are written to a private temporary file and renamed into place, so
+concurrent builds only ever see complete entries. Reading an entry marks it
+as recently used, and once the cache grows past its size cap the least
+recently used entries are removed. Hit and miss counts are kept in the cache
+directory, updated under a file lock.
+
+Author: Evan Sneath
+License: Open Software License v3.0
+
+Classes:
+    BuildCache: A content addressed cache of generated code and programs.
+
+Functions:
+    compiler_files: Returns the modules and runtime sources of the compiler.
+    compiler_digest: Hashes the modules and runtime sources of the compiler.
+"""
+
+import fcntl
+import json
+import os
+import tempfile
+
+from lib.toolchain import DEFAULT_CACHE_DIR, DEFAULT_CACHE_SIZE
+
+
+"""The version of the layout of cache entries, part of every key."""
+CACHE_VERSION = 2
+
+"""The stages of a build which are cached."""
+STAGES = ['code', 'binary']
+
+"""The fraction of the size cap the cache is trimmed to on eviction."""
+EVICT_TO = 0.8
+
+"""The prefix of the temporary files of entries and statistics being
+written."""
+TEMP_PREFIX = '.tmp_'
+
+"""The prefix of the temporary file of a program being copied to its
+target."""
+COPY_PREFIX = '.cache_'
+
+# Holds the digest of the compiler once computed
+_compiler_digest = None
+
+
+def compiler_files():
+    """Compiler Files
+
+    Returns:
+        The sorted paths of every module and runtime source of the compiler,
+        or the path of the zipapp the compiler is run from (see
+        tools/buildzipapp.py), which holds all of them.
+    """
+    archive = getattr(__loader__, 'archive', None)
+
+    if archive is not None:
+        return [archive]
+
+    root = os.path.dirname(os.path.abspath(__file__))
+    paths = []
+
+    for directory, dirs, files in sorted(os.walk(root)):
+        dirs[:] = sorted(d for d in dirs if d != '__pycache__')
+
+        paths.extend(os.path.join(directory, name) for name in sorted(files)
+                     if name.endswith(('.py', '.c', '.h')))
+
+    return paths
+
+
+def compiler_digest():
+    """Compiler Digest
+
+    Hashes every module and runtime source of the compiler, so a changed
+    compiler never reuses code generated by an older one.
+
+    Returns:
+        The hex digest of the compiler files.
+    """
+    global _compiler_digest
+
+    # Only a compile using the cache hashes anything
+    import hashlib
+
+    if _compiler_digest is None:
+        root = os.path.dirname(os.path.abspath(__file__))
+        digest = hashlib.sha256()
+
+        for path in compiler_files():
+            digest.update(os.path.relpath(path, root).encode())
+
+            with open(path, 'rb') as f:
+                digest.update(f.read())
+
+        _compiler_digest = digest.hexdigest()
+
+    return _compiler_digest
+
+
+def _remove_temp(path):
+    """Remove Temporary File (Protected)
+
+    Removes the temporary file of a write which failed, if it is still there.
+
+    Arguments:
+        path: The path of the temporary file.
+    """
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+    return
+
+
+class BuildCache:
+    """BuildCache class
+
+    A content addressed cache of the generated code and the programs of
+    builds, with a size cap and least recently used eviction.
+
+    Attributes:
+        path: The directory of the cache.
+        max_size: The size cap of the cache in bytes.
+
+    Methods:
+        code_key: Computes the key of the generated code of a source.
+        binary_key: Computes the key of the program built from some code.
+        get_code: Looks up cached generated code.
+        get_messages: Looks up the warnings of cached generated code.
+        put_code: Stores generated code.
+        get_binary: Copies a cached program to its target path.
+        put_binary: Stores a program.
+        stats: Returns the statistics of the whole cache.
+        report: Formats the statistics for display.
+    """
+    def __init__(self, path=DEFAULT_CACHE_DIR, max_size=DEFAULT_CACHE_SIZE):
+        super().__init__()
+
+        self.path = path
+        self.max_size = max_size
+
+        return
+
+    def code_key(self, data, options):
+        """Code Key
+
+        Arguments:
+            data: The bytes of the source. The code stored under the key must
+                be generated from these bytes, not from the file read again.
+            options: A dictionary of the options which change the generated
+                code.
+
+        Returns:
+            The key of the generated code.
+        """
+        import hashlib
+
+        digest = hashlib.sha256()
+        digest.update(json.dumps([CACHE_VERSION, compiler_digest(), options],
+                                 sort_keys=True).encode())
+        digest.update(data)
+
+        return digest.hexdigest()
+
+    def binary_key(self, code_key, toolchain):
+        """Binary Key
+
+        Arguments:
+            code_key: The key of the generated code.
+            toolchain: The identity string of the C toolchain and any other
+                option which changes how the code is built.
+
+        Returns:
+            The key of the program.
+        """
+        import hashlib
+
+        return hashlib.sha256(json.dumps([CACHE_VERSION, code_key,
+                                          toolchain]).encode()).hexdigest()
+
+    def get_code(self, key):
+        """Get Code
+
+        Arguments:
+            key: The key of the generated code.
+
+        Returns:
+            A (units, messages) tuple, or None on a miss. Units is a list of
+            (file name, code) tuples, the main unit first, and messages the
+            list of warnings printed while generating the code.
+        """
+        data = self._read('code', key)
+
+        if data is None:
+            return None
+
+        entry = json.loads(data.decode())
+
+        return [tuple(unit) for unit in entry['units']], entry['messages']
+
+    def get_messages(self, key):
+        """Get Messages
+
+        Looks up the warnings of cached generated code, without counting a
+        hit or a miss of the code, for a program built from it.
+
+        Arguments:
+            key: The key of the generated code.
+
+        Returns:
+            The list of warnings printed while generating the code, or None
+            if the code is not cached.
+        """
+        data = self._read('code', key, count=False)
+
+        return json.loads(data.decode())['messages'] \
+            if data is not None else None
+
+    def put_code(self, key, units, messages):
+        """Put Code
+
+        Arguments:
+            key: The key of the generated code.
+            units: A list of (file name, code) tuples, the main unit first.
+            messages: The list of warnings printed while generating the code.
+        """
+        self._write('code', key, json.dumps({'units': units,
+                                             'messages': messages}).encode())
+
+        return
+
+    def get_binary(self, key, target):
+        """Get Binary
+
+        Copies a cached program to its target path. The target is replaced
+        in one step, so it is never seen partly written.
+
+        Arguments:
+            key: The key of the program.
+            target: The path to copy the program to.
+
+        Returns:
+            True on a hit, False on a miss.
+        """
+        data = self._read('binary', key)
+
+        if data is None:
+            return False
+
+        directory = os.path.dirname(os.path.abspath(target))
+        fd, temp_path = tempfile.mkstemp(prefix=COPY_PREFIX, dir=directory)
+
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+
+            umask = os.umask(0)
+            os.umask(umask)
+            os.chmod(temp_path, 0o777 & ~umask)
+            os.replace(temp_path, target)
+        except BaseException:
+            _remove_temp(temp_path)
+            raise
+
+        return True
+
+    def put_binary(self, key, target):
+        """Put Binary
+
+        Arguments:
+            key: The key of the program.
+            target: The path of the program to store.
+        """
+        with open(target, 'rb') as f:
+            self._write('binary', key, f.read())
+
+        return
+
+    def stats(self):
+        """Get Statistics
+
+        Returns:
+            A dictionary of the 'hits' and 'misses' by stage, 'stores',
+            'evictions' and 'size' in bytes of the whole cache.
+        """
+        with self._locked():
+            return self._load_stats()
+
+    def report(self, since=None):
+        """Report Statistics
+
+        Arguments:
+            since: The stats() of the cache at the start of this run, or None.
+                (Default: None)
+
+        Returns:
+            A multi-line string of the statistics of the whole cache, and of
+            this run if given where it started.
+        """
+        stats = self.stats()
+        lines = ['Build cache (%s):' % self.path]
+
+        for stage in STAGES:
+            line = '    %-8s %d hits, %d misses' % (
+                stage, stats['hits'][stage], stats['misses'][stage])
+
+            if since is not None:
+                line += ' (this run %d hits, %d misses)' % (
+                    stats['hits'][stage] - since['hits'][stage],
+                    stats['misses'][stage] - since['misses'][stage])
+
+            lines.append(line)
+
+        lines.append('    size %.1f of %.1f MiB, %d stores, %d evictions' %
+                     (stats['size'] / 2.0**20, self.max_size / 2.0**20,
+                      stats['stores'], stats['evictions']))
+
+        return '\n'.join(lines)
+
+    def _entry_path(self, stage, key):
+        """Entry Path (Protected)
+
+        Returns:
+            The path of the entry of a key in a stage.
+        """
+        return os.path.join(self.path, stage, key[:2], key)
+
+    def _read(self, stage, key, count=True):
+        """Read Entry (Protected)
+
+        Reads an entry and marks it as recently used. The cache is trimmed
+        if it is over its cap. If count is False, the read is not counted as
+        a hit or a miss.
+
+        Returns:
+            The bytes of the entry, or None on a miss.
+        """
+        path = self._entry_path(stage, key)
+
+        # An entry may be evicted at any time, which is only a miss
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+
+            os.utime(path)
+        except OSError:
+            data = None
+
+        if not count:
+            return data
+
+        # The statistics are not worth failing a build over
+        try:
+            with self._locked():
+                stats = self._load_stats()
+                counts = stats['hits'] if data is not None else \
+                    stats['misses']
+                counts[stage] += 1
+
+                # A smaller cap than the cache was filled with applies now
+                if stats['size'] > self.max_size:
+                    self._evict(stats)
+
+                self._save_stats(stats)
+        except OSError:
+            pass
+
+        return data
+
+    def _write(self, stage, key, data):
+        """Write Entry (Protected)
+
+        Writes an entry to a private file and renames it into place, then
+        evicts the least recently used entries if the cache is over its cap.
+        """
+        path = self._entry_path(stage, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        fd, temp_path = tempfile.mkstemp(prefix=TEMP_PREFIX,
+                                         dir=os.path.dirname(path))
+
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+
+            # The entry replaced by a concurrent store of the same key is not
+            # counted twice
+            with self._locked():
+                try:
+                    replaced = os.stat(path).st_size
+                except OSError:
+                    replaced = 0
+
+                os.replace(temp_path, path)
+
+                stats = self._load_stats()
+                stats['stores'] += 1
+                stats['size'] += len(data) - replaced
+
+                if stats['size'] > self.max_size:
+                    self._evict(stats)
+
+                self._save_stats(stats)
+        except BaseException:
+            _remove_temp(temp_path)
+            raise
+
+        return
+
+    def _evict(self, stats):
+        """Evict Entries (Protected)
+
+        Removes the least recently used entries until the cache is trimmed
+        to EVICT_TO of its cap, and recounts its size. The temporary files
+        of stores still being written are neither counted nor removed. Must
+        be called with the lock held.
+        """
+        entries = []
+
+        for stage in STAGES:
+            for directory, _, files in os.walk(os.path.join(self.path,
+                                                            stage)):
+                for name in files:
+                    if name.startswith((TEMP_PREFIX, COPY_PREFIX)):
+                        continue
+
+                    path = os.path.join(directory, name)
+
+                    try:
+                        stat = os.stat(path)
+                    except OSError:
+                        continue
+
+                    entries.append((stat.st_mtime, stat.st_size, path))
+
+        entries.sort()
+        size = sum(entry[1] for entry in entries)
+
+        for _, entry_size, path in entries:
+            if size <= self.max_size * EVICT_TO:
+                break
+
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+
+            size -= entry_size
+            stats['evictions'] += 1
+
+        stats['size'] = size
+
+        return
+
+    def _locked(self):
+        """Lock Cache (Protected)
+
+        Returns:
+            A context manager holding the cache lock, which serializes the
+            updates of the statistics and evictions between processes.
+        """
+        os.makedirs(self.path, exist_ok=True)
+
+        return _FileLock(os.path.join(self.path, 'lock'))
+
+    def _load_stats(self):
+        """Load Statistics (Protected)
+
+        Returns:
+            The statistics dictionary of the cache.
+        """
+        stats = {'hits': dict((stage, 0) for stage in STAGES),
+                 'misses': dict((stage, 0) for stage in STAGES),
+                 'stores': 0, 'evictions': 0, 'size': 0}
+
+        try:
+            with open(os.path.join(self.path, 'stats.json')) as f:
+                stats.update(json.load(f))
+        except (OSError, ValueError):
+            pass
+
+        return stats
+
+    def _save_stats(self, stats):
+        """Save Statistics (Protected)
+
+        Arguments:
+            stats: The statistics dictionary of the cache.
+        """
+        path = os.path.join(self.path, 'stats.json')
+        fd, temp_path = tempfile.mkstemp(prefix=TEMP_PREFIX, dir=self.path)
+
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(stats, f, sort_keys=True)
+
+            os.replace(temp_path, path)
+        except BaseException:
+            _remove_temp(temp_path)
+            raise
+
+        return
+
+
+class _FileLock:
+    """_FileLock class
+
+    A context manager holding an exclusive lock on a file.
+    """
+    def __init__(self, path):
+        super().__init__()
+
+        self._path = path
+        self._fd = None
+
+        return
+
+    def __enter__(self):
+        self._fd = os.open(self._path, os.O_RDWR | os.O_CREAT, 0o644)
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+
+        return self
+
+    def __exit__(self, *exc):
+        fcntl.flock(self._fd, fcntl.LOCK_UN)
+        os.close(self._fd)
+
+        return False
@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+
+"""Client module
+
+Sends compiles to a running compile server (see server.py) over a Unix domain
+socket. This module is imported by the command line interface before any
+other part of the compiler, so it only uses a few standard modules: a compile
+handed to a server saves the client every other import. The modules talking
+to a server are only imported once a server is found, so a compile run by
+the command line itself does not import them.
+
+A request is one line of JSON sent by the client, answered by one line of
+JSON from the server:
+
+    request:  {"version": 1, "args": [...], "cwd": "...", "cc": "gcc"}
+    response: {"status": 0, "output": "..."} or {"error": "..."}
+
+The arguments are those of the command line, run by the server in the
+working directory of the client. The output is everything the compile
+printed, its C compiler included, and the status its exit status.
+
+A request may instead carry source text, such as the unsaved buffer of an
+editor, which is compiled to C code in memory (see api.py) without running
+the C compiler:
+
+    request:  {"version": 1, "source": "...", "name": "...", "options": {}}
+    response: {"status": 0, "code": "...", "diagnostics": [{...}, ...]}
+
+The options are keyword arguments of api.compile_source(), the code is null
+if the compile failed, and each diagnostic has the fields of a Diagnostic.
+
+Author: Evan Sneath
+License: Open Software License v3.0
+
+Functions:
+    socket_option: Finds the socket path given on a command line.
+    request: Sends a compile request to a compile server.
+    request_source: Sends source text to compile to a compile server.
+    run_client: Runs a command line on a compile server.
+"""
+
+import os
+import sys
+
+
+"""The version of the request and response format."""
+PROTOCOL_VERSION = 1
+
+"""The default path of the socket of the compile server."""
+DEFAULT_SOCKET = os.path.join(
+    os.environ.get('XDG_RUNTIME_DIR') or '/tmp',
+    'evansneath-compiler-%d.sock' % os.getuid())
+
+"""The number of seconds to wait for a compile server to accept."""
+CONNECT_TIMEOUT = 1.0
+
+
+def socket_option(argv):
+    """Socket Option
+
+    Arguments:
+        argv: The list of command line arguments.
+
+    Returns:
+        The socket path given by --socket, or DEFAULT_SOCKET.
+    """
+    path = DEFAULT_SOCKET
+
+    for index, arg in enumerate(argv):
+        if arg == '--socket' and index + 1 < len(argv):
+            path = argv[index + 1]
+        elif arg.startswith('--socket='):
+            path = arg[len('--socket='):]
+
+    return path
+
+
+def request(path, args, cwd=None, cc=None):
+    """Request Compile
+
+    Sends a compile request to a compile server and waits for its response.
+
+    Arguments:
+        path: The path of the socket of the server.
+        args: The list of command line arguments of the compile.
+        cwd: The working directory of the compile, or None for the current
+            one. (Default: None)
+        cc: The C compiler to use when the arguments name none, or None for
+            that of the server. (Default: None)
+
+    Returns:
+        The response dictionary, or None if no server answered. A server
+        owned by another user is never used.
+    """
+    return _send(path, {'version': PROTOCOL_VERSION, 'args': list(args),
+                        'cwd': cwd or os.getcwd(), 'cc': cc})
+
+
+def request_source(path, source, name='<source>', options=None):
+    """Request Source Compile
+
+    Sends source text to a compile server to compile to C code in memory,
+    and waits for its response.
+
+    Arguments:
+        path: The path of the socket of the server.
+        source: The source code string.
+        name: The name of the source in diagnostics. (Default: '<source>')
+        options: A dictionary of keyword arguments of api.compile_source(),
+            or None. (Default: None)
+
+    Returns:
+        The response dictionary, or None if no server answered. A server
+        owned by another user is never used.
+    """
+    return _send(path, {'version': PROTOCOL_VERSION, 'source': source,
+                        'name': name, 'options': options or {}})
+
+
+def _send(path, message):
+    """Send Request (Protected)
+
+    Arguments:
+        path: The path of the socket of the server.
+        message: The request dictionary.
+
+    Returns:
+        The response dictionary, or None if no server answered or the server
+        is owned by another user.
+    """
+    try:
+        if os.stat(path).st_uid != os.getuid():
+            return None
+    except OSError:
+        return None
+
+    import json
+    import socket
+
+    message = json.dumps(message)
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+
+    try:
+        sock.settimeout(CONNECT_TIMEOUT)
+        sock.connect(path)
+
+        # A compile may take any time once it has been accepted
+        sock.settimeout(None)
+        sock.sendall(message.encode() + b'\n')
+
+        with sock.makefile('rb') as f:
+            line = f.readline()
+    except OSError:
+        return None
+    finally:
+        sock.close()
+
+    try:
+        response = json.loads(line.decode())
+    except ValueError:
+        return None
+
+    return response if isinstance(response, dict) else None
+
+
+def run_client(argv):
+    """Run Client
+
+    Runs a command line on the compile server if it asks for one with
+    --client and a server answers.
+
+    Arguments:
+        argv: The list of command line arguments.
+
+    Returns:
+        The exit status of the compile, or None if it must be run in this
+        process instead.
+    """
+    # Invalid combinations are reported by the compiler itself, and programs
+    # are never run by the server
+    if '--client' not in argv or '--serve' in argv or '--watch' in argv or \
+            argv[:1] == ['run']:
+        return None
+
+    response = request(socket_option(argv), argv,
+                       cc=os.environ.get('CC'))
+
+    if response is None:
+        return None
+
+    if 'error' in response:
+        sys.stderr.write('Warning: compile server: %s, compiling in this '
+                         'process\n' % response['error'])
+        return None
+
+    sys.stdout.write(response.get('output', ''))
+    sys.stdout.flush()
+
+    return response.get('status', 1)
@@ -2,15 +2,157 @@
 
 """CodeGenerator module
 
-Provides functionality for code output to a attached destination file.
+Provides functionality for code output to a attached destination file. Code
+is generated as three-address IR (see the ir module) which is lowered to C
+when the destination file is committed.
 
 Author: Evan Sneath
 License: Open Software License v3.0
 
 Classes:
     CodeGenerator: A code generator interface for destination file outputting.
+
+Functions:
+    runtime_path: Returns the path of a runtime source for the C compiler.
 """
 
+import os
+import re
+
+from lib import ir
+
+"""The directory holding the C sources of the buffered runtime I/O layer."""
+RUNTIME_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                           'runtime')
+
+"""The default number of main memory cells, mapped when a program starts."""
+DEFAULT_MEMORY = 16 * 2**20
+
+"""The default maximum number of instructions in an inlined procedure body."""
+DEFAULT_BUDGET = 24
+
+"""The first line of the C function of a natively called procedure."""
+NATIVE_HEADER = re.compile(r'^(?:static )?void \w+\(cell fp\)\n\{$')
+
+"""A register or float register operand of the lowered C code."""
+REGISTER_OPERAND = re.compile(r'\bR(F?)\[(\d+|FP)\]')
+
+"""Stack allocations of at least this many cells are checked for overflow."""
+CHECKED_ALLOC = 256
+
+"""The body of each runtime routine. ARG is replaced by the param cell."""
+RUNTIME_ROUTINES = [
+    ('putString', [
+        'R[0] = ARG;',
+        'printf("%s\\n", (char*)R[0]);',
+    ]),
+    ('getString', [
+        'fgets(STR_BUF, BUF_SIZE, stdin);',
+        'ARG = sh_store(STR_BUF, &R[HP], R[SP]);',
+    ]),
+    ('putBool', [
+        'R[0] = ARG;',
+        'printf("%s\\n", R[0] ? "true" : "false");',
+    ]),
+    ('getBool', [
+        'scanf("%d", &INT_BUF);',
+        'R[0] = INT_BUF ? 1 : 0;',
+        'ARG = R[0];',
+    ]),
+    ('putInteger', [
+        'R[0] = ARG;',
+        'printf("%d\\n", (int)R[0]);',
+    ]),
+    ('getInteger', [
+        'scanf("%d", &INT_BUF);',
+        'R[0] = INT_BUF;',
+        'ARG = R[0];',
+    ]),
+    ('putFloat', [
+        'R[0] = ARG;',
+        'printf("%g\\n", RF[0].f);',
+    ]),
+    ('getFloat', [
+        'scanf("%f", &RF[0].f);',
+        'ARG = R[0];',
+    ]),
+]
+
+"""The body of each runtime routine when the buffered I/O layer is used."""
+BUFFERED_RUNTIME_ROUTINES = [
+    ('putString', [
+        'rt_put_chars((char*)ARG, ((cell*)ARG)[-1]);',
+    ]),
+    ('getString', [
+        'rt_get_line(STR_BUF, BUF_SIZE);',
+        'ARG = sh_store(STR_BUF, &R[HP], R[SP]);',
+    ]),
+    ('putBool', [
+        'rt_put_bool(ARG ? 1 : 0);',
+    ]),
+    ('getBool', [
+        'rt_get_int(&INT_BUF);',
+        'R[0] = INT_BUF ? 1 : 0;',
+        'ARG = R[0];',
+    ]),
+    ('putInteger', [
+        'rt_put_int((int)ARG);',
+    ]),
+    ('getInteger', [
+        'rt_get_int(&INT_BUF);',
+        'ARG = INT_BUF;',
+    ]),
+    ('putFloat', [
+        'R[0] = ARG;',
+        'rt_put_float(RF[0].f);',
+    ]),
+    ('getFloat', [
+        'rt_get_float(&RF[0].f);',
+        'ARG = R[0];',
+    ]),
+]
+
+# Holds the lines of each runtime source file once read, by name
+_runtime_files = {}
+
+
+def runtime_path(name):
+    """Runtime Path
+
+    Returns the path of a runtime source file for the C compiler. The files
+    of a compiler run from a zipapp are not on disk, so they are written out
+    once to a directory named after the compiler in the toolchain cache.
+
+    Arguments:
+        name: The name of a C file in RUNTIME_DIR.
+
+    Returns:
+        The path of the file.
+    """
+    path = os.path.join(RUNTIME_DIR, name)
+
+    if os.path.isfile(path):
+        return path
+
+    from lib.cache import compiler_digest
+    from lib.toolchain import CACHE_ROOT
+
+    directory = os.path.join(CACHE_ROOT, 'runtime-%s' %
+                             compiler_digest()[:16])
+    target = os.path.join(directory, name)
+
+    # Written to a private file and renamed, so no C compiler reads part of it
+    if not os.path.isfile(target):
+        os.makedirs(directory, exist_ok=True)
+        partial = '%s.%d' % (target, os.getpid())
+
+        with open(partial, 'wb') as f:
+            f.write(__loader__.get_data(path))
+
+        os.replace(partial, target)
+
+    return target
+
 
 class CodeGenerator:
     """CodeGenerator class
@@ -22,16 +164,48 @@ class CodeGenerator:
 
     Attributes:
         runtime_functions: Details of each runtime function and its params.
+        peephole: A PeepholeOptimizer object run over the generated code
+            before it is committed. If None, no optimization is performed.
+        inliner: An Inliner object run over the generated IR before the IR
+            passes. If None, no procedures are inlined.
+        pass_manager: A PassManager object run over the generated IR before
+            it is lowered to C. If None, no IR passes are run.
+        target: The code model of the generated code. Either '32' (memory
+            cells are 'int') or '64' (memory cells are 'intptr_t'). Integer
+            values keep 32-bit semantics on both targets.
+        call_model: The procedure call model of the generated code. Either
+            'goto' (all code in main, calls by labels as values) or 'native'
+            (each procedure is a C function taking its frame pointer, with
+            its registers as C locals).
+        memory: The default number of main memory cells. A program may be
+            run with a different size set in the MM_CELLS environment
+            variable.
+        io: The I/O layer of the runtime routines. Either 'stdio' (printf
+            and scanf) or 'buffered' (the rtio layer in RUNTIME_DIR).
+        io_object: If True, the buffered I/O layer is only declared in the
+            generated code and must be linked as a separate object.
+        units: The number of C translation units the code is split into.
+            More than one requires the native call model. The main unit
+            holds the machine state, runtime and program entry point, the
+            others hold procedures, and all of them include a shared header.
+        unit_paths: The paths of the C files written by the last commit,
+            the main unit first. Empty if the code was written to a stream.
+        reachability: A dictionary of (emitted, eliminated) counts of the
+            'procedures' and 'runtime' routines after the last commit.
 
     Methods:
         attach_destination: Binds a destination file to the code generator.
         generate_header: Generates overhead code (memory allocation, etc).
         generate_footer: Generates finishing overhead code.
-        generate: Formats and stores a given string of code for later output.
+        generate: Stores a given string of raw C code for later output.
         comment: Adds a comment to the generated code with appropriate tabbing.
         tab_push: Increases the tab depth by 1 tab (4 spaces).
         tab_pop: Decreases the tab depth by 1 tab (4 spaces).
         commit: Commits all code generation and writes to the destination file.
+        dump_ir: Formats the generated IR for debugging.
+        reachability_report: Formats the emitted and eliminated procedure
+            counts of the last commit.
+        code_counts: Counts the registers and labels of the last commit.
         get_mm: Provides a free memory space for global or local variables.
         reset_local_ptr: Resets the value for the local pointer to default.
         reset_param_ptr: Resets the value for the param pointer to default.
@@ -40,6 +214,9 @@ class CodeGenerator:
         get_unique_call_id: Returns a unique identifier for multiple calls.
         generate_program_entry: Generates all code associated with setting up
             the program entry and exit point.
+        generate_procedure_entry: Begins the code of a program or procedure
+            body and allocates its local variables.
+        generate_procedure_exit: Ends the code of a program or procedure body.
         generate_procedure_call: Generates all code associated with managing
             the memory stack during a procedure call.
         generate_procedure_call_end: Generates code to clean up a procedure
@@ -51,8 +228,13 @@ class CodeGenerator:
         generate_param_store: Generates code to save an outgoing parameter
             to an identifier located in main memory.
         generate_number: Generates the code for a number reference.
+        generate_string: Generates the code for a string literal reference.
         generate_return: Generates the code for the 'return' operation.
         generate_operation: Generates operation code given an operation.
+        generate_not: Generates the code for a bitwise 'not' operation.
+        generate_label: Generates a label for jumps within a procedure.
+        generate_jump: Generates an unconditional jump to a label.
+        generate_branch: Generates a jump to a label if a register is false.
     """
     def __init__(self):
         super().__init__()
@@ -60,11 +242,30 @@ class CodeGenerator:
         # Holds the file path of the attached destination file
         self._dest_path = ''
 
-        # Holds all generated code to be written to the file destination
-        self._generated_code = ''
+        # Holds all generated code to be written to the file destination as
+        # a list of (tabs, code) statements once the IR has been lowered
+        self._generated_code = []
+
+        # Holds the generated IR and the function currently being generated.
+        # The first function holds the header and the program entry point
+        self._program = ir.Program()
+        self._function = self._begin_function('main')
+
+        # Holds the optional inlining, IR and peephole optimization stages
+        self.inliner = None
+        self.pass_manager = None
+        self.peephole = None
+
+        # Holds the code model and call model of the generated code
+        self.target = '32'
+        self.call_model = 'goto'
+
+        # Holds the I/O layer of the runtime routines
+        self.io = 'stdio'
+        self.io_object = False
 
-        # Holds allocated size of main memory and num registers
-        self._mm_size = 65536
+        # Holds the default number of main memory cells and num registers
+        self.memory = DEFAULT_MEMORY
         self._reg_size = 2048
         self._buf_size = 256
 
@@ -95,6 +296,19 @@ class CodeGenerator:
         # Holds an integer to distinguish multiple calls of a function
         self._unique_id = 0
 
+        # Holds the names of the runtime routines emitted in the footer
+        self._runtime_names = []
+
+        # Holds the pool variable name of each distinct string literal
+        self._string_pool = {}
+
+        # Holds the procedure and runtime routine counts of the last commit
+        self.reachability = None
+
+        # Holds the number of translation units and the files last written
+        self.units = 1
+        self.unit_paths = []
+
         # Holds the details of the runtime functions
         self.runtime_functions = {
             'getString': [('my_string', 'string', 'out')],
@@ -113,14 +327,21 @@ class CodeGenerator:
         """Attach Destination
 
         Attaches a destination file to the code generator and prepares the
-        file for writing.
+        file for writing. The destination may also be an open text stream,
+        such as the stdin pipe of the C compiler, which the code is written
+        to as it is committed. Split translation units need a path.
 
         Arguments:
-            dest_path: The path to the destination file to write.
+            dest_path: The path to the destination file to write, or a
+                stream object with a write() method.
 
         Returns:
             True on success, False otherwise.
         """
+        if self.units > 1 and hasattr(dest_path, 'write'):
+            print('Error: translation units must be written to a file')
+            return False
+
         # The target file was attached, store the path
         self._dest_path = dest_path
 
@@ -129,13 +350,104 @@ class CodeGenerator:
     def generate_header(self):
         """Generate Code Header
 
-        Adds all header code to the generated code buffer.
+        Adds all header code to the generated code buffer. The header is
+        generated again on commit once the number of registers is known.
         """
-        code = [
+        self.generate('\n'.join(self._generate_header_code()), tabs=0)
+
+        return
+
+    def _generate_header_code(self):
+        """Generate Header Code (Protected)
+
+        Returns:
+            A list of lines of C code of the header.
+        """
+        if self.units > 1:
+            # The types and shared state are declared in the unit header
+            code = [
+                '#include "%s"' % os.path.basename(self._header_path()),
+                '',
+            ]
+        else:
+            code = self._generate_types()
+
+        # Main memory is mapped when the program starts and strings read at
+        # run time are kept in its heap
+        code.extend(self._read_runtime_file('mm.c'))
+        code.extend(self._read_runtime_file('strheap.c'))
+
+        if self.units == 1:
+            code.extend([
+                '#define MM_SIZE mm_size',
+                '',
+            ])
+
+        if self.io == 'buffered':
+            code.extend(self._generate_buffered_io())
+
+        # With native calls the machine state is shared by all C functions
+        storage = 'static ' if self.call_model == 'native' else ''
+
+        if self.call_model != 'native':
+            code.extend([
+                'int main(void)',
+                '{',
+            ])
+
+        if self.units > 1:
+            code.extend([
+                '// Allocate register space',
+                'union registers REGS;',
+                '',
+            ])
+        else:
+            code.extend([
+                '// Allocate register space. Registers holding floats are',
+                '// accessed through the RF view of the same storage',
+                '%sunion {' % storage,
+                '    cell i[R_SIZE];',
+                '    cell_bits f[R_SIZE];',
+                '} REGS;',
+                '#define R  REGS.i',
+                '#define RF REGS.f',
+                '',
+            ])
+
+        if self.call_model != 'native':
+            code.extend(self._generate_machine_setup())
+
+        code.extend([
+            '// Allocate space for a string and integer input buffer',
+            '%schar STR_BUF[BUF_SIZE];' % storage,
+            '%sint INT_BUF;' % storage,
+            '',
+        ])
+
+        code.extend([
+            '////////////////////////////////////////////////////',
+            '// PROGRAM START',
+            '',
+        ])
+
+        return code
+
+    def _generate_types(self):
+        """Generate Types (Protected)
+
+        Returns:
+            A list of lines of C code which include the standard headers and
+            define the machine constants and cell types.
+        """
+        # Memory cells must be wide enough to hold label and string pointers
+        cell_type = 'int' if self.target == '32' else 'intptr_t'
+
+        return [
+            '#include <stdint.h>',
             '#include <stdio.h>',
             '#include <string.h>',
             '',
-            '#define MM_SIZE  %d' % self._mm_size,
+            '#define MM_DEFAULT_SIZE %d' % self.memory,
             '#define R_SIZE   %d' % self._reg_size,
             '#define BUF_SIZE %d' % self._buf_size,
             '',
@@ -144,113 +456,140 @@ class CodeGenerator:
             '#define FP       %d' % self._FP,
             '#define HP       %d' % self._HP,
             '',
-            'int main(void)',
-            '{',
-            '// Allocate main memory and register space',
-            'int MM[MM_SIZE];',
-            'int R[R_SIZE];',
-            '',
-            '// SP and FP start at the top of MM',
-            'R[SP] = MM_SIZE - 1;',
-            'R[FP] = MM_SIZE - 1;',
-            '',
-            '// HP starts at the bottom of MM',
-            'R[HP] = 0;',
-            '',
-            '// Allocate float registers',
-            'float R_FLOAT_1;',
-            'float R_FLOAT_2;',
-            '',
-            '// Allocate space for a string buffer',
-            'char STR_BUF[BUF_SIZE];',
-            '',
-            '////////////////////////////////////////////////////',
-            '// PROGRAM START',
+            '// Define the memory cell type and its float view',
+            'typedef %s cell;' % cell_type,
+            'typedef union { cell i; float f; } cell_bits;',
             '',
         ]
 
-        self.generate('\n'.join(code), tabs=0)
-
-        return
-
     def generate_footer(self):
         """Generate Code Footer
 
         Adds all footer code to the generated code buffer.
         """
+        self._function = self._begin_function('runtime')
+        self._runtime_names = [name for name, _ in self._runtime_routines()]
+        self.generate(self._generate_runtime_code(self._runtime_names),
+                      tabs=0)
+
+        return
+
+    def _generate_runtime_code(self, names):
+        """Generate Runtime Code (Protected)
+
+        Arguments:
+            names: The names of the runtime routines to include.
+
+        Returns:
+            The C code of the runtime routines as a single string.
+        """
         code = [
-            '',
-            '    // Jump to the program exit',
-            '    goto *(void*)MM[R[FP]];',
-            '',
             '////////////////////////////////////////////////////',
             '// RUNTIME FUNCTIONS',
+        ]
+
+        for name, body in self._runtime_routines():
+            if name not in names:
+                continue
+
+            code.append('')
+
+            if self.call_model == 'native':
+                # The param is addressed from the frame passed by the caller
+                code.append('%svoid %s_1(cell fp)' % (self._linkage(), name))
+                code.append('{')
+                code.extend('    ' + line.replace('ARG', 'MM[fp+2]')
+                            for line in body)
+                code.append('}')
+            else:
+                code.append('%s_1:' % name)
+                code.extend('    ' + line.replace('ARG', 'MM[R[FP]+2]')
+                            for line in body)
+                code.extend([
+                    '    R[0] = MM[R[FP]];',
+                    '    goto *(void*)R[0];',
+                ])
+
+        if self.call_model != 'native':
+            code.append('}')
+
+        return '\n'.join(code)
+
+    def _runtime_routines(self):
+        """Runtime Routines (Protected)
+
+        Returns:
+            The list of (name, body) runtime routines of the I/O layer.
+        """
+        if self.io == 'buffered':
+            return BUFFERED_RUNTIME_ROUTINES
+
+        return RUNTIME_ROUTINES
+
+    def _read_runtime_file(self, name, skip=()):
+        """Read Runtime File (Protected)
+
+        Reads a runtime source file which is pasted into the generated code.
+        Each file is only read once by a process, so repeated compiles do not
+        touch the filesystem. The file is read through the loader of this
+        module, so it is also found inside a zipapp.
+
+        Arguments:
+            name: The name of a C file in RUNTIME_DIR.
+            skip: Lines of the file to leave out. (Default: ())
+
+        Returns:
+            A list of the lines of C code in the file.
+        """
+        if name not in _runtime_files:
+            data = __loader__.get_data(os.path.join(RUNTIME_DIR, name))
+            _runtime_files[name] = tuple(data.decode().splitlines())
+
+        return [line for line in _runtime_files[name]
+                if line not in skip] + ['']
+
+    def _generate_buffered_io(self):
+        """Generate Buffered I/O (Protected)
+
+        Reads the buffered I/O layer from RUNTIME_DIR. Its declarations are
+        always included, and its implementation is included unless it is
+        linked as a separate object.
+
+        Returns:
+            A list of lines of C code.
+        """
+        code = self._read_runtime_file('rtio.h')
+
+        if not self.io_object:
+            code.extend(self._read_runtime_file('rtio.c',
+                                                skip=['#include "rtio.h"']))
+
+        return code
+
+    def _generate_machine_setup(self):
+        """Generate Machine Setup (Protected)
+
+        Returns:
+            A list of lines of C code which set up the special registers.
+        """
+        return [
+            '// Map main memory',
+            'mm_init();',
             '',
-            'putString_1:',
-            '    R[0] = MM[R[FP]+2];',
-            '    printf("%s\\n", (char*)R[0]);',
-            '    R[0] = MM[R[FP]];',
-            '    goto *(void*)R[0];',
-            '',
-            'getString_1:',
-            '    fgets(STR_BUF, BUF_SIZE, stdin);',
-            '    R[0] = strlen(STR_BUF) + 1;',
-            '    memcpy(&MM[R[HP]], &STR_BUF, R[0]);',
-            '    MM[R[FP]+2] = (int)((char*)&MM[R[HP]]);',
-            '    R[HP] = R[HP] + R[0];',
-            '    R[0] = MM[R[FP]];',
-            '    goto *(void*)R[0];',
-            '',
-            'putBool_1:',
-            '    R[0] = MM[R[FP]+2];',
-            '    printf("%s\\n", R[0] ? "true" : "false");',
-            '    R[0] = MM[R[FP]];',
-            '    goto *(void*)R[0];',
-            '',
-            'getBool_1:',
-            '    scanf("%d", &R[0]);',
-            '    R[0] = R[0] ? 1 : 0;',
-            '    MM[R[FP]+2] = R[0];',
-            '    R[0] = MM[R[FP]];',
-            '    goto *(void*)R[0];',
-            '',
-            'putInteger_1:',
-            '    R[0] = MM[R[FP]+2];',
-            '    printf("%d\\n", R[0]);',
-            '    R[0] = MM[R[FP]];',
-            '    goto *(void*)R[0];',
-            '',
-            'getInteger_1:',
-            '    scanf("%d", &R[0]);',
-            '    MM[R[FP]+2] = R[0];',
-            '    R[0] = MM[R[FP]];',
-            '    goto *(void*)R[0];',
+            '// SP and FP start at the top of MM',
+            'R[SP] = MM_SIZE - 1;',
+            'R[FP] = MM_SIZE - 1;',
             '',
-            'putFloat_1:',
-            '    R[0] = MM[R[FP]+2];',
-            '    memcpy(&R_FLOAT_1, &R[0], sizeof(float));',
-            '    printf("%g\\n", R_FLOAT_1);',
-            '    R[0] = MM[R[FP]];',
-            '    goto *(void*)R[0];',
+            '// HP starts at the bottom of MM',
+            'R[HP] = 0;',
             '',
-            'getFloat_1:',
-            '    scanf("%f", &R_FLOAT_1);',
-            '    memcpy(&R[0], &R_FLOAT_1, sizeof(float));',
-            '    MM[R[FP]+2] = R[0];',
-            '    R[0] = MM[R[FP]];',
-            '    goto *(void*)R[0];',
-            '}',
         ]
 
-        self.generate('\n'.join(code), tabs=0)
-
-        return
-
     def generate(self, code, tabs=-1):
         """Generate Code
         
-        Adds the given code to the generated code and automatically formats
-        it with the appropriate tabs and ending newline.
+        Adds the given raw C code to the generated code. It is automatically
+        formatted with the appropriate tabs and ending newline once lowered.
 
         Arguments:
             code: The code to add to the generated code buffer.
@@ -260,10 +599,42 @@ class CodeGenerator:
                 methods. (Default: -1)
         """
         tabs = tabs if tabs != -1 else self._tab_count
-        self._generated_code += ('    ' * tabs) + code + '\n'
+        self._function.append(ir.Instr('raw', target=code, tabs=tabs))
+
+        return
 
+    def _emit(self, op, dst=None, a=None, b=None, target=None):
+        """Emit Instruction (Protected)
+
+        Adds an IR instruction to the function currently being generated.
+
+        Arguments:
+            op: The IR operation name.
+            dst: The destination register number. (Default: None)
+            a: The first encoded operand. (Default: None)
+            b: The second encoded operand. (Default: None)
+            target: The label name or comment text. (Default: None)
+        """
+        self._function.append(ir.Instr(op, dst, a, b, target,
+                                       self._tab_count))
         return
 
+    def _begin_function(self, name):
+        """Begin Function (Protected)
+
+        Creates a new IR function which receives all following instructions.
+
+        Arguments:
+            name: The name of the function.
+
+        Returns:
+            The new Function object.
+        """
+        function = ir.Function(name)
+        self._program.functions.append(function)
+
+        return function
+
     def comment(self, text, is_displayed=False):
         """Generate Comment
 
@@ -275,7 +646,7 @@ class CodeGenerator:
                 code. (Default: False)
         """
         if is_displayed:
-            self.generate('// %s' % text)
+            self._emit('comment', target=text)
 
         return
 
@@ -302,20 +673,752 @@ class CodeGenerator:
 
         Writes the generated code to the destination output file for
         intermediate code if the source is parsed without fatal errors.
+        Self-recursive tail calls are always turned into jumps. The inliner
+        and IR passes are run (if attached) before the IR is lowered to C,
+        only the procedures and runtime routines reachable from the program
+        body are kept, and the peephole optimizer (if attached) is run over
+        the lowered C.
 
         Returns:
             True if file is successfully written, False otherwise.
         """
+        for function in self._program.functions:
+            self._eliminate_tail_calls(function)
+
+        if self.inliner is not None:
+            self.inliner.run(self._program, self.get_reg, self._reg_size)
+
+        if self.pass_manager is not None:
+            self.pass_manager.run(self._program)
+
+        self._eliminate_unreachable()
+
+        # Registers are never reused, so large programs need more of them
+        if self._reg >= self._reg_size:
+            self._reg_size = self._reg + 1
+            self._program.functions[0].instrs[0].target = \
+                '\n'.join(self._generate_header_code())
+
+        if self.units > 1:
+            return self._commit_units()
+
+        # String literals are declared just after the header
+        pool = self._generate_string_pool(self._program.functions)
+        if pool:
+            self._program.functions[0].instrs.insert(
+                1, ir.Instr('raw', target='\n'.join(pool), tabs=0))
+
+        self._generated_code = self._lower()
+
+        if self.peephole is not None:
+            self._generated_code = self.peephole.optimize(self._generated_code)
+
+        self._generated_code = self._localize_registers(self._generated_code)
+
+        if hasattr(self._dest_path, 'write'):
+            self.unit_paths = []
+        else:
+            self.unit_paths = [self._dest_path]
+
+        return self._write_code(self._dest_path, self._generated_code)
+
+    def _commit_units(self):
+        """Commit Translation Units (Protected)
+
+        Splits the functions over the translation units and writes each of
+        them along with the shared unit header. The main unit keeps the
+        header, program entry point and runtime functions, and procedures
+        are placed largest first in the unit with the fewest instructions.
+
+        Returns:
+            True if every file is successfully written, False otherwise.
+        """
+        functions = self._program.functions
+        order = dict((function.name, i) for i, function in enumerate(functions))
+        units = [[] for _ in range(self.units)]
+        sizes = [0] * self.units
+
+        for function in sorted(functions, key=lambda f: -len(f.instrs)):
+            if function.name in ['main', 'runtime']:
+                index = 0
+            else:
+                index = sizes.index(min(sizes))
+
+            units[index].append(function)
+            sizes[index] += len(function.instrs)
+
+        header = [(0, line) for line in self._generate_unit_header()]
+        if not self._write_code(self._header_path(), header):
+            return False
+
+        root = os.path.splitext(self._dest_path)[0]
+        self.unit_paths = []
+        self._generated_code = []
+        statements = [0, 0]
+
+        for index, unit in enumerate(u for u in units if u):
+            unit.sort(key=lambda function: order[function.name])
+
+            code = self._lower(unit)
+            pool = [(0, line) for line in self._generate_string_pool(unit)]
+
+            # The main unit includes the unit header from its own header
+            if index == 0:
+                path = self._dest_path
+                code = code[:1] + pool + code[1:]
+            else:
+                path = '%s_%d.c' % (root, index)
+                code = [(0, '#include "%s"\n' %
+                         os.path.basename(self._header_path()))] + pool + code
+
+            if self.peephole is not None:
+                code = self.peephole.optimize(code)
+                statements[0] += self.peephole.statements_in
+                statements[1] += self.peephole.statements_out
+
+            code = self._localize_registers(code)
+
+            if not self._write_code(path, code):
+                return False
+
+            self.unit_paths.append(path)
+            self._generated_code.extend(code)
+
+        # Report the statements of all units together
+        if self.peephole is not None:
+            self.peephole.statements_in, self.peephole.statements_out = \
+                statements
+
+        return True
+
+    def _generate_unit_header(self):
+        """Generate Unit Header (Protected)
+
+        Returns:
+            A list of lines of C code of the header shared by all translation
+            units. It declares the machine state defined in the main unit and
+            every function.
+        """
+        code = self._generate_types()
+
+        code.extend([
+            '// Define the machine state in the main unit, shared by all',
+            '#define MM_SHARED',
+            'extern cell *MM;',
+            'extern cell mm_size;',
+            'extern cell mm_stack_limit;',
+            'void mm_overflow(void);',
+            '#define MM_SIZE mm_size',
+            '',
+            '// Registers holding floats are accessed through the RF view',
+            'union registers {',
+            '    cell i[R_SIZE];',
+            '    cell_bits f[R_SIZE];',
+            '};',
+            'extern union registers REGS;',
+            '#define R  REGS.i',
+            '#define RF REGS.f',
+            '',
+        ])
+
+        code.extend(self._generate_prototypes())
+
+        return code
+
+    def _header_path(self):
+        """Unit Header Path (Protected)
+
+        Returns:
+            The path of the header shared by the translation units, next to
+            the destination file.
+        """
+        return os.path.splitext(self._dest_path)[0] + '.h'
+
+    def _write_code(self, path, code):
+        """Write Code (Protected)
+
+        Arguments:
+            path: The path of the file to write, or a stream object to write
+                to.
+            code: A list of (tabs, code) statements.
+
+        Returns:
+            True if the file is successfully written, False otherwise.
+        """
+        if hasattr(path, 'write'):
+            try:
+                for tabs, line in code:
+                    path.write(('    ' * tabs) + line + '\n')
+            except IOError as e:
+                print('Error: Could not write to destination stream: %s' %
+                      e.strerror)
+                return False
+
+            return True
+
         try:
-            with open(self._dest_path, 'w+') as f:
-                f.write(self._generated_code)
+            with open(path, 'w+') as f:
+                for tabs, line in code:
+                    f.write(('    ' * tabs) + line + '\n')
         except IOError as e:
-            print('Error: "%s"' % self._dest_path)
+            print('Error: "%s"' % path)
             print('    Could not write to destination file: %s' % e.strerror)
             return False
 
         return True
 
+    def _generate_string_pool(self, functions):
+        """Generate String Pool (Protected)
+
+        Arguments:
+            functions: The Function objects written together in one file.
+
+        Returns:
+            A list of lines of C code which declare the pool variable of
+            every string literal referenced by the functions, or an empty
+            list if there are none.
+        """
+        used = set()
+
+        for function in functions:
+            for instr in function.instrs:
+                for operand in [instr.a, instr.b]:
+                    if operand is not None and ir.kind(operand) == ir.SYM:
+                        used.add(self._program.symbol_text(operand))
+
+        code = ['// Declare the string literals']
+
+        for value, name in self._string_pool.items():
+            if '(cell)%s.text' % name in used:
+                code.append('static const struct { cell length; '
+                            'char text[sizeof("%s")]; } %s = {%d, "%s"};' %
+                            (value, name, len(value.encode()), value))
+
+        if len(code) == 1:
+            return []
+
+        return code + ['']
+
+    def _eliminate_unreachable(self):
+        """Eliminate Unreachable Code (Protected)
+
+        Walks the call graph from the program body and removes every
+        procedure which is never called. The runtime routines are rebuilt
+        with only those which are called.
+        """
+        functions = dict((f.name, f) for f in self._program.functions)
+        entry = [i.target for i in functions['main'].instrs if i.op == 'start']
+        work = list(entry)
+        reachable = set()
+
+        while work:
+            name = work.pop()
+
+            if name not in reachable:
+                reachable.add(name)
+                if name in functions:
+                    work.extend(functions[name].calls())
+
+        procedures = [f for f in self._program.functions
+                      if f.name not in ['main', 'runtime'] + entry]
+        kept = [f for f in procedures if f.name in reachable]
+
+        names = [name for name in self._runtime_names
+                 if '%s_1' % name in reachable]
+
+        self.reachability = {
+            'procedures': (len(kept), len(procedures) - len(kept)),
+            'runtime': (len(names), len(self._runtime_names) - len(names)),
+        }
+
+        self._program.functions = [f for f in self._program.functions
+                                   if f.name in ['main', 'runtime'] or
+                                   f.name in reachable]
+
+        if 'runtime' in functions:
+            self._runtime_names = names
+            functions['runtime'].instrs = [
+                ir.Instr('raw', target=self._generate_runtime_code(names))
+            ]
+
+        return
+
+    def reachability_report(self):
+        """Reachability Report
+
+        Returns:
+            A multi-line string of the emitted and eliminated procedures and
+            runtime routines of the last commit.
+        """
+        lines = ['Reachability:']
+
+        for label, key in [('procedures', 'procedures'),
+                           ('runtime routines', 'runtime')]:
+            emitted, eliminated = self.reachability[key]
+            lines.append('    %-24s %d emitted, %d eliminated' %
+                         (label, emitted, eliminated))
+
+        return '\n'.join(lines)
+
+    def code_counts(self):
+        """Code Counts
+
+        Returns:
+            A dictionary of the number of 'registers' allocated (including the
+            stack, frame and heap pointers) and of the 'labels' kept in the IR
+            of the last commit.
+        """
+        labels = sum(1 for function in self._program.functions
+                     for instr in function.instrs if instr.op == 'label')
+
+        return {'registers': self._reg, 'labels': labels}
+
+    def _eliminate_tail_calls(self, function):
+        """Eliminate Tail Calls (Protected)
+
+        Replaces each call of a procedure to itself in tail position with a
+        reassignment of its params and a jump back to the beginning of its
+        body, so the recursion runs in constant stack space.
+
+        Arguments:
+            function: The Function object to rewrite.
+
+        Returns:
+            The number of tail calls eliminated.
+        """
+        eliminated = 0
+        index = 0
+
+        while index < len(function.instrs):
+            instr = function.instrs[index]
+
+            if instr.op != 'call' or instr.target != function.name:
+                index += 1
+                continue
+
+            tail = self._find_tail_call(function, index)
+
+            if tail is None:
+                index += 1
+                continue
+
+            num_params, end = tail
+            tabs = instr.tabs
+            sp, fp = ir.reg(self._SP), ir.reg(self._FP)
+
+            # The pushed arguments are copied over the params of this frame
+            code = []
+            for param in range(num_params):
+                arg_reg = self.get_reg()
+                address = sp
+
+                if param != 0:
+                    code.append(ir.Instr('add', arg_reg, sp, ir.imm(param),
+                                         tabs=tabs))
+                    address = ir.reg(arg_reg)
+
+                code.append(ir.Instr('load', arg_reg, address, tabs=tabs))
+
+                param_reg = self.get_reg()
+                code.append(ir.Instr('add', param_reg, fp, ir.imm(param + 2),
+                                     tabs=tabs))
+                code.append(ir.Instr('store', a=ir.reg(param_reg),
+                                     b=ir.reg(arg_reg), tabs=tabs))
+
+            # Leave the frame as it was on entry and run the body again
+            code.append(ir.Instr('mov', self._SP, fp, tabs=tabs))
+            code.append(ir.Instr('jump', target='%s_begin' % function.name,
+                                 tabs=tabs))
+
+            function.instrs[index:end] = code
+            index += len(code)
+            eliminated += 1
+
+        return eliminated
+
+    def _find_tail_call(self, function, index):
+        """Find Tail Call (Protected)
+
+        Determines if a call is in tail position. Only param pops and out
+        param write backs may follow the call before the procedure returns,
+        and every 'out' argument must be the matching 'out' param of the
+        procedure itself so that writing back through the frame is the same.
+
+        Arguments:
+            function: The Function object holding the call.
+            index: The index of the 'call' Instr in the function.
+
+        Returns:
+            A (params, end) tuple of the number of params of the call and the
+            index after its clean up code, or None if it is not a tail call.
+        """
+        instrs = function.instrs
+        pops = 0
+        position = index + 1
+
+        # The clean up pops every param and then the saved FP space
+        while position < len(instrs):
+            instr = instrs[position]
+
+            if instr.op == 'pop':
+                pops += 1
+            elif instr.op == 'add' and position + 2 < len(instrs):
+                load, store = instrs[position + 1], instrs[position + 2]
+
+                # An out param written back to the same param of this frame
+                if instr.a != ir.reg(self._FP) or \
+                        instr.b != ir.imm(pops + 1) or \
+                        load.op != 'load' or \
+                        load.a != ir.reg(self._SP) or \
+                        store.op != 'store' or \
+                        store.a != ir.reg(instr.dst) or \
+                        store.b != ir.reg(load.dst):
+                    return None
+
+                position += 2
+            elif instr.op != 'comment':
+                break
+
+            position += 1
+
+        end = position
+        seen = set()
+
+        # Follow jumps and labels until the procedure returns
+        while position < len(instrs):
+            instr = instrs[position]
+
+            if instr.op == 'ret':
+                return pops - 1, end
+            elif instr.op == 'jump' and instr.target not in seen:
+                seen.add(instr.target)
+                position = next((i for i, target in enumerate(instrs)
+                                 if target.op == 'label' and
+                                 target.target == instr.target), len(instrs))
+            elif instr.op in ['label', 'comment']:
+                position += 1
+            else:
+                return None
+
+        return None
+
+    def dump_ir(self):
+        """Dump IR
+
+        Formats the generated IR, partitioned into basic blocks, for
+        debugging. After commit() this includes the effect of any IR passes.
+
+        Returns:
+            A multi-line string of the program IR.
+        """
+        return self._program.dump()
+
+    def _lower(self, functions=None):
+        """Lower IR (Protected)
+
+        Lowers every function of the IR program to C statements.
+
+        Arguments:
+            functions: The Function objects to lower, or None for every
+                function of the program. (Default: None)
+
+        Returns:
+            A list of (tabs, code) statements.
+        """
+        code = []
+
+        if functions is None:
+            functions = self._program.functions
+
+        for function in functions:
+            # Natively called procedures become C functions of their frame
+            native = (self.call_model == 'native' and
+                      function.name not in ['main', 'runtime'])
+
+            # The frame pointer of a C function is its fp argument
+            if native:
+                code.append((0, '%svoid %s(cell fp)\n{' %
+                             (self._linkage(), function.name)))
+
+            for instr in function.instrs:
+                code.extend(self._lower_instr(instr))
+
+            if native:
+                code.append((0, '}\n'))
+            else:
+                code.append((0, ''))
+
+        return code
+
+    def _localize_registers(self, code):
+        """Localize Registers (Protected)
+
+        Turns the registers of each natively called procedure into locals of
+        its C function, and its FP into the fp argument, so the C compiler
+        can keep them in machine registers. A register is never used by two
+        procedures, and is not expected to survive a call, so no procedure
+        sees another's. This is done after the peephole optimizer, whose
+        patterns match the registers of the register file.
+
+        Arguments:
+            code: A list of (tabs, code) statements.
+
+        Returns:
+            The list of statements with the registers of every C function
+            of a procedure declared as locals.
+        """
+        if self.call_model != 'native':
+            return code
+
+        localized = []
+        registers = None
+
+        def rename(match):
+            if match.group(2) == 'FP':
+                return 'fp'
+
+            registers.add(int(match.group(2)))
+
+            # A register holds the bits of its int or float view
+            return 'r%s%s' % (match.group(2), '' if match.group(1) else '.i')
+
+        for tabs, line in code:
+            if registers is None:
+                localized.append((tabs, line))
+
+                if NATIVE_HEADER.match(line):
+                    registers = set()
+                    start = len(localized)
+            elif tabs == 0 and line == '}\n':
+                names = ['r%d' % reg for reg in sorted(registers)]
+
+                localized[start:start] = [
+                    (1, 'cell_bits %s;' % ', '.join(names[i:i + 8]))
+                    for i in range(0, len(names), 8)]
+                localized.append((tabs, line))
+                registers = None
+            else:
+                localized.append((tabs, REGISTER_OPERAND.sub(rename, line)))
+
+        return localized
+
+    def _c_operand(self, operand):
+        """C Operand (Protected)
+
+        Arguments:
+            operand: The encoded IR operand.
+
+        Returns:
+            The C expression of the operand.
+        """
+        if ir.is_reg(operand):
+            names = {ir.SP: 'SP', ir.FP: 'FP', ir.HP: 'HP'}
+            return 'R[%s]' % names.get(ir.value(operand), ir.value(operand))
+        elif ir.is_imm(operand):
+            return str(ir.value(operand))
+
+        return self._program.symbol_text(operand)
+
+    def _lower_native_main(self, instr):
+        """Lower Native Main (Protected)
+
+        Lowers the program entry point to the C main function when each
+        procedure is a C function. Every runtime function and procedure is
+        declared first.
+
+        Arguments:
+            instr: The 'start' Instr object of the program.
+
+        Returns:
+            A list of (tabs, code) statements.
+        """
+        code = []
+
+        # Split units declare every function in the unit header instead
+        if self.units == 1:
+            code.extend((0, line) for line in self._generate_prototypes())
+
+        code.append((0, '\nint main(void)\n{'))
+        code.extend((1 if line else 0, line)
+                    for line in self._generate_machine_setup())
+        code.append((1, '%s(R[FP]);' % instr.target))
+        code.append((1, 'return 0;'))
+        code.append((0, '}\n'))
+
+        return code
+
+    def _generate_prototypes(self):
+        """Generate Prototypes (Protected)
+
+        Returns:
+            A list of lines of C code which declare every runtime function
+            and procedure function of the native call model.
+        """
+        code = ['// Declare the runtime functions']
+
+        for name in self._runtime_names:
+            code.append('%svoid %s_1(cell fp);' % (self._linkage(), name))
+
+        code.append('\n// Declare the program and procedure functions')
+
+        for function in self._program.functions:
+            if function.name not in ['main', 'runtime']:
+                code.append('%svoid %s(cell fp);' % (self._linkage(),
+                                                     function.name))
+
+        return code
+
+    def _linkage(self):
+        """Function Linkage (Protected)
+
+        Returns:
+            The storage class of the C functions, which must be visible to
+            the other translation units if the code is split.
+        """
+        return 'static ' if self.units == 1 else ''
+
+    def _is_address_operand(self, operand):
+        """Is Address Operand (Protected)
+
+        Arguments:
+            operand: The encoded IR operand.
+
+        Returns:
+            True if the operand is a special register or a symbol, which are
+            only used in memory address arithmetic, False otherwise.
+        """
+        if ir.is_reg(operand):
+            return ir.value(operand) in [self._SP, self._FP, self._HP]
+
+        return not ir.is_imm(operand)
+
+    def _c_float_operand(self, operand):
+        """C Float Operand (Protected)
+
+        Arguments:
+            operand: The encoded IR operand holding float bits.
+
+        Returns:
+            A C expression of the operand bits read as a float.
+        """
+        if ir.is_reg(operand):
+            return 'RF[%d].f' % ir.value(operand)
+
+        return '((cell_bits){%s}).f' % self._c_operand(operand)
+
+    def _lower_instr(self, instr):
+        """Lower Instruction (Protected)
+
+        Lowers a single IR instruction to C statements.
+
+        Arguments:
+            instr: The Instr object to lower.
+
+        Returns:
+            A list of (tabs, code) statements.
+        """
+        op = instr.op
+        tabs = instr.tabs
+
+        a = self._c_operand(instr.a) if instr.a is not None else None
+        b = self._c_operand(instr.b) if instr.b is not None else None
+        dst = self._c_operand(ir.reg(instr.dst)) \
+            if instr.dst is not None else None
+
+        if op == 'raw':
+            lines = [instr.target]
+        elif op == 'comment':
+            lines = ['// %s' % instr.target]
+        elif op == 'label':
+            lines = ['%s:' % instr.target]
+        elif op == 'jump':
+            lines = ['goto %s;' % instr.target]
+        elif op == 'branch':
+            lines = ['if (!%s) goto %s;' % (a, instr.target)]
+        elif op in ir.BRANCH_OPS:
+            lines = ['if (%s %s %s) goto %s;' %
+                     (a, ir.BINARY_OPS[ir.BRANCH_OPS[op]], b, instr.target)]
+        elif op == 'mov':
+            lines = ['%s = %s;' % (dst, a)]
+        elif op == 'not':
+            lines = ['%s = ~%s;' % (dst, a)]
+        elif op in ir.BINARY_OPS:
+            expr = '%s %s %s' % (a, ir.BINARY_OPS[op], b)
+            wrapped = not self._is_address_operand(instr.a) and \
+                not self._is_address_operand(instr.b)
+
+            # Integer arithmetic wraps to 32 bits. It is done on wide cells
+            # or unsigned ints, as constant operands would overflow an int.
+            # Address arithmetic on the special registers never overflows
+            if self.target != '32' and op in ['add', 'sub', 'mul', 'div'] \
+                    and wrapped:
+                expr = '(int)((cell)%s %s (cell)%s)' % (
+                    a, ir.BINARY_OPS[op], b)
+            elif self.target == '32' and op in ['add', 'sub', 'mul'] \
+                    and wrapped:
+                expr = '(cell)((unsigned)%s %s (unsigned)%s)' % (
+                    a, ir.BINARY_OPS[op], b)
+
+            lines = ['%s = %s;' % (dst, expr)]
+        elif op == 'load':
+            lines = ['%s = MM[%s];' % (dst, a)]
+        elif op == 'store':
+            lines = ['MM[%s] = %s;' % (a, b)]
+        elif op == 'push':
+            lines = ['R[SP] = R[SP] - 1;', 'MM[R[SP]] = %s;' % a]
+        elif op == 'pop':
+            lines = ['R[SP] = R[SP] + %s;' % a]
+        elif op == 'alloc':
+            lines = ['R[SP] = R[SP] - %s;' % a]
+
+            # Large frames could step over the guard page below the stack
+            if not ir.is_imm(instr.a) or ir.value(instr.a) >= CHECKED_ALLOC:
+                lines.append('if (R[SP] < mm_stack_limit) mm_overflow();')
+        elif op == 'call' and self.call_model == 'native':
+            # The FP of the caller is a C local which the call leaves alone,
+            # so the frame only keeps its space for the layout of the params
+            lines = [
+                'R[SP] = R[SP] - 2;',
+                '%s(R[SP]);' % instr.target,
+                'R[SP] = R[SP] + 1;',
+            ]
+        elif op == 'call':
+            return_label = '%s_%s' % (instr.target, a)
+            lines = [
+                'R[SP] = R[SP] - 1;',
+                'MM[R[SP]] = R[FP];',
+                'R[SP] = R[SP] - 1;',
+                'R[FP] = R[SP];',
+                'MM[R[SP]] = (cell)&&%s;' % return_label,
+                'goto %s;' % instr.target,
+                '%s:' % return_label,
+                'R[SP] = R[SP] + 1;',
+                'R[FP] = MM[R[SP]];',
+            ]
+        elif op == 'ret' and self.call_model == 'native':
+            lines = ['R[SP] = R[FP];', 'return;']
+        elif op == 'ret':
+            lines = ['R[SP] = R[FP];', 'goto *(void*)MM[R[FP]];']
+        elif op == 'start' and self.call_model == 'native':
+            return self._lower_native_main(instr)
+        elif op == 'start':
+            return [
+                (tabs, 'MM[R[FP]] = (cell)&&%s_end;' % instr.target),
+                (tabs, 'goto %s_begin;' % instr.target),
+                (tabs, '%s_end:' % instr.target),
+                (tabs + 1, 'return 0;'),
+            ]
+        elif op == 'fconst' or op == 'i2f':
+            lines = ['RF[%d].f = %s;' % (instr.dst, a)]
+        elif op in ir.FLOAT_OPS:
+            lines = ['RF[%d].f = %s %s %s;' %
+                     (instr.dst, self._c_float_operand(instr.a),
+                      ir.FLOAT_OPS[op], self._c_float_operand(instr.b))]
+        else:
+            raise ValueError('cannot lower IR operation "%s"' % op)
+
+        return [(tabs, line) for line in lines]
+
     def get_mm(self, id_size, is_param=False):
         """Get Memory Space
 
@@ -424,22 +1527,52 @@ class CodeGenerator:
             program_num: The label id of the program.
             debug: Determines if comments should be written to the code.
         """
-        # Push the return address onto the stack
-        self.comment('Setting program return address', debug)
-        self.generate('MM[R[FP]] = (int)&&%s_%d_end;' %
-                      (program_name, program_num))
+        # Run the program body and exit once it returns
+        self.comment('Entering the program, exiting once it returns', debug)
+        self._emit('start', target='%s_%d' % (program_name, program_num))
+
+        return
+
+    def generate_procedure_entry(self, procedure_name, procedure_num,
+                                 local_var_size, debug):
+        """Generate Procedure Entry
+
+        Begins a new IR function for the body of a program or procedure. The
+        entry labels are generated and space for the local variables is
+        allocated on the stack.
+
+        Arguments:
+            procedure_name: The name of the program or procedure.
+            procedure_num: The label id of the program or procedure.
+            local_var_size: The number of memory spaces of local variables.
+            debug: Determines if comments should be written to the code.
+        """
+        label = '%s_%d' % (procedure_name, procedure_num)
+        self._function = self._begin_function(label)
 
-        # Make the jump to the entry point
-        self.generate('goto %s_%d_begin;' % (program_name, program_num))
+        # Define the entry point and the beginning of the body
+        self._emit('label', target=label)
+        self._emit('label', target='%s_begin' % label)
 
-        # Make the main program return
-        self.generate('')
-        self.comment('Creating the program exit point', debug)
-        self.generate('%s_%d_end:' % (program_name, program_num))
         self.tab_push()
-        self.generate('return 0;')
+
+        if local_var_size != 0:
+            self.comment('Allocating space for local variables', debug)
+            self._emit('alloc', a=ir.imm(local_var_size))
+
+        return
+
+    def generate_procedure_exit(self, debug):
+        """Generate Procedure Exit
+
+        Ends the IR function of a program or procedure body by returning to
+        the caller scope.
+
+        Arguments:
+            debug: Determines if comments should be written to the code.
+        """
+        self.generate_return(debug)
         self.tab_pop()
-        self.generate('')
 
         return
 
@@ -455,31 +1588,14 @@ class CodeGenerator:
             procedure_num: The label id of the procedure to call.
             debug: Determines if comments should be written to the code.
         """
-        # Save the FP to the stack. Set next FP to return address
-        self.comment('Setting caller FP', debug)
-        self.generate('R[SP] = R[SP] - 1;')
-        self.generate('MM[R[SP]] = R[FP];')
-        self.comment('Setting return address (current FP)', debug)
-        self.generate('R[SP] = R[SP] - 1;')
-        self.generate('R[FP] = R[SP];')
-
         # Generate a new call number so multiple calls do not cause collisions
         call_number = self.get_unique_call_id()
 
-        # Push the return address onto the stack
-        self.generate('MM[R[SP]] = (int)&&%s_%d_%d;' %
-                (procedure_name, procedure_num, call_number))
-                
-        # Make the jump to the function call
-        self.generate('goto %s_%d;' % (procedure_name, procedure_num))
-
-        # Generate the return label
-        self.generate('%s_%d_%d:' % (procedure_name, procedure_num, call_number))
-
-        # The SP now points to the return address. Restore the old FP
-        self.comment('Restore caller FP', debug)
-        self.generate('R[SP] = R[SP] + 1;')
-        self.generate('R[FP] = MM[R[SP]];')
+        # The call saves the caller FP and the return address on the stack,
+        # jumps to the procedure and restores the caller FP on return
+        self.comment('Calling procedure, saving caller FP', debug)
+        self._emit('call', a=ir.imm(call_number),
+                   target='%s_%d' % (procedure_name, procedure_num))
 
         return
 
@@ -495,7 +1611,7 @@ class CodeGenerator:
         self.comment('Move to caller local stack', debug)
 
         # Finalize the function call. Move the SP off the param list
-        self.generate('R[SP] = R[SP] + 1;')
+        self._emit('pop', a=ir.imm(1))
 
         return
 
@@ -523,21 +1639,26 @@ class CodeGenerator:
         # Get a new register to calculate the main memory address of this id
         id_reg = self.get_reg()
 
-        self.generate('R[%d] = %d;' % (id_reg, id_obj.mm_ptr))
+        # Params and globals are one memory space further from their landmark
+        offset = id_obj.mm_ptr
+        if id_location in ['param', 'global']:
+            offset += 1
+
+        offset = ir.imm(offset)
 
         if id_obj.size is not None and idx_reg is not None:
-            self.generate('R[%d] = R[%d] + R[%d];' %
-                    (id_reg, id_reg, idx_reg))
+            self._emit('add', id_reg, offset, ir.reg(idx_reg))
+            offset = ir.reg(id_reg)
 
         if id_location == 'param':
             self.comment('Param referenced', debug)
-            self.generate('R[%d] = R[FP] + 1 + R[%d];' % (id_reg, id_reg))
+            self._emit('add', id_reg, ir.reg(self._FP), offset)
         elif id_location == 'global':
             self.comment('Global var referenced', debug)
-            self.generate('R[%d] = MM_SIZE - 1 - R[%d];' % (id_reg, id_reg))
+            self._emit('sub', id_reg, self._program.symbol('MM_SIZE'), offset)
         else:
             self.comment('Local var referenced', debug)
-            self.generate('R[%d] = R[FP] - R[%d];' % (id_reg, id_reg))
+            self._emit('sub', id_reg, ir.reg(self._FP), offset)
 
         return id_reg
 
@@ -559,7 +1680,7 @@ class CodeGenerator:
                                              debug)
 
         # Retrieve the main memory location and place it in the last register
-        self.generate('R[%d] = MM[R[%d]];' % (id_reg, id_reg))
+        self._emit('load', id_reg, ir.reg(id_reg))
 
         return
 
@@ -583,7 +1704,7 @@ class CodeGenerator:
                                              debug)
 
         # Set the main memory value to the value in the expression register
-        self.generate('MM[R[%d]] = R[%d];' % (id_reg, expr_reg))
+        self._emit('store', a=ir.reg(id_reg), b=ir.reg(expr_reg))
 
         return
 
@@ -598,8 +1719,7 @@ class CodeGenerator:
             debug: Determines if comments are to be written in generated code.
         """
         self.comment('Pushing argument onto the stack', debug)
-        self.generate('R[SP] = R[SP] - 1;')
-        self.generate('MM[R[SP]] = R[%d];' % expr_reg)
+        self._emit('push', a=ir.reg(expr_reg))
 
         return
 
@@ -616,7 +1736,7 @@ class CodeGenerator:
         self.comment('Popping "%s" param off the stack' % param_name, debug)
                 
         # Move to the next memory space
-        self.generate('R[SP] = R[SP] + 1;')
+        self._emit('pop', a=ir.imm(1))
 
         return
 
@@ -636,7 +1756,9 @@ class CodeGenerator:
         id_reg = self._generate_get_id_in_mm(id_obj, id_location, None, debug)
 
         # Store the parameter in the position pointed to by the SP
-        self.generate('MM[R[%d]] = MM[R[SP]];' % id_reg)
+        value_reg = self.get_reg()
+        self._emit('load', value_reg, ir.reg(self._SP))
+        self._emit('store', a=ir.reg(id_reg), b=ir.reg(value_reg))
 
         return
 
@@ -654,19 +1776,35 @@ class CodeGenerator:
 
         if token_type == 'integer':
             # This is an integer value, set it to the register
-            if negate:
-                self.generate('R[%d] = -%s;' % (reg, number))
-            else:
-                self.generate('R[%d] = %s;' % (reg, number))
+            value = -int(number) if negate else int(number)
+
+            # Literals wrap to a 32-bit integer regardless of the cell size
+            value = (value + 2**31) % 2**32 - 2**31
+            self._emit('mov', reg, ir.imm(value))
         else:
-            # This is a float value, place it in the float buffer and copy it
-            # to the register
-            if negate:
-                self.generate('R_FLOAT_1 = -%s;' % number)
-            else:
-                self.generate('R_FLOAT_1 = %s;' % number)
+            # This is a float value, its bits are placed in the register
+            value = '-%s' % number if negate else number
+            self._emit('fconst', reg, self._program.symbol(value))
+
+        return
+
+    def generate_string(self, value):
+        """Generate String
 
-            self.generate('memcpy(&R[%d], &R_FLOAT_1, sizeof(float));' % reg)
+        Generates the code to store a pointer to a string literal in a new
+        register. Literals are laid out like the strings of the heap, with
+        their length in the cell before the characters.
+
+        Arguments:
+            value: The parsed string value.
+        """
+        # Identical literals share one length-prefixed pool variable
+        if value not in self._string_pool:
+            self._string_pool[value] = 'STR_%d' % len(self._string_pool)
+
+        reg = self.get_reg()
+        self._emit('mov', reg, self._program.symbol(
+            '(cell)%s.text' % self._string_pool[value]))
 
         return
 
@@ -679,13 +1817,9 @@ class CodeGenerator:
         Arguments:
             debug: Determines if comments should be displayed or not.
         """
-        # Smash the local stack
-        self.comment('Moving SP to FP (return address)', debug)
-        self.generate('R[SP] = R[FP];')
-
-        # Go to the return label to exit the procedure
-        self.comment('Return to calling function', debug)
-        self.generate('goto *(void*)MM[R[FP]];')
+        # Smash the local stack and go to the return label
+        self.comment('Moving SP to FP, returning to calling function', debug)
+        self._emit('ret')
 
         return
 
@@ -706,25 +1840,184 @@ class CodeGenerator:
             The register number where the result of the operation
             is stored.
         """
-        # Get a register to hold the operation result
-        result = self.get_reg()
-
         if type1 != 'float' and type2 != 'float':
-            self.generate('R[%d] = R[%d] %s R[%d];' %
-                          (result, reg1, operation, reg2))
+            # Get a register to hold the operation result
+            result = self.get_reg()
+            self._emit(ir.OPERATORS[operation], result, ir.reg(reg1),
+                       ir.reg(reg2))
             return result
 
+        # Integer operands are converted to float first. The result register
+        # must be allocated last, it is expected to be the last register
         if type1 != 'float':
-            self.generate('R_FLOAT_1 = R[%d];' % reg1)
-        else:
-            self.generate('memcpy(&R_FLOAT_1, &R[%d], sizeof(float));' % reg1)
+            conv = self.get_reg()
+            self._emit('i2f', conv, ir.reg(reg1))
+            reg1 = conv
 
         if type2 != 'float':
-            self.generate('R_FLOAT_2 = R[%d];' % reg2)
-        else:
-            self.generate('memcpy(&R_FLOAT_2, &R[%d], sizeof(float));' % reg2)
+            conv = self.get_reg()
+            self._emit('i2f', conv, ir.reg(reg2))
+            reg2 = conv
+
+        result = self.get_reg()
+        self._emit(ir.FLOAT_OPERATORS[operation], result, ir.reg(reg1),
+                   ir.reg(reg2))
 
-        self.generate('R_FLOAT_1 = R_FLOAT_1 %s R_FLOAT_2;' % operation)
-        self.generate('memcpy(&R[%d], &R_FLOAT_1, sizeof(float));' % result)
-        
         return result
+
+    def generate_not(self, reg):
+        """Generate Not
+
+        Generates the code to invert the bits of a register in place.
+
+        Arguments:
+            reg: The register to invert.
+        """
+        self._emit('not', reg, ir.reg(reg))
+        return
+
+    def generate_label(self, label):
+        """Generate Label
+
+        Generates a label which may be the target of jumps and branches.
+
+        Arguments:
+            label: The label name.
+        """
+        self._emit('label', target=label)
+        return
+
+    def generate_jump(self, label):
+        """Generate Jump
+
+        Generates an unconditional jump to a label.
+
+        Arguments:
+            label: The label name to jump to.
+        """
+        self._emit('jump', target=label)
+        return
+
+    def generate_branch(self, reg, label):
+        """Generate Branch
+
+        Generates a jump to a label which is taken if a register is false.
+
+        If the register holds a relation, or a '&' or '|' of relations, which
+        was just computed in the current basic block, the computation is
+        rewritten into compare-and-branch instructions instead. The outcome
+        of each relation then never has to be materialized in a register.
+
+        Arguments:
+            reg: The register holding the condition.
+            label: The label name to jump to.
+        """
+        instrs = self._function.instrs
+
+        # Find the last definition of each register in the current block
+        defs = {}
+
+        for index in range(len(instrs) - 1, -1, -1):
+            instr = instrs[index]
+
+            if instr.op == 'label' or instr.op in ir.TERMINATOR_OPS:
+                break
+
+            if instr.dst is not None and instr.dst not in defs:
+                defs[instr.dst] = index
+
+        condition = self._get_condition(reg, defs)
+
+        if condition is None:
+            self._emit('branch', a=ir.reg(reg), target=label)
+            return
+
+        # Maps the index of each rewritten instruction to its replacements
+        rewrites = {}
+        self._generate_condition_branch(condition, label, False, rewrites)
+
+        code = []
+        for index, instr in enumerate(instrs):
+            code.extend(rewrites.get(index, [instr]))
+
+        self._function.instrs = code
+
+        return
+
+    def _get_condition(self, reg, defs):
+        """Get Condition (Protected)
+
+        Determines if a register holds a condition which can be branched on
+        directly. Relations only produce 0 or 1, so a '&' or '|' of relations
+        may be evaluated as a chain of branches.
+
+        Arguments:
+            reg: The register holding the condition.
+            defs: A dictionary of register number to the index of its last
+                definition in the current basic block.
+
+        Returns:
+            A ('relation', index) or (op, index, left, right) condition tree,
+            or None if the register must be tested as a value.
+        """
+        if reg not in defs:
+            return None
+
+        index = defs[reg]
+        instr = self._function.instrs[index]
+
+        if instr.op in ir.COMPARISON_OPS:
+            return ('relation', index)
+
+        if instr.op not in ['and', 'or'] or not ir.is_reg(instr.a) or \
+                not ir.is_reg(instr.b):
+            return None
+
+        left = self._get_condition(ir.value(instr.a), defs)
+        right = self._get_condition(ir.value(instr.b), defs)
+
+        if left is None or right is None:
+            return None
+
+        return (instr.op, index, left, right)
+
+    def _generate_condition_branch(self, condition, label, jump_if,
+                                   rewrites):
+        """Generate Condition Branch (Protected)
+
+        Rewrites a condition tree into compare-and-branch instructions. Each
+        relation is replaced by a branch in place, so the right operand of a
+        '&' or '|' is skipped once the outcome is already known.
+
+        Arguments:
+            condition: The condition tree from _get_condition().
+            label: The label name to jump to.
+            jump_if: The condition outcome (True or False) which jumps.
+            rewrites: A dictionary of instruction index to the list of its
+                replacement instructions which is updated in place.
+        """
+        instr = self._function.instrs[condition[1]]
+
+        if condition[0] == 'relation':
+            op = instr.op if jump_if else ir.INVERSE_COMPARISONS[instr.op]
+            rewrites[condition[1]] = [ir.Instr('b' + op, a=instr.a, b=instr.b,
+                                               target=label, tabs=instr.tabs)]
+            return
+
+        left, right = condition[2], condition[3]
+
+        if (condition[0] == 'and') != jump_if:
+            # Either operand alone decides the jump
+            self._generate_condition_branch(left, label, jump_if, rewrites)
+            self._generate_condition_branch(right, label, jump_if, rewrites)
+            rewrites[condition[1]] = []
+        else:
+            # The left operand may decide against the jump, skip the right
+            skip = 'cond_%d' % self.get_label_id()
+            self._generate_condition_branch(left, skip, not jump_if,
+                                            rewrites)
+            self._generate_condition_branch(right, label, jump_if, rewrites)
+            rewrites[condition[1]] = [ir.Instr('label', target=skip,
+                                               tabs=instr.tabs)]
+
+        return
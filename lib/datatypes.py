@@ -12,6 +12,7 @@ Classes:
     Token: A named tuple object containing token information.
     Identifier: A named tuple object containing identifier information.
     Parameter: A named tuple object containing procedure param information.
+    Diagnostic: A named tuple object containing an error or warning.
     IdentifierTable: Extends the list type to provide ID table functionality.
 """
 
@@ -58,6 +59,23 @@ Attributes:
 Parameter = namedtuple('Parameter', ['id', 'direction'])
 
 
+"""Diagnostic class
+
+A named tuple object factory containing an error or warning of a compile.
+
+Attributes:
+    severity: The kind of diagnostic, 'error' or 'warning'.
+    message: The description of the problem.
+    path: The path or name of the source.
+    line: The line number of the source where the problem was found.
+    column: The 1-based column of the character the problem is at, or None
+        if it applies to the whole line.
+    text: The line of source, stripped of surrounding whitespace, or None.
+"""
+Diagnostic = namedtuple('Diagnostic',
+        ['severity', 'message', 'path', 'line', 'column', 'text'])
+
+
 class IdentifierTable(list):
     """IdentifierTable class
 
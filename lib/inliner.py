@@ -0,0 +1,309 @@
+#!/usr/bin/env python3
+
+"""Inliner module
+
+Provides the procedure inliner which runs over the three-address IR before
+the optimization passes. The body of a small, non-recursive procedure is
+copied into each of its call sites in place of the call, so the return
+address store and the indirect jump back to the caller are no longer needed.
+
+The callee frame is still built on the stack exactly as a call would build
+it, so params are copied in and written back with the same semantics.
+
+Author: Evan Sneath
+License: Open Software License v3.0
+
+Classes:
+    Inliner: Inlines small procedures into their call sites.
+"""
+
+from lib import ir
+from lib.codegenerator import DEFAULT_BUDGET
+
+
+class Inliner:
+    """Inliner class
+
+    Replaces calls of small, non-recursive procedures with a copy of the
+    procedure body. Runtime routines, which are raw C code, and procedures
+    which can reach themselves through the call graph are never inlined.
+
+    Attributes:
+        budget: The maximum number of instructions in an inlined body.
+        decisions: A list of (caller, callee, call id, reason) tuples, one
+            per call site seen by the last run. The reason is None for an
+            inlined call.
+
+    Methods:
+        run: Inlines procedures throughout a program.
+        report: Formats the decision of every call site for display.
+    """
+    def __init__(self, budget=DEFAULT_BUDGET):
+        super().__init__()
+
+        self.budget = budget
+        self.decisions = []
+
+        # Holds the last call id used, calls copied into a caller get new ids
+        self._call_id = 0
+
+        return
+
+    def run(self, program, get_reg, reg_limit):
+        """Run Inliner
+
+        Inlines procedures into every function of the program. Callees are
+        handled before their callers so already inlined bodies are copied.
+
+        Arguments:
+            program: The Program object to rewrite.
+            get_reg: The register allocator of the code generator. Called
+                with no argument it returns a new register number, called
+                with False it returns the last register allocated.
+            reg_limit: The number of registers available to the program.
+        """
+        self.decisions = []
+
+        functions = dict((f.name, f) for f in program.functions
+                         if not any(i.op == 'raw' for i in f.instrs))
+        order, recursive = self._order_calls(functions)
+
+        self._call_id = max([ir.value(i.a) for f in program.functions
+                             for i in f.instrs if i.op == 'call'] + [0])
+
+        for function in order:
+            code = []
+
+            for instr in function.instrs:
+                if instr.op != 'call':
+                    code.append(instr)
+                    continue
+
+                callee = functions.get(instr.target)
+                reason = None
+
+                if callee is None:
+                    reason = 'runtime routine'
+                elif instr.target in recursive:
+                    reason = 'recursive'
+                elif self._size(callee) > self.budget:
+                    reason = 'over budget (%d > %d)' % (self._size(callee),
+                                                       self.budget)
+                elif get_reg(False) + self._reg_count(callee) >= reg_limit:
+                    reason = 'register limit'
+
+                self.decisions.append((function.name, instr.target,
+                                       ir.value(instr.a), reason))
+
+                if reason is None:
+                    code.extend(self._expand(instr, callee, get_reg))
+                else:
+                    code.append(instr)
+
+            function.instrs = code
+
+        return
+
+    def report(self):
+        """Report Decisions
+
+        Returns:
+            A multi-line string of the inlining decision of each call site.
+        """
+        lines = ['Inlining (budget %d):' % self.budget]
+
+        for caller, callee, call_id, reason in self.decisions:
+            site = '%s -> %s #%d' % (caller, callee, call_id)
+            lines.append('    %-40s %s' % (site, reason or 'inlined'))
+
+        inlined = sum(1 for d in self.decisions if d[3] is None)
+        lines.append('    call sites: %d inlined, %d kept' %
+                     (inlined, len(self.decisions) - inlined))
+
+        return '\n'.join(lines)
+
+    def _order_calls(self, functions):
+        """Order Calls (Protected)
+
+        Finds the strongly connected components of the call graph with
+        Tarjan's algorithm. A component is only complete once every
+        component it calls is, so they are found callees first. The walk
+        keeps its own stack, since a chain of calls may be deeper than the
+        Python recursion limit.
+
+        Arguments:
+            functions: A dictionary of function name to Function object.
+
+        Returns:
+            A tuple (order, recursive) of a list of the Function objects
+            where every non-recursive callee appears before its callers, and
+            the set of function names which can reach themselves through
+            procedure calls.
+        """
+        order = []
+        recursive = set()
+
+        # The visit number and lowest number reachable of each function
+        index = {}
+        low = {}
+
+        # Functions visited whose component is not yet complete
+        stack = []
+        on_stack = set()
+
+        for root in functions:
+            if root in index:
+                continue
+
+            # Each entry holds a function and an iterator over its callees
+            work = [(root, iter(functions[root].calls()))]
+            index[root] = low[root] = len(index)
+            stack.append(root)
+            on_stack.add(root)
+
+            while work:
+                name, callees = work[-1]
+                callee = next(callees, None)
+
+                if callee is not None:
+                    if callee not in functions:
+                        continue
+
+                    if callee not in index:
+                        index[callee] = low[callee] = len(index)
+                        stack.append(callee)
+                        on_stack.add(callee)
+                        work.append((callee, iter(functions[callee].calls())))
+                    elif callee in on_stack:
+                        low[name] = min(low[name], index[callee])
+
+                    continue
+
+                work.pop()
+
+                if work:
+                    caller = work[-1][0]
+                    low[caller] = min(low[caller], low[name])
+
+                if low[name] != index[name]:
+                    continue
+
+                # The function is the root of a complete component
+                component = []
+
+                while True:
+                    member = stack.pop()
+                    on_stack.discard(member)
+                    component.append(member)
+
+                    if member == name:
+                        break
+
+                if len(component) > 1 or name in functions[name].calls():
+                    recursive.update(component)
+
+                order.extend(functions[member] for member in
+                             reversed(component))
+
+        return order, recursive
+
+    def _size(self, function):
+        """Function Size (Protected)
+
+        Arguments:
+            function: The Function object to measure.
+
+        Returns:
+            The number of instructions in the function, not counting labels
+            and comments.
+        """
+        return sum(1 for i in function.instrs
+                   if i.op not in ['label', 'comment'])
+
+    def _reg_count(self, function):
+        """Register Count (Protected)
+
+        Arguments:
+            function: The Function object to check.
+
+        Returns:
+            The number of general registers written by the function.
+        """
+        return len(set(i.dst for i in function.instrs
+                       if i.dst is not None and i.dst > ir.HP))
+
+    def _expand(self, call, callee, get_reg):
+        """Expand Call (Protected)
+
+        Builds the instructions which replace a call with the callee body.
+        The caller FP is saved and the callee frame is set up just as the
+        call would have done, with the return address space left unused.
+
+        Arguments:
+            call: The 'call' Instr object to replace.
+            callee: The Function object of the called procedure.
+            get_reg: The register allocator of the code generator.
+
+        Returns:
+            A list of Instr objects.
+        """
+        call_id = ir.value(call.a)
+        end_label = '%s_%d' % (callee.name, call_id)
+        sp, fp = ir.reg(ir.SP), ir.reg(ir.FP)
+
+        # Every register and label of the copy must be unique
+        regs = {}
+        for instr in callee.instrs:
+            if instr.dst is not None and instr.dst > ir.HP and \
+                    instr.dst not in regs:
+                regs[instr.dst] = get_reg()
+
+        operands = dict((old, ir.reg(new)) for old, new in regs.items())
+
+        def rename(label):
+            return '%s_inline_%d' % (label, call_id)
+
+        code = [
+            ir.Instr('push', a=fp, tabs=call.tabs),
+            ir.Instr('alloc', a=ir.imm(1), tabs=call.tabs),
+            ir.Instr('mov', ir.FP, sp, tabs=call.tabs),
+        ]
+
+        body = [i for i in callee.instrs if not
+                (i.op == 'label' and i.target == callee.name)]
+
+        for index, instr in enumerate(body):
+            tabs = max(call.tabs + instr.tabs - 1, 0)
+
+            if instr.op == 'ret':
+                code.append(ir.Instr('mov', ir.SP, fp, tabs=tabs))
+
+                # The last return falls through to the end of the copy
+                if index != len(body) - 1:
+                    code.append(ir.Instr('jump', target=end_label,
+                                         tabs=tabs))
+                continue
+
+            copy = ir.Instr(instr.op, regs.get(instr.dst, instr.dst),
+                            instr.a, instr.b, instr.target, tabs)
+            copy.replace_uses(operands)
+
+            if instr.op in ['label', 'jump', 'branch'] or \
+                    instr.op in ir.BRANCH_OPS:
+                copy.target = rename(instr.target)
+            elif instr.op == 'call':
+                # Each copy of a call needs its own return label
+                self._call_id += 1
+                copy.a = ir.imm(self._call_id)
+
+            code.append(copy)
+
+        if any(i.op == 'jump' and i.target == end_label for i in code):
+            code.append(ir.Instr('label', target=end_label, tabs=call.tabs))
+
+        code.extend([
+            ir.Instr('pop', a=ir.imm(1), tabs=call.tabs),
+            ir.Instr('load', ir.FP, sp, tabs=call.tabs),
+        ])
+
+        return code
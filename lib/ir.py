@@ -0,0 +1,503 @@
+#!/usr/bin/env python3
+
+"""IR module
+
+Provides the three-address intermediate representation which sits between
+the parser and C emission. Every program or procedure body is held in its own
+Function object which may be partitioned into basic blocks linked by a
+control-flow graph.
+
+Operands are encoded compactly as plain integers. The lowest two bits hold
+the operand kind and the remaining bits hold the register number, immediate
+value or symbol table index.
+
+Author: Evan Sneath
+License: Open Software License v3.0
+
+Classes:
+    Instr: A single three-address instruction.
+    BasicBlock: A straight-line sequence of instructions in a function.
+    Function: The instructions of a single program or procedure body.
+    Program: The complete IR of a compiled source file.
+
+Functions:
+    reg: Encodes a register operand.
+    imm: Encodes an immediate integer operand.
+    kind: Gets the kind of an encoded operand.
+    value: Gets the register number, immediate or symbol index of an operand.
+    is_reg: Determines if an operand is a register.
+    is_imm: Determines if an operand is an immediate integer.
+"""
+
+# Operand kinds stored in the lowest two bits of an operand
+REG = 0
+IMM = 1
+SYM = 2
+
+# Special register numbers shared with the code generator
+SP = 1
+FP = 2
+HP = 3
+
+# Binary operations and their C operators
+BINARY_OPS = {
+    'add': '+', 'sub': '-', 'mul': '*', 'div': '/', 'and': '&', 'or': '|',
+    'lt': '<', 'gt': '>', 'le': '<=', 'ge': '>=', 'eq': '==', 'ne': '!=',
+}
+
+# Comparison operations and the comparison which is true when each is false
+COMPARISON_OPS = ['lt', 'gt', 'le', 'ge', 'eq', 'ne']
+INVERSE_COMPARISONS = {
+    'lt': 'ge', 'ge': 'lt', 'gt': 'le', 'le': 'gt', 'eq': 'ne', 'ne': 'eq',
+}
+
+# Compare-and-branch operations and the comparison they branch on
+BRANCH_OPS = dict(('b' + op, op) for op in COMPARISON_OPS)
+
+# Binary float operations and their C operators
+FLOAT_OPS = {'fadd': '+', 'fsub': '-', 'fmul': '*', 'fdiv': '/'}
+
+# Maps C operator symbols to binary operations
+OPERATORS = dict((symbol, op) for op, symbol in BINARY_OPS.items())
+FLOAT_OPERATORS = dict((symbol, op) for op, symbol in FLOAT_OPS.items())
+
+# Instructions which only compute a value into their destination register
+PURE_OPS = set(BINARY_OPS) | set(FLOAT_OPS) | {
+    'mov', 'not', 'load', 'fconst', 'i2f',
+}
+
+# Instructions which end a basic block
+TERMINATOR_OPS = {'jump', 'branch', 'call', 'ret', 'start'} | set(BRANCH_OPS)
+
+
+def reg(number):
+    """Register Operand
+
+    Arguments:
+        number: The register number.
+
+    Returns:
+        The encoded register operand.
+    """
+    return number << 2 | REG
+
+
+def imm(number):
+    """Immediate Operand
+
+    Arguments:
+        number: The integer value.
+
+    Returns:
+        The encoded immediate operand.
+    """
+    return int(number) << 2 | IMM
+
+
+def kind(operand):
+    """Operand Kind
+
+    Arguments:
+        operand: The encoded operand.
+
+    Returns:
+        REG, IMM or SYM.
+    """
+    return operand & 3
+
+
+def value(operand):
+    """Operand Value
+
+    Arguments:
+        operand: The encoded operand.
+
+    Returns:
+        The register number, immediate value or symbol index of the operand.
+    """
+    return operand >> 2
+
+
+def is_reg(operand):
+    """Operand Is Register
+
+    Arguments:
+        operand: The encoded operand, or None.
+
+    Returns:
+        True if the operand is a register, False otherwise.
+    """
+    return operand is not None and operand & 3 == REG
+
+
+def is_imm(operand):
+    """Operand Is Immediate
+
+    Arguments:
+        operand: The encoded operand, or None.
+
+    Returns:
+        True if the operand is an immediate integer, False otherwise.
+    """
+    return operand is not None and operand & 3 == IMM
+
+
+class Instr:
+    """Instr class
+
+    A single three-address instruction. Not every field is used by every
+    operation; unused fields are None.
+
+        mov     dst = a               load    dst = MM[a]
+        <binop> dst = a <op> b        store   MM[a] = b
+        not     dst = ~a              push    SP -= 1; MM[SP] = a
+        fconst  dst = float symbol a  pop     SP += a
+        i2f     dst = float(a)        alloc   SP -= a
+        <fop>   dst = a <fop> b       call    call procedure target
+        label   target:               ret     return to the caller
+        jump    goto target           start   run program target and exit
+        branch  if (!a) goto target   comment comment text target
+        b<cmp>  if (a <cmp> b) goto target
+
+    Attributes:
+        op: The operation name.
+        dst: The destination register number.
+        a: The first encoded operand.
+        b: The second encoded operand.
+        target: The label name of the instruction, or the comment text.
+        tabs: The indentation depth of the instruction once lowered to C.
+
+    Methods:
+        uses: Gets the register numbers read by the instruction.
+        replace_uses: Rewrites the operands read by the instruction.
+    """
+    __slots__ = ('op', 'dst', 'a', 'b', 'target', 'tabs')
+
+    def __init__(self, op, dst=None, a=None, b=None, target=None, tabs=0):
+        self.op = op
+        self.dst = dst
+        self.a = a
+        self.b = b
+        self.target = target
+        self.tabs = tabs
+
+    def uses(self):
+        """Get Uses
+
+        Returns:
+            A list of register numbers read by the instruction.
+        """
+        used = [value(o) for o in (self.a, self.b) if is_reg(o)]
+
+        # Stack operations implicitly read the SP
+        if self.op in ['push', 'pop', 'alloc']:
+            used.append(SP)
+
+        return used
+
+    def replace_uses(self, mapping):
+        """Replace Uses
+
+        Rewrites every register operand which appears in the mapping.
+
+        Arguments:
+            mapping: A dictionary of register number to encoded operand.
+
+        Returns:
+            True if any operand was replaced, False otherwise.
+        """
+        changed = False
+
+        if is_reg(self.a) and value(self.a) in mapping:
+            self.a = mapping[value(self.a)]
+            changed = True
+
+        if is_reg(self.b) and value(self.b) in mapping:
+            self.b = mapping[value(self.b)]
+            changed = True
+
+        return changed
+
+
+class BasicBlock:
+    """BasicBlock class
+
+    A straight-line sequence of instructions which is only entered at the
+    top and only left at the bottom.
+
+    Attributes:
+        index: The position of the block in its function.
+        instrs: The list of Instr objects in the block.
+        succs: The list of successor BasicBlock objects.
+        preds: The list of predecessor BasicBlock objects.
+    """
+    def __init__(self, index):
+        self.index = index
+        self.instrs = []
+        self.succs = []
+        self.preds = []
+
+    def labels(self):
+        """Block Labels
+
+        Returns:
+            The names of all labels at the top of the block.
+        """
+        names = []
+
+        for instr in self.instrs:
+            if instr.op == 'label':
+                names.append(instr.target)
+            elif instr.op != 'comment':
+                break
+
+        return names
+
+
+class Function:
+    """Function class
+
+    The instructions of a single program or procedure body.
+
+    Attributes:
+        name: The label name of the function entry point.
+        instrs: The list of Instr objects making up the function.
+        blocks: The list of BasicBlock objects after build_cfg() is called.
+
+    Methods:
+        append: Appends an instruction to the function.
+        build_cfg: Partitions the instructions into basic blocks.
+        flatten: Rebuilds the instruction list from the basic blocks.
+        calls: Gets the names of all functions called by this function.
+    """
+    def __init__(self, name):
+        self.name = name
+        self.instrs = []
+        self.blocks = []
+
+    def append(self, instr):
+        """Append Instruction
+
+        Arguments:
+            instr: The Instr object to add to the end of the function.
+        """
+        self.instrs.append(instr)
+        return
+
+    def build_cfg(self):
+        """Build Control-Flow Graph
+
+        Partitions the instruction list into basic blocks and links each block
+        to its successors and predecessors.
+
+        Returns:
+            The list of BasicBlock objects.
+        """
+        self.blocks = []
+        block = None
+
+        for instr in self.instrs:
+            # A label starts a new block unless the block is still empty
+            if block is None or (instr.op == 'label' and
+                                 any(i.op not in ['label', 'comment']
+                                     for i in block.instrs)):
+                block = BasicBlock(len(self.blocks))
+                self.blocks.append(block)
+
+            block.instrs.append(instr)
+
+            if instr.op in TERMINATOR_OPS:
+                block = None
+
+        # Link each block to its successors
+        owner = {}
+        for block in self.blocks:
+            for name in block.labels():
+                owner[name] = block
+
+        for block in self.blocks:
+            last = self._last(block)
+            op = last.op if last is not None else None
+
+            if (op in ['jump', 'branch'] or op in BRANCH_OPS) and \
+                    last.target in owner:
+                block.succs.append(owner[last.target])
+
+            # Everything but jumps, returns and exits falls through
+            if op not in ['jump', 'ret', 'start'] and \
+                    block.index + 1 < len(self.blocks):
+                following = self.blocks[block.index + 1]
+                if following not in block.succs:
+                    block.succs.append(following)
+
+            for succ in block.succs:
+                succ.preds.append(block)
+
+        return self.blocks
+
+    def flatten(self):
+        """Flatten Blocks
+
+        Rebuilds the instruction list from the current basic blocks.
+        """
+        self.instrs = [i for block in self.blocks for i in block.instrs]
+        return
+
+    def calls(self):
+        """Get Called Functions
+
+        Returns:
+            A list of the function names called by this function in order.
+        """
+        return [i.target for i in self.instrs if i.op == 'call']
+
+    def _last(self, block):
+        """Last Instruction (Protected)
+
+        Arguments:
+            block: The BasicBlock object to look in.
+
+        Returns:
+            The last non-comment Instr of the block, None if there is none.
+        """
+        for instr in reversed(block.instrs):
+            if instr.op != 'comment':
+                return instr
+
+        return None
+
+
+class Program:
+    """Program class
+
+    The complete IR of a compiled source file.
+
+    Attributes:
+        functions: The list of Function objects in output order. The first
+            function holds the program entry code.
+        symbols: The list of symbol texts referenced by SYM operands.
+
+    Methods:
+        symbol: Interns a symbol and returns its encoded operand.
+        symbol_text: Gets the text of an encoded symbol operand.
+        format_operand: Formats an operand for an IR dump.
+        format_instr: Formats an instruction for an IR dump.
+        dump: Formats the entire program for debugging.
+    """
+    def __init__(self):
+        self.functions = []
+        self.symbols = []
+
+        # Holds the symbol table index of each interned symbol text
+        self._symbol_ids = {}
+
+    def symbol(self, text):
+        """Intern Symbol
+
+        Arguments:
+            text: The C text of the symbol (literal, label address, etc).
+
+        Returns:
+            The encoded SYM operand of the symbol.
+        """
+        if text not in self._symbol_ids:
+            self._symbol_ids[text] = len(self.symbols)
+            self.symbols.append(text)
+
+        return self._symbol_ids[text] << 2 | SYM
+
+    def symbol_text(self, operand):
+        """Symbol Text
+
+        Arguments:
+            operand: The encoded SYM operand.
+
+        Returns:
+            The C text of the symbol.
+        """
+        return self.symbols[value(operand)]
+
+    def format_operand(self, operand):
+        """Format Operand
+
+        Arguments:
+            operand: The encoded operand.
+
+        Returns:
+            The operand as a readable string (r5, sp, 12, @MM_SIZE, ...).
+        """
+        if is_reg(operand):
+            names = {SP: 'sp', FP: 'fp', HP: 'hp'}
+            return names.get(value(operand), 'r%d' % value(operand))
+        elif is_imm(operand):
+            return str(value(operand))
+
+        return '@%s' % self.symbol_text(operand)
+
+    def format_instr(self, instr):
+        """Format Instruction
+
+        Arguments:
+            instr: The Instr object to format.
+
+        Returns:
+            The instruction as a readable string.
+        """
+        op = instr.op
+        a = self.format_operand(instr.a) if instr.a is not None else None
+        b = self.format_operand(instr.b) if instr.b is not None else None
+        dst = self.format_operand(reg(instr.dst)) \
+            if instr.dst is not None else None
+
+        if op == 'label':
+            return '%s:' % instr.target
+        elif op == 'comment':
+            return '; %s' % instr.target
+        elif op == 'raw':
+            return 'raw C (%d lines)' % (instr.target.count('\n') + 1)
+        elif op == 'mov':
+            return '%s = %s' % (dst, a)
+        elif op == 'load':
+            return '%s = load [%s]' % (dst, a)
+        elif op == 'store':
+            return 'store [%s], %s' % (a, b)
+        elif op == 'jump':
+            return 'goto %s' % instr.target
+        elif op == 'branch':
+            return 'if not %s goto %s' % (a, instr.target)
+        elif op in BRANCH_OPS:
+            return 'if %s %s %s goto %s' % (a, BINARY_OPS[BRANCH_OPS[op]], b,
+                                            instr.target)
+        elif op in ['call', 'start']:
+            return '%s %s' % (op, instr.target)
+        elif op == 'ret':
+            return op
+        elif dst is not None:
+            return '%s = %s %s' % (dst, op, ', '.join(o for o in (a, b) if o))
+
+        return '%s %s' % (op, ', '.join(o for o in (a, b) if o))
+
+    def dump(self):
+        """Dump Program
+
+        Formats every function of the program, partitioned into basic blocks
+        with their successors, for debugging.
+
+        Returns:
+            A multi-line string of the program IR.
+        """
+        lines = []
+
+        for function in self.functions:
+            lines.append('function %s' % function.name)
+
+            for block in function.build_cfg():
+                succs = ', '.join('B%d' % s.index for s in block.succs)
+                lines.append('  B%d -> [%s]' % (block.index, succs))
+
+                for instr in block.instrs:
+                    lines.append('    %s' % self.format_instr(instr))
+
+            lines.append('')
+
+        return '\n'.join(lines)
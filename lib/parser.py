@@ -36,6 +36,8 @@ class Parser(Scanner, CodeGenerator):
     Methods:
         parse: Parses the given file until a terminal error is encountered or
             the end-of-file token is reached.
+        parse_text: Parses source text held in memory like parse() does a
+            file.
     """
     def __init__(self, debug=False):
         super().__init__()
@@ -62,7 +64,8 @@ class Parser(Scanner, CodeGenerator):
 
         Arguments:
             src_path: The input source file to parse.
-            dest_path: The output target file to write.
+            dest_path: The output target file to write, or a stream to write
+                the code to.
 
         Returns:
             True on success, False otherwise.
@@ -71,6 +74,38 @@ class Parser(Scanner, CodeGenerator):
         if not self.attach_source(src_path):
             return False
 
+        return self._parse_attached(dest_path)
+
+    def parse_text(self, text, dest_path, name='<source>'):
+        """Begin Parsing Text
+
+        Begins the parse of source text held in memory.
+
+        Arguments:
+            text: The source code string to parse.
+            dest_path: The output target file to write, or a stream to write
+                the code to.
+            name: The name of the source in diagnostics. (Default: '<source>')
+
+        Returns:
+            True on success, False otherwise.
+        """
+        self.attach_text(text, name)
+
+        return self._parse_attached(dest_path)
+
+    def _parse_attached(self, dest_path):
+        """Parse Attached Source (Protected)
+
+        Parses the attached source and commits the generated code.
+
+        Arguments:
+            dest_path: The output target file to write, or a stream to write
+                the code to.
+
+        Returns:
+            True on success, False otherwise.
+        """
         # Attach the destination file for writing
         if not self.attach_destination(dest_path):
             return False
@@ -96,14 +131,17 @@ class Parser(Scanner, CodeGenerator):
 
         # Make sure there's no junk after the end of program
         if not self._check('eof'):
-            self._warning('eof', '')
+            token = self._current
+            self._warning('Expected end of file, encountered "%s" (%s)' %
+                          (token.value, token.type), token.line)
 
         # If errors were encountered, don't write code
         if self._has_errors:
             return False
 
         # Commit the code buffer to the output code file
-        self.commit()
+        if not self.commit():
+            return False
 
         return True
 
@@ -145,9 +183,7 @@ class Parser(Scanner, CodeGenerator):
             prefix: A string value to be printed at the start of the warning.
                 Overwritten for error messages. (Default: 'Warning')
         """
-        print('%s: "%s", line %d' % (prefix, self._src_path, line))
-        print('    %s' % msg)
-        print('    %s' % self._get_line(line))
+        self._diagnose(prefix.lower(), msg, line)
 
         return
 
@@ -310,8 +346,15 @@ class Parser(Scanner, CodeGenerator):
         Arguments:
             token_type: The id_type of the token to resync.
             token_value: The value of the token to resync. (Default: None)
+
+        Raises:
+            ParserSyntaxError: If the end of the file is reached first. The
+                error which led to the resync has already been reported.
         """
         while not self._check(token_type, token_value):
+            if self._check('eof'):
+                raise ParserSyntaxError()
+
             self._advance_token()
 
         return
@@ -394,12 +437,8 @@ class Parser(Scanner, CodeGenerator):
             self._match('symbol', ';')
 
         # Label the entry point for the program
-        self.generate('%s_%d_begin:' % (program_id.name, program_id.mm_ptr))
-        self.tab_push()
-
-        if local_var_size != 0:
-            self.comment('Allocating space for local variables', self.debug)
-            self.generate('R[SP] = R[SP] - %d;' % local_var_size)
+        self.generate_procedure_entry(program_id.name, program_id.mm_ptr,
+                                      local_var_size, self.debug)
 
         while not self._accept('keyword', 'end'):
             try:
@@ -411,9 +450,11 @@ class Parser(Scanner, CodeGenerator):
 
         self._match('keyword', 'program')
 
+        # Jump to the program exit
+        self.generate_procedure_exit(self.debug)
+
         # Pop out of the program body scope
         self._ids.pop_scope()
-        self.tab_pop()
 
         return
 
@@ -626,14 +667,6 @@ class Parser(Scanner, CodeGenerator):
                 self._name_error('name already declared at global scope',
                                  param.id.name, id_line)
 
-        # Define the entry point for the function w/ unique identifier
-        self.generate('%s_%d:' % (id_obj.name, id_obj.mm_ptr))
-        self.tab_push()
-
-        # Define the beginning of the function body
-        self.generate('goto %s_%d_begin;' % (id_obj.name, id_obj.mm_ptr))
-        self.generate('')
-
         return id_obj
 
     def _parse_procedure_body(self, procedure_id):
@@ -663,21 +696,15 @@ class Parser(Scanner, CodeGenerator):
 
                 # If this was a local var, allocate space for it
                 if size is not None:
-                    local_var_size += size
+                    local_var_size += int(size)
             except ParserError:
                 self._resync_at_token('symbol', ';')
 
             self._match('symbol', ';')
 
-        # Define the function begin point
-        self.generate('%s_%d_begin:' %
-                      (procedure_id.name, procedure_id.mm_ptr))
-
-        self.tab_push()
-
-        if local_var_size != 0:
-            self.comment('Allocating space for local variables', self.debug)
-            self.generate('R[SP] = R[SP] - %d;' % local_var_size)
+        # Define the function entry and begin points
+        self.generate_procedure_entry(procedure_id.name, procedure_id.mm_ptr,
+                                      local_var_size, self.debug)
 
         # Accept any statements
         while not self._accept('keyword', 'end'):
@@ -691,12 +718,9 @@ class Parser(Scanner, CodeGenerator):
         self._match('keyword', 'procedure')
 
         # Generate code to jump back to the caller scope
-        self.generate_return(self.debug)
-        self.generate('')
+        self.generate_procedure_exit(self.debug)
 
-        self.tab_pop()
         self._ids.pop_scope()
-        self.tab_pop()
 
         return
 
@@ -871,7 +895,7 @@ class Parser(Scanner, CodeGenerator):
         label_id = self.get_label_id()
         expr_reg = self.get_reg(inc=False)
 
-        self.generate('if (!R[%d]) goto else_%d;' % (expr_reg, label_id))
+        self.generate_branch(expr_reg, 'else_%d' % label_id)
         self.tab_push()
 
         while True:
@@ -885,10 +909,10 @@ class Parser(Scanner, CodeGenerator):
             if self._check('keyword', 'else') or self._check('keyword', 'end'):
                 break
 
-        self.generate('goto endif_%d;' % label_id)
+        self.generate_jump('endif_%d' % label_id)
 
         self.tab_pop()
-        self.generate('else_%d:' % label_id)
+        self.generate_label('else_%d' % label_id)
         self.tab_push()
 
         if self._accept('keyword', 'else'):
@@ -907,7 +931,7 @@ class Parser(Scanner, CodeGenerator):
         self._match('keyword', 'if')
 
         self.tab_pop()
-        self.generate('endif_%d:' % label_id)
+        self.generate_label('endif_%d' % label_id)
 
         return
 
@@ -938,7 +962,7 @@ class Parser(Scanner, CodeGenerator):
         self._match('symbol', '(')
 
         label_id = self.get_label_id()
-        self.generate('loop_%d:' % label_id)
+        self.generate_label('loop_%d' % label_id)
         self.tab_push()
 
         try:
@@ -952,7 +976,7 @@ class Parser(Scanner, CodeGenerator):
         self._match('symbol', ')')
 
         expr_reg = self.get_reg(inc=False)
-        self.generate('if (!R[%d]) goto endloop_%d;' % (expr_reg, label_id))
+        self.generate_branch(expr_reg, 'endloop_%d' % label_id)
 
         while not self._accept('keyword', 'end'):
             try:
@@ -964,9 +988,9 @@ class Parser(Scanner, CodeGenerator):
 
         self._match('keyword', 'for')
 
-        self.generate('goto loop_%d;' % label_id)
+        self.generate_jump('loop_%d' % label_id)
         self.tab_pop()
-        self.generate('endloop_%d:' % label_id)
+        self.generate_label('endloop_%d' % label_id)
 
         return
 
@@ -1090,9 +1114,10 @@ class Parser(Scanner, CodeGenerator):
         param = params[index]
 
         if param.direction == 'out':
-            # We may only parse a single identifier if the direction is 'out'
+            # We may only parse a single identifier if the direction is 'out'.
+            # An 'out' param of the caller may be passed on to be written
             arg_name = self._current.value
-            arg_type = self._parse_name()
+            arg_type = self._parse_name(is_out_arg=True)
 
             out_names.append(arg_name)
         elif param.direction == 'in':
@@ -1217,7 +1242,7 @@ class Parser(Scanner, CodeGenerator):
                                              next_type, operation)
 
             if negate:
-                self.generate('R[%d] = ~R[%d];' % (result, result))
+                self.generate_not(result)
 
         return id_type
 
@@ -1392,15 +1417,15 @@ class Parser(Scanner, CodeGenerator):
             id_type = 'string'
             str_val = self._previous.value
 
-            self.generate('R[%d] = (int)"%s";' % (self.get_reg(), str_val))
+            self.generate_string(str_val)
         elif self._accept('keyword', 'true'):
             id_type = 'bool'
 
-            self.generate('R[%d] = 1;' % (self.get_reg()))
+            self.generate_number('1', 'integer', False)
         elif self._accept('keyword', 'false'):
             id_type = 'bool'
 
-            self.generate('R[%d] = 0;' % (self.get_reg()))
+            self.generate_number('0', 'integer', False)
         elif self._accept('symbol', '-'):
             if self._first_name():
                 id_type = self._parse_name()
@@ -1430,13 +1455,17 @@ class Parser(Scanner, CodeGenerator):
         """
         return self._check('identifier')
 
-    def _parse_name(self):
+    def _parse_name(self, is_out_arg=False):
         """<name> (Protected)
 
         Parses <name> language structure.
 
             <name> ::=
                 <identifier> [ '[' <expression> ']' ]
+
+        Arguments:
+            is_out_arg: True if the name is an 'out' argument of a procedure
+                call, which may be an 'in' or an 'out' param. (Default: False)
         """
         id_name = self._current.value
         id_line = self._current.line
@@ -1473,8 +1502,9 @@ class Parser(Scanner, CodeGenerator):
         # Determine the location of the identifier in the stack
         id_location = self._ids.get_id_location(id_name)
 
-        # Verify the direction of the id if it is a param
-        if id_location == 'param':
+        # Verify the direction of the id if it is a param. An 'out' argument
+        # may be a param of either direction, which is written by the call
+        if id_location == 'param' and not is_out_arg:
             direction = self._ids.get_param_direction(id_name)
             if direction != 'in':
                 self._type_error('\'in\' param',
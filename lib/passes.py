@@ -0,0 +1,497 @@
+#!/usr/bin/env python3
+
+"""Passes module
+
+Provides the optimization passes which run over the three-address IR and the
+pass manager which schedules and times them. Every pass is a function which
+takes a Function and its Program, rewrites the function in place and returns
+the number of changes it made.
+
+Author: Evan Sneath
+License: Open Software License v3.0
+
+Classes:
+    PassManager: Runs a pipeline of passes over a program with timing.
+
+Functions:
+    propagate_constants: Propagates and folds constant register values.
+    propagate_copies: Replaces uses of copied registers with their source.
+    eliminate_common_subexpressions: Reuses values computed earlier in a block.
+    eliminate_dead_code: Removes unused computations and unreachable blocks.
+"""
+
+import re
+import time
+from collections import Counter
+
+from lib import ir
+
+
+def _wrap(number):
+    """Wrap Integer (Protected)
+
+    Wraps an integer to the range of a 32-bit signed C integer.
+
+    Arguments:
+        number: The integer to wrap.
+
+    Returns:
+        The wrapped integer.
+    """
+    return (number + 2**31) % 2**32 - 2**31
+
+
+def _fold(op, a, b):
+    """Fold Operation (Protected)
+
+    Computes a binary operation on two constant integers with the semantics
+    of the generated C code.
+
+    Arguments:
+        op: The binary operation name.
+        a: The first integer operand.
+        b: The second integer operand.
+
+    Returns:
+        The integer result, or None if the operation cannot be folded.
+    """
+    if op == 'div':
+        if b == 0:
+            return None
+        # C division truncates toward zero
+        quotient = abs(a) // abs(b)
+        return _wrap(quotient if (a < 0) == (b < 0) else -quotient)
+
+    results = {
+        'add': lambda: a + b, 'sub': lambda: a - b, 'mul': lambda: a * b,
+        'and': lambda: a & b, 'or': lambda: a | b,
+        'lt': lambda: int(a < b), 'gt': lambda: int(a > b),
+        'le': lambda: int(a <= b), 'ge': lambda: int(a >= b),
+        'eq': lambda: int(a == b), 'ne': lambda: int(a != b),
+    }
+
+    return _wrap(results[op]())
+
+
+def _fold_branch(instr):
+    """Fold Branch (Protected)
+
+    Determines the outcome of a branch on constant immediates.
+
+    Arguments:
+        instr: The Instr object to check.
+
+    Returns:
+        True if the branch is always taken, False if it is never taken, or
+        None if the outcome is not known.
+    """
+    if instr.op == 'branch' and ir.is_imm(instr.a):
+        return ir.value(instr.a) == 0
+
+    if instr.op in ir.BRANCH_OPS and ir.is_imm(instr.a) and \
+            ir.is_imm(instr.b):
+        return _fold(ir.BRANCH_OPS[instr.op], ir.value(instr.a),
+                     ir.value(instr.b)) == 1
+
+    return None
+
+
+def _is_opaque(function):
+    """Function Is Opaque (Protected)
+
+    Determines if a function holds raw C code which the passes cannot reason
+    about (the header and runtime functions).
+
+    Arguments:
+        function: The Function object to check.
+
+    Returns:
+        True if the function must be left untouched, False otherwise.
+    """
+    return any(instr.op == 'raw' for instr in function.instrs)
+
+
+def _defines(instr):
+    """Defined Registers (Protected)
+
+    Arguments:
+        instr: The Instr object to check.
+
+    Returns:
+        A list of register numbers written by the instruction, or None if the
+        instruction may write any register (procedure calls).
+    """
+    if instr.op == 'call':
+        return None
+    elif instr.op in ['push', 'pop', 'alloc']:
+        return [ir.SP]
+    elif instr.dst is not None:
+        return [instr.dst]
+
+    return []
+
+
+def propagate_constants(function, program):
+    """Propagate Constants
+
+    Replaces every use of a register which is only ever assigned a single
+    immediate value with that value, then folds operations whose operands
+    are all immediates. Branches on immediates become jumps or are removed.
+    This repeats until nothing changes.
+
+    Arguments:
+        function: The Function object to optimize.
+        program: The Program object holding the function.
+
+    Returns:
+        The number of operands replaced and operations folded.
+    """
+    if _is_opaque(function):
+        return 0
+
+    changes = 0
+
+    while True:
+        # Find each register's definitions in this function
+        defs = Counter(i.dst for i in function.instrs if i.dst is not None)
+        constants = {}
+
+        for instr in function.instrs:
+            if (instr.op == 'mov' and defs[instr.dst] == 1 and
+                    instr.dst > ir.HP and not ir.is_reg(instr.a)):
+                constants[instr.dst] = instr.a
+
+        changed = 0
+        kept = []
+
+        for instr in function.instrs:
+            if instr.replace_uses(constants):
+                changed += 1
+
+            taken = _fold_branch(instr)
+
+            if taken is not None:
+                changed += 1
+                if not taken:
+                    continue
+                instr.op, instr.a, instr.b = 'jump', None, None
+
+            kept.append(instr)
+
+            if (instr.op in ir.BINARY_OPS and ir.is_imm(instr.a) and
+                    ir.is_imm(instr.b)):
+                result = _fold(instr.op, ir.value(instr.a),
+                               ir.value(instr.b))
+
+                if result is not None:
+                    instr.op, instr.a, instr.b = 'mov', ir.imm(result), None
+                    changed += 1
+            elif instr.op == 'not' and ir.is_imm(instr.a):
+                instr.op, instr.a = 'mov', ir.imm(~ir.value(instr.a))
+                changed += 1
+
+        function.instrs = kept
+        changes += changed
+
+        if not changed:
+            break
+
+    return changes
+
+
+def propagate_copies(function, program):
+    """Propagate Copies
+
+    Within each basic block, replaces uses of a register which was copied
+    from another operand with that operand, as long as neither has been
+    redefined since the copy.
+
+    Arguments:
+        function: The Function object to optimize.
+        program: The Program object holding the function.
+
+    Returns:
+        The number of instructions rewritten.
+    """
+    if _is_opaque(function):
+        return 0
+
+    changes = 0
+
+    for block in function.build_cfg():
+        copies = {}
+
+        for instr in block.instrs:
+            if instr.replace_uses(copies):
+                changes += 1
+
+            defined = _defines(instr)
+
+            if defined is None:
+                copies = {}
+                continue
+
+            # Forget every copy which involves a redefined register
+            for number in defined:
+                copies.pop(number, None)
+                for dst, src in list(copies.items()):
+                    if ir.is_reg(src) and ir.value(src) == number:
+                        del copies[dst]
+
+            if instr.op == 'mov' and instr.dst > ir.HP and \
+                    instr.a != ir.reg(instr.dst):
+                copies[instr.dst] = instr.a
+
+    function.flatten()
+
+    return changes
+
+
+def eliminate_common_subexpressions(function, program):
+    """Eliminate Common Subexpressions
+
+    Numbers the values computed in each basic block. When a value has
+    already been computed into a register which still holds it, the
+    computation is replaced with a copy of that register. Loads are also
+    replaced with the value last stored to the same address.
+
+    Arguments:
+        function: The Function object to optimize.
+        program: The Program object holding the function.
+
+    Returns:
+        The number of computations replaced.
+    """
+    if _is_opaque(function):
+        return 0
+
+    changes = 0
+
+    for block in function.build_cfg():
+        # Maps (op, a, b) value keys to the operand holding the value
+        values = {}
+
+        for instr in block.instrs:
+            defined = _defines(instr)
+
+            if defined is None:
+                values = {}
+                continue
+
+            key = None
+
+            if instr.op in ir.PURE_OPS and instr.op != 'mov':
+                key = (instr.op, instr.a, instr.b)
+
+                if key in values:
+                    instr.op, instr.a, instr.b = 'mov', values[key], None
+                    changes += 1
+                    key = None
+
+            # Memory writes invalidate every remembered load
+            if instr.op in ['store', 'push', 'alloc']:
+                values = dict((k, v) for k, v in values.items()
+                              if k[0] != 'load')
+
+            for number in defined:
+                operand = ir.reg(number)
+                values = dict((k, v) for k, v in values.items()
+                              if operand not in k and v != operand)
+
+            # A stored value may be reused by a later load of the address
+            if instr.op == 'store':
+                values[('load', instr.a, None)] = instr.b
+
+            # A value is only remembered if it did not overwrite an operand
+            if key is not None and ir.reg(instr.dst) not in key:
+                values[key] = ir.reg(instr.dst)
+
+    function.flatten()
+
+    return changes
+
+
+def eliminate_dead_code(function, program):
+    """Eliminate Dead Code
+
+    Removes basic blocks which cannot be reached and computations whose
+    results are never read, using a liveness analysis over the control-flow
+    graph of the function.
+
+    Arguments:
+        function: The Function object to optimize.
+        program: The Program object holding the function.
+
+    Returns:
+        The number of instructions removed.
+    """
+    if _is_opaque(function):
+        return 0
+
+    blocks = function.build_cfg()
+
+    if not blocks:
+        return 0
+
+    # Labels whose address is taken may be jumped to from anywhere
+    address_taken = set()
+    for text in program.symbols:
+        address_taken.update(re.findall(r'&&(\w+)', text))
+
+    reachable = set()
+    work = [blocks[0]] + [b for b in blocks
+                          if address_taken.intersection(b.labels())]
+
+    while work:
+        block = work.pop()
+        if block.index not in reachable:
+            reachable.add(block.index)
+            work.extend(block.succs)
+
+    removed = sum(1 for b in blocks if b.index not in reachable
+                  for i in b.instrs if i.op != 'comment')
+
+    function.blocks = [b for b in blocks if b.index in reachable]
+    function.flatten()
+    blocks = function.build_cfg()
+
+    # Compute the registers read before being written in each block
+    gen = []
+    kill = []
+
+    for block in blocks:
+        read = set()
+        written = set()
+
+        for instr in block.instrs:
+            read.update(n for n in instr.uses() if n not in written)
+            if instr.dst is not None:
+                written.add(instr.dst)
+
+        gen.append(read)
+        kill.append(written)
+
+    # Iterate the liveness equations to a fixed point
+    live_in = [set() for _ in blocks]
+    live_out = [set() for _ in blocks]
+    changed = True
+
+    while changed:
+        changed = False
+
+        for block in reversed(blocks):
+            out = set()
+            for succ in block.succs:
+                out |= live_in[succ.index]
+
+            new_in = gen[block.index] | (out - kill[block.index])
+
+            if out != live_out[block.index] or new_in != live_in[block.index]:
+                live_out[block.index] = out
+                live_in[block.index] = new_in
+                changed = True
+
+    # Walk each block backwards dropping unread pure computations
+    for block in blocks:
+        live = set(live_out[block.index])
+        kept = []
+
+        for instr in reversed(block.instrs):
+            if (instr.op in ir.PURE_OPS and instr.dst > ir.HP and
+                    instr.dst not in live):
+                removed += 1
+                continue
+
+            if instr.dst is not None:
+                live.discard(instr.dst)
+            live.update(instr.uses())
+
+            kept.append(instr)
+
+        block.instrs = list(reversed(kept))
+
+    function.flatten()
+
+    return removed
+
+
+"""The registry of all available passes by name."""
+PASSES = {
+    'constprop': propagate_constants,
+    'copyprop': propagate_copies,
+    'cse': eliminate_common_subexpressions,
+    'dce': eliminate_dead_code,
+}
+
+"""The pass pipeline used when none is given to the pass manager."""
+DEFAULT_PIPELINE = ['constprop', 'copyprop', 'cse', 'copyprop', 'dce']
+
+
+class PassManager:
+    """PassManager class
+
+    Runs a pipeline of IR optimization passes over every function of a
+    program and records the time spent and changes made by each pass.
+
+    Attributes:
+        pipeline: The list of pass names to run, in order.
+        timings: A Counter of the total seconds spent in each pass.
+        changes: A Counter of the total changes made by each pass.
+
+    Methods:
+        run: Runs the pipeline over a program.
+        report: Formats the collected timings for display.
+    """
+    def __init__(self, pipeline=None):
+        super().__init__()
+
+        self.pipeline = list(pipeline if pipeline is not None else
+                             DEFAULT_PIPELINE)
+
+        for name in self.pipeline:
+            if name not in PASSES:
+                raise ValueError('unknown IR pass "%s"' % name)
+
+        self.timings = Counter()
+        self.changes = Counter()
+
+        return
+
+    def run(self, program):
+        """Run Pipeline
+
+        Runs each pass of the pipeline over every function of the program.
+
+        Arguments:
+            program: The Program object to optimize.
+        """
+        for index, name in enumerate(self.pipeline):
+            # Passes may appear more than once, so time each position
+            label = '%d:%s' % (index + 1, name)
+            start = time.perf_counter()
+
+            for function in program.functions:
+                self.changes[label] += PASSES[name](function, program)
+
+            self.timings[label] += time.perf_counter() - start
+
+        return
+
+    def report(self):
+        """Report Statistics
+
+        Returns:
+            A multi-line string of the time and changes of every pass.
+        """
+        lines = ['IR optimization:']
+
+        for index, name in enumerate(self.pipeline):
+            label = '%d:%s' % (index + 1, name)
+            lines.append('    %-24s %6d changes %9.3f ms' %
+                         (label, self.changes[label],
+                          self.timings[label] * 1000))
+
+        total = sum(self.timings.values()) * 1000
+        lines.append('    %-24s %24.3f ms' % ('total', total))
+
+        return '\n'.join(lines)
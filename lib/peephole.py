@@ -0,0 +1,755 @@
+#!/usr/bin/env python3
+
+"""Peephole module
+
+Provides a peephole optimization stage which sits between the code generator
+and the destination file. The generated statement stream is decoded into a
+structured list of statements and a set of patterns is repeatedly matched
+against small windows of that list until no more rewrites are possible.
+
+Author: Evan Sneath
+License: Open Software License v3.0
+
+Classes:
+    Statement: A named tuple object describing one decoded C statement.
+    Pattern: The base class for all peephole patterns.
+    SinkStackAdjust: Moves SP adjustments below stack-relative statements.
+    MergeStackAdjust: Merges adjacent SP adjustments into one.
+    FoldRedefinition: Folds a register into its own immediate redefinition.
+    ForwardSingleUse: Forwards a single-use register into its only use.
+    ForwardStoredValue: Replaces a reload of a just-stored address.
+    RemoveDeadStore: Removes a store overwritten by the following store.
+    RemoveJumpToNext: Removes jumps to an immediately following label.
+    RemoveUnreachable: Removes statements following an unconditional jump.
+    RemoveDeadLabel: Removes labels which are never referenced.
+    PeepholeOptimizer: Runs a pattern set over a statement stream.
+
+Functions:
+    decode: Decodes a line of generated code into a Statement object.
+"""
+
+import re
+from collections import Counter, namedtuple
+
+
+"""Statement class
+
+A named tuple object factory containing a decoded statement of generated code.
+
+Attributes:
+    kind: The statement kind. One of 'blank', 'label', 'jump', 'exit',
+        'branch', 'stack', 'assign', or 'raw'.
+    args: A tuple of kind specific values (label name, SP delta, etc).
+    text: The C text of the statement without indentation.
+    tabs: The indentation depth of the statement.
+    regs: A Counter of each register number referenced by the statement.
+    refs: A Counter of each label name referenced by the statement.
+"""
+Statement = namedtuple('Statement',
+        ['kind', 'args', 'text', 'tabs', 'regs', 'refs'])
+
+
+# Regular expressions used to decode each generated line of code
+_RE_LABEL = re.compile(r'^([A-Za-z_]\w*):$')
+_RE_JUMP = re.compile(r'^goto ([A-Za-z_]\w*);$')
+_RE_EXIT = re.compile(r'^(goto \*|return\b)')
+_RE_BRANCH = re.compile(r'^if \((.*)\) goto ([A-Za-z_]\w*);$')
+_RE_STACK = re.compile(r'^R\[SP\] = R\[SP\] ([+-]) (\d+);$')
+_RE_ASSIGN = re.compile(r'^(R\[\w+\]|MM\[.*?\]) = (.*);$')
+_RE_REG = re.compile(r'RF?\[(\d+)\]')
+_RE_LABEL_REF = re.compile(r'(?:goto |&&)([A-Za-z_]\w*)')
+_RE_SP_REF = re.compile(r'R\[SP\](?: ([+-]) (\d+))?(?=[\];])')
+_RE_ATOM = re.compile(r'^(-?\d+|R\[\w+\])$')
+_RE_CALL = re.compile(r'\b[A-Za-z_]\w*\s*\(')
+
+
+def decode(text, tabs=0):
+    """Decode Statement
+
+    Decodes a single line of generated code into a Statement object.
+
+    Arguments:
+        text: The C code of the statement without indentation.
+        tabs: The indentation depth of the statement. (Default: 0)
+
+    Returns:
+        The decoded Statement object.
+    """
+    regs = Counter(int(r) for r in _RE_REG.findall(text))
+    refs = Counter(_RE_LABEL_REF.findall(text))
+
+    kind = 'raw'
+    args = ()
+
+    if '\n' in text:
+        # Multi-line blocks (header, runtime) are opaque to all patterns
+        pass
+    elif text == '' or text.startswith('//'):
+        kind = 'blank'
+    elif _RE_LABEL.match(text):
+        kind = 'label'
+        args = (_RE_LABEL.match(text).group(1),)
+    elif _RE_JUMP.match(text):
+        kind = 'jump'
+        args = (_RE_JUMP.match(text).group(1),)
+    elif _RE_EXIT.match(text):
+        kind = 'exit'
+    elif _RE_BRANCH.match(text):
+        kind = 'branch'
+        args = _RE_BRANCH.match(text).groups()
+    elif _RE_STACK.match(text):
+        sign, value = _RE_STACK.match(text).groups()
+        kind = 'stack'
+        args = (int(value) if sign == '+' else -int(value),)
+    elif _RE_ASSIGN.match(text):
+        kind = 'assign'
+        args = _RE_ASSIGN.match(text).groups()
+
+    return Statement(kind, args, text, tabs, regs, refs)
+
+
+def _stack_adjust(delta, tabs):
+    """Stack Adjust Statement (Protected)
+
+    Builds a statement which moves the SP by the given delta.
+
+    Arguments:
+        delta: The signed number of memory spaces to move the SP.
+        tabs: The indentation depth of the statement.
+
+    Returns:
+        The Statement object of the SP adjustment.
+    """
+    sign = '+' if delta > 0 else '-'
+    return decode('R[SP] = R[SP] %s %d;' % (sign, abs(delta)), tabs)
+
+
+def _is_atom(expr):
+    """Is Atomic Expression (Protected)
+
+    Determines if an expression may be substituted without parentheses.
+
+    Arguments:
+        expr: The C expression text.
+
+    Returns:
+        True if the expression is a literal or a register, False otherwise.
+    """
+    return _RE_ATOM.match(expr) is not None
+
+
+def _substitute(text, reg, expr):
+    """Substitute Register (Protected)
+
+    Replaces the single reference of a register in a statement with an
+    expression, parenthesizing the expression where necessary.
+
+    Arguments:
+        text: The C code of the statement.
+        reg: The register number to replace.
+        expr: The C expression to place in the register's location.
+
+    Returns:
+        The C code of the statement with the register substituted.
+    """
+    name = 'R[%d]' % reg
+    index = text.find(name)
+
+    if index == -1:
+        return text
+
+    before = text[:index]
+    after = text[index+len(name):]
+
+    # Memory indices and whole expressions need no parentheses
+    bare = (before.endswith('[') and after.startswith(']') or
+            before == '' and after == '')
+
+    if not bare and not _is_atom(expr):
+        expr = '(%s)' % expr
+
+    return before + expr + after
+
+
+def _is_pure(expr):
+    """Is Pure Expression (Protected)
+
+    Determines if an expression may be moved or repeated without changing the
+    behavior of the program.
+
+    Arguments:
+        expr: The C expression text.
+
+    Returns:
+        True if the expression has no side effects, False otherwise.
+    """
+    return _RE_CALL.search(expr) is None
+
+
+class Pattern:
+    """Pattern class
+
+    The base class of all peephole patterns. A pattern looks at a window of
+    consecutive significant statements (blank lines and comments are not
+    significant) and either returns a replacement list or None.
+
+    Attributes:
+        name: The name of the pattern used when reporting statistics.
+        size: The number of significant statements in the matched window.
+
+    Methods:
+        apply: Attempts to rewrite the given window of statements.
+    """
+    name = 'pattern'
+    size = 1
+
+    def apply(self, window, context):
+        """Apply Pattern
+
+        Attempts to match and rewrite the given window of statements.
+
+        Arguments:
+            window: A list of Statement objects of length size.
+            context: The PeepholeOptimizer holding whole-stream reference
+                counts for registers and labels.
+
+        Returns:
+            A list of replacement Statement objects if the pattern matched,
+            None otherwise.
+        """
+        raise NotImplementedError()
+
+
+class SinkStackAdjust(Pattern):
+    """SinkStackAdjust class
+
+    Moves an SP adjustment below the following statement, rebasing any
+    SP-relative operand of that statement. Repeated application gathers all
+    adjustments of a push or pop sequence in front of the next barrier.
+    """
+    name = 'sink-stack-adjust'
+    size = 2
+
+    def apply(self, window, context):
+        adjust, stmt = window
+
+        if adjust.kind != 'stack':
+            return None
+
+        if stmt.kind not in ['assign', 'raw'] or '\n' in stmt.text:
+            return None
+
+        if stmt.kind == 'raw' and ('goto' in stmt.text or
+                                    'return' in stmt.text):
+            return None
+
+        if stmt.kind == 'assign' and stmt.args[0] == 'R[SP]':
+            return None
+
+        # Every reference to the SP must be a rebasable memory offset
+        if stmt.text.count('R[SP]') != len(_RE_SP_REF.findall(stmt.text)):
+            return None
+
+        delta = adjust.args[0]
+
+        def rebase(match):
+            offset = int(match.group(2) or 0)
+            offset = offset if match.group(1) != '-' else -offset
+            offset += delta
+
+            if offset == 0:
+                return 'R[SP]'
+
+            return 'R[SP] %s %d' % ('+' if offset > 0 else '-', abs(offset))
+
+        text = _RE_SP_REF.sub(rebase, stmt.text)
+
+        return [decode(text, stmt.tabs), adjust]
+
+
+class MergeStackAdjust(Pattern):
+    """MergeStackAdjust class
+
+    Merges two adjacent SP adjustments into one. Adjustments which cancel
+    each other out are removed entirely, as are adjustments directly
+    followed by an assignment of the SP.
+    """
+    name = 'merge-stack-adjust'
+    size = 2
+
+    def apply(self, window, context):
+        first, second = window
+
+        if first.kind != 'stack':
+            return None
+
+        if (second.kind == 'assign' and second.args[0] == 'R[SP]' and
+                'R[SP]' not in second.args[1]):
+            return [second]
+
+        if second.kind != 'stack':
+            return None
+
+        delta = first.args[0] + second.args[0]
+
+        if delta == 0:
+            return []
+
+        return [_stack_adjust(delta, first.tabs)]
+
+
+class FoldRedefinition(Pattern):
+    """FoldRedefinition class
+
+    Folds the value of a register into the statement which immediately
+    redefines it using its old value (R[a] = E; R[a] = F(R[a]) becomes
+    R[a] = F(E)). This collapses address calculations into one expression.
+    """
+    name = 'fold-redefinition'
+    size = 2
+
+    def apply(self, window, context):
+        first, second = window
+
+        if first.kind != 'assign' or second.kind != 'assign':
+            return None
+
+        target = first.args[0]
+
+        if target != second.args[0] or not target[2:-1].isdigit():
+            return None
+
+        reg = int(target[2:-1])
+
+        if first.regs[reg] != 1 or second.regs[reg] != 2:
+            return None
+
+        if not _is_pure(first.args[1]):
+            return None
+
+        rhs = _substitute(second.args[1], reg, first.args[1])
+
+        return [decode('%s = %s;' % (target, rhs), second.tabs)]
+
+
+class ForwardSingleUse(Pattern):
+    """ForwardSingleUse class
+
+    Forwards the expression assigned to a register into the immediately
+    following statement when that statement is the register's only use in
+    the entire program. The register assignment is then removed.
+    """
+    name = 'forward-single-use'
+    size = 2
+
+    def apply(self, window, context):
+        first, second = window
+
+        if first.kind != 'assign':
+            return None
+
+        if second.kind not in ['assign', 'branch']:
+            return None
+
+        target = first.args[0]
+
+        if not target[2:-1].isdigit() or second.args[0] == target:
+            return None
+
+        reg = int(target[2:-1])
+
+        # The definition and the single use must be the only references
+        if (context.reg_counts[reg] != 2 or first.regs[reg] != 1 or
+                second.regs[reg] != 1):
+            return None
+
+        if not _is_pure(first.args[1]):
+            return None
+
+        if second.kind == 'branch':
+            cond = _substitute(second.args[0], reg, first.args[1])
+            text = 'if (%s) goto %s;' % (cond, second.args[1])
+        else:
+            rhs = _substitute(second.args[1], reg, first.args[1])
+            lhs = _substitute(second.args[0], reg, first.args[1])
+            text = '%s = %s;' % (lhs, rhs)
+
+        return [decode(text, second.tabs)]
+
+
+class ForwardStoredValue(Pattern):
+    """ForwardStoredValue class
+
+    Replaces the load of a memory address which was stored to by the
+    previous statement with a copy of the stored value.
+    """
+    name = 'forward-stored-value'
+    size = 2
+
+    def apply(self, window, context):
+        store, load = window
+
+        if store.kind != 'assign' or load.kind != 'assign':
+            return None
+
+        address = store.args[0]
+
+        if not address.startswith('MM[') or load.args[1] != address:
+            return None
+
+        value = store.args[1]
+
+        if 'MM' in address[3:] or 'MM' in value or not _is_atom(value):
+            return None
+
+        return [store, decode('%s = %s;' % (load.args[0], value), load.tabs)]
+
+
+class RemoveDeadStore(Pattern):
+    """RemoveDeadStore class
+
+    Removes a store to a memory address which is overwritten by the next
+    statement before it can be read.
+    """
+    name = 'remove-dead-store'
+    size = 2
+
+    def apply(self, window, context):
+        first, second = window
+
+        if first.kind != 'assign' or second.kind != 'assign':
+            return None
+
+        address = first.args[0]
+
+        if not address.startswith('MM[') or second.args[0] != address:
+            return None
+
+        if 'MM' in address[3:] or 'MM' in second.args[1]:
+            return None
+
+        return [second]
+
+
+class RemoveJumpToNext(Pattern):
+    """RemoveJumpToNext class
+
+    Removes an unconditional jump to a label which directly follows it.
+    """
+    name = 'remove-jump-to-next'
+    size = 1
+
+    def apply(self, window, context):
+        jump, = window
+
+        if jump.kind != 'jump':
+            return None
+
+        if jump.args[0] not in context.following_labels():
+            return None
+
+        return []
+
+
+class RemoveUnreachable(Pattern):
+    """RemoveUnreachable class
+
+    Removes a statement which follows an unconditional jump or return and
+    which is not labeled. Control can never reach such a statement.
+    """
+    name = 'remove-unreachable'
+    size = 2
+
+    def apply(self, window, context):
+        jump, stmt = window
+
+        if jump.kind not in ['jump', 'exit']:
+            return None
+
+        if stmt.kind == 'label' or '\n' in stmt.text:
+            return None
+
+        return [jump]
+
+
+class RemoveDeadLabel(Pattern):
+    """RemoveDeadLabel class
+
+    Removes a label which is never the target of a jump or address-of
+    operation, letting the patterns on either side of it match.
+    """
+    name = 'remove-dead-label'
+    size = 1
+
+    def apply(self, window, context):
+        label, = window
+
+        if label.kind != 'label':
+            return None
+
+        if context.label_counts[label.args[0]] != 0:
+            return None
+
+        return []
+
+
+"""The pattern set used when none is given to the optimizer."""
+DEFAULT_PATTERNS = [
+    RemoveDeadLabel(),
+    RemoveUnreachable(),
+    RemoveJumpToNext(),
+    FoldRedefinition(),
+    ForwardStoredValue(),
+    RemoveDeadStore(),
+    ForwardSingleUse(),
+    SinkStackAdjust(),
+    MergeStackAdjust(),
+]
+
+
+class PeepholeOptimizer:
+    """PeepholeOptimizer class
+
+    Runs a pluggable set of patterns over a stream of generated statements
+    until no pattern matches or the pass limit is reached.
+
+    Attributes:
+        patterns: The list of Pattern objects to apply, in priority order.
+        max_passes: The maximum number of passes over the statement stream.
+        stats: A Counter of how many times each pattern was applied.
+        statements_in: The number of significant statements before the last
+            optimization.
+        statements_out: The number of significant statements after the last
+            optimization.
+        reg_counts: A Counter of register references in the current stream.
+        label_counts: A Counter of label references in the current stream.
+
+    Methods:
+        register: Adds a pattern to the pattern set.
+        optimize: Optimizes a stream of (tabs, code) statements.
+        following_labels: Gets the labels directly following the window.
+        report: Formats the collected statistics for display.
+    """
+    def __init__(self, patterns=None, max_passes=16):
+        super().__init__()
+
+        self.patterns = list(patterns if patterns is not None else
+                             DEFAULT_PATTERNS)
+        self.max_passes = max_passes
+
+        self.stats = Counter()
+        self.statements_in = 0
+        self.statements_out = 0
+
+        self.reg_counts = Counter()
+        self.label_counts = Counter()
+
+        # Holds the working statement list and the current window position
+        self._stmts = []
+        self._next = 0
+
+        return
+
+    def register(self, pattern):
+        """Register Pattern
+
+        Adds a pattern to the end of the pattern set.
+
+        Arguments:
+            pattern: The Pattern object to add.
+        """
+        self.patterns.append(pattern)
+        return
+
+    def optimize(self, code):
+        """Optimize
+
+        Decodes the given statement stream, applies all patterns until the
+        stream reaches a fixed point, and returns the rewritten stream.
+
+        Arguments:
+            code: A list of (tabs, text) tuples of generated code.
+
+        Returns:
+            The optimized list of (tabs, text) tuples.
+        """
+        self._stmts = [decode(text, tabs) for tabs, text in code]
+        self.statements_in = self._count_significant()
+
+        # Collect the whole-stream reference counts
+        self.reg_counts = Counter()
+        self.label_counts = Counter()
+
+        for stmt in self._stmts:
+            self._count(stmt, 1)
+
+        for _ in range(self.max_passes):
+            if not self._run_pass():
+                break
+
+        self.statements_out = self._count_significant()
+
+        return [(stmt.tabs, stmt.text) for stmt in self._stmts]
+
+    def following_labels(self):
+        """Following Labels
+
+        Gets the names of all labels which directly follow the window being
+        matched, ignoring blank lines and comments.
+
+        Returns:
+            A list of label names.
+        """
+        labels = []
+
+        for stmt in self._stmts[self._next:]:
+            if stmt.kind == 'label':
+                labels.append(stmt.args[0])
+            elif stmt.kind != 'blank':
+                break
+
+        return labels
+
+    def report(self):
+        """Report Statistics
+
+        Formats the statistics of the last optimization for display.
+
+        Returns:
+            A multi-line string of optimization statistics.
+        """
+        lines = ['Peephole optimization:']
+
+        for pattern in self.patterns:
+            lines.append('    %-24s %d' %
+                         (pattern.name, self.stats[pattern.name]))
+
+        removed = self.statements_in - self.statements_out
+        percent = 100.0 * removed / self.statements_in if self.statements_in else 0
+
+        lines.append('    statements: %d -> %d (%.1f%% removed)' %
+                     (self.statements_in, self.statements_out, percent))
+
+        return '\n'.join(lines)
+
+    def _count_significant(self):
+        """Count Significant Statements (Protected)
+
+        Returns:
+            The number of non-blank statements in the working stream.
+        """
+        return sum(1 for stmt in self._stmts if stmt.kind != 'blank')
+
+    def _count(self, stmt, sign):
+        """Count References (Protected)
+
+        Adds or subtracts the references of a statement from the
+        whole-stream reference counts.
+
+        Arguments:
+            stmt: The Statement object to count.
+            sign: 1 to add the references, -1 to remove them.
+        """
+        for reg, count in stmt.regs.items():
+            self.reg_counts[reg] += sign * count
+
+        for label, count in stmt.refs.items():
+            self.label_counts[label] += sign * count
+
+        return
+
+    def _window(self, start, size):
+        """Get Window (Protected)
+
+        Collects the indices of the next significant statements.
+
+        Arguments:
+            start: The index at which to start the window.
+            size: The number of significant statements to collect.
+
+        Returns:
+            A list of statement indices, or None if the stream ends first.
+        """
+        indices = []
+        index = start
+
+        while len(indices) < size and index < len(self._stmts):
+            if self._stmts[index].kind != 'blank':
+                indices.append(index)
+            index += 1
+
+        return indices if len(indices) == size else None
+
+    def _run_pass(self):
+        """Run Pass (Protected)
+
+        Runs every pattern at every position of the statement stream once.
+
+        Returns:
+            True if any statement was rewritten, False otherwise.
+        """
+        changed = False
+        index = 0
+
+        while index < len(self._stmts):
+            if self._stmts[index].kind == 'blank':
+                index += 1
+                continue
+
+            for pattern in self.patterns:
+                indices = self._window(index, pattern.size)
+
+                if indices is None:
+                    continue
+
+                self._next = indices[-1] + 1
+                window = [self._stmts[i] for i in indices]
+                replacement = pattern.apply(window, self)
+
+                if replacement is None:
+                    continue
+
+                self._replace(indices, replacement)
+                self.stats[pattern.name] += 1
+                changed = True
+
+                # Step back so earlier windows can see the rewrite
+                index = max(0, index - 1)
+                break
+            else:
+                index += 1
+
+        return changed
+
+    def _replace(self, indices, replacement):
+        """Replace Statements (Protected)
+
+        Replaces the significant statements at the given indices with the
+        replacement list, keeping any comments between them in place.
+
+        Arguments:
+            indices: The statement indices of the matched window.
+            replacement: The list of replacement Statement objects.
+        """
+        for i in indices:
+            self._count(self._stmts[i], -1)
+
+        for stmt in replacement:
+            self._count(stmt, 1)
+
+        # Put the replacements in the first slots, drop the leftovers
+        slots = list(indices)
+        for i, stmt in zip(slots, replacement):
+            self._stmts[i] = stmt
+
+        extra = replacement[len(slots):]
+        leftover = slots[len(replacement):]
+
+        for i in reversed(leftover):
+            del self._stmts[i]
+
+        if extra:
+            position = slots[-1] + 1
+            self._stmts[position:position] = extra
+
+        return
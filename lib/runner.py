@@ -0,0 +1,377 @@
+#!/usr/bin/env python3
+
+"""Runner module
+
+Runs compiled programs for the run mode of the command line: with a file as
+stdin, a time limit and an address space limit, capturing their output and
+measuring the time and memory they used. The resource use of each program is
+read when it is reaped, so it is that program's alone. A single program is
+compiled and run with the stdin of the command, and many test programs are
+compiled and run over a pool of worker processes.
+
+A test program tests/<name>.src may have a tests/<name>.in file given to it
+as stdin and a tests/<name>.expected file holding the output it must print.
+
+Author: Evan Sneath
+License: Open Software License v3.0
+
+Classes:
+    RunResult: A named tuple object containing the outcome of a run.
+
+Functions:
+    input_path: Returns the stdin file of a test program.
+    expected_path: Returns the expected output file of a test program.
+    run_program: Runs a program with limits and captures its output.
+    run_source: Compiles a program and runs it.
+    run_test: Compiles and runs a test program in a worker process.
+    run_tests: Runs many test programs over a pool of workers.
+"""
+
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import namedtuple
+
+from lib.batch import compile_chunk
+from lib.build import prepare_toolchain, run_compiler
+
+
+"""The default number of seconds a program may run."""
+DEFAULT_TIME_LIMIT = 10.0
+
+
+"""RunResult class
+
+A named tuple object factory containing the outcome of a program run.
+
+Attributes:
+    status: The exit code of the program, the negative number of the signal
+        which ended it, or 'timeout' if it was stopped at the time limit.
+    stdout: The bytes the program wrote to stdout.
+    stderr: The bytes the program wrote to stderr.
+    seconds: The wall time of the run.
+    cpu: The CPU time (user and system) of the program.
+    max_rss: The peak resident memory of the program in KiB.
+"""
+RunResult = namedtuple('RunResult',
+        ['status', 'stdout', 'stderr', 'seconds', 'cpu', 'max_rss'])
+
+
+def input_path(source):
+    """Input Path
+
+    Arguments:
+        source: The path of a test program.
+
+    Returns:
+        The path of its .in file if it exists, None otherwise.
+    """
+    path = os.path.splitext(source)[0] + '.in'
+
+    return path if os.path.isfile(path) else None
+
+
+def expected_path(source):
+    """Expected Path
+
+    Arguments:
+        source: The path of a test program.
+
+    Returns:
+        The path its expected output is kept at, which may not exist.
+    """
+    return os.path.splitext(source)[0] + '.expected'
+
+
+def run_program(binary, stdin_path=None, time_limit=DEFAULT_TIME_LIMIT,
+                memory_limit=None):
+    """Run Program
+
+    Runs a program until it exits or reaches the time limit, when it is
+    killed.
+
+    Arguments:
+        binary: The path of the program.
+        stdin_path: A file to use as stdin, '-' for the stdin of this
+            process, or None for no input. (Default: None)
+        time_limit: The seconds the program may run.
+            (Default: DEFAULT_TIME_LIMIT)
+        memory_limit: The most bytes of address space of the program, or
+            None for no limit. A program over it fails to map its main
+            memory or to grow its heap. (Default: None)
+
+    Returns:
+        A RunResult object.
+    """
+    def limit():
+        if memory_limit is not None:
+            resource.setrlimit(resource.RLIMIT_AS,
+                               (memory_limit, memory_limit))
+
+    timed_out = []
+
+    def stop():
+        timed_out.append(True)
+        process.kill()
+
+    if stdin_path == '-':
+        stdin = None
+    else:
+        stdin = open(stdin_path or os.devnull, 'rb')
+
+    # Output goes to files, so the program never waits for a pipe to drain
+    with tempfile.TemporaryFile() as out, tempfile.TemporaryFile() as err:
+        start = time.perf_counter()
+
+        try:
+            process = subprocess.Popen([binary], stdin=stdin, stdout=out,
+                                       stderr=err, preexec_fn=limit)
+        finally:
+            if stdin is not None:
+                stdin.close()
+
+        timer = threading.Timer(time_limit, stop)
+        timer.start()
+
+        # Reaping the program here gives its own resource use
+        try:
+            _, wait_status, usage = os.wait4(process.pid, 0)
+        finally:
+            timer.cancel()
+
+        seconds = time.perf_counter() - start
+        process.returncode = os.waitstatus_to_exitcode(wait_status)
+
+        out.seek(0)
+        err.seek(0)
+        stdout = out.read()
+        stderr = err.read()
+
+    status = 'timeout' if timed_out else process.returncode
+
+    return RunResult(status, stdout, stderr, seconds,
+                     usage.ru_utime + usage.ru_stime, usage.ru_maxrss)
+
+
+def run_source(source, stdin_path, time_limit, memory_limit=None,
+               keep_ir=None, **options):
+    """Run Source
+
+    Compiles a program into a private directory and runs it. The output of
+    the program is printed as it was written, and its exit status, run time
+    and peak memory are reported on stderr.
+
+    Arguments:
+        source: The source file to compile.
+        stdin_path: A file given to the program as stdin, or '-' for the
+            stdin of this process.
+        time_limit: The seconds the program may run.
+        memory_limit: The address space limit of the program in bytes, or
+            None. (Default: None)
+        keep_ir: The path to write the generated C code to, or None.
+            (Default: None)
+        options: The run_compiler() arguments of the compile.
+
+    Returns:
+        True if the program was compiled and exited with status 0, False
+        otherwise.
+    """
+    work_dir = tempfile.mkdtemp(prefix='compiler-run-')
+    binary = os.path.join(work_dir, os.path.splitext(
+        os.path.basename(source))[0])
+
+    try:
+        if not run_compiler(source, binary, keep_ir=keep_ir, **options):
+            return False
+
+        try:
+            run = run_program(binary, stdin_path, time_limit, memory_limit)
+        except IOError as e:
+            print('Error: could not run "%s": %s' % (source, e.strerror))
+            return False
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    sys.stdout.flush()
+    sys.stdout.buffer.write(run.stdout)
+    sys.stdout.buffer.flush()
+    sys.stderr.buffer.write(run.stderr)
+
+    if run.status == 'timeout':
+        sys.stderr.write('Run: stopped at the time limit of %gs\n' %
+                         time_limit)
+    else:
+        sys.stderr.write('Run: exited with status %d in %.3fs (%.3fs CPU, '
+                         '%dK peak memory)\n' % (run.status, run.seconds,
+                                                 run.cpu, run.max_rss))
+
+    sys.stderr.flush()
+
+    return run.status == 0
+
+
+def run_test(source, time_limit, memory_limit, update_expected, options):
+    """Run Test
+
+    Compiles a test program into a private directory in a worker process
+    and runs it with its .in file as stdin, comparing its output with its
+    .expected file. A program named *_bad must fail to compile, and one
+    with no .expected file is only compiled.
+
+    Arguments:
+        source: The source file of the test.
+        time_limit: The seconds the program may run.
+        memory_limit: The address space limit of the program in bytes, or
+            None.
+        update_expected: If True, the output of the program is written to
+            its .expected file if it exits with status 0.
+        options: A dictionary of run_compiler() arguments.
+
+    Returns:
+        A (source, status, build seconds, run, details) tuple. The status is
+        'ok', 'built' (compiled but not run), 'updated', 'FAILED' or
+        'TIMEOUT', run is the RunResult of the program or None if it was not
+        run, and details is the output explaining a failure.
+    """
+    import difflib
+
+    name = os.path.splitext(os.path.basename(source))[0]
+    expected = expected_path(source)
+    work_dir = tempfile.mkdtemp(prefix='compiler-run-')
+    binary = os.path.join(work_dir, name)
+
+    try:
+        _, built, output, build_seconds = compile_chunk([(source, binary)],
+                                                        options)[0]
+
+        if name.endswith('_bad'):
+            if built:
+                return (source, 'FAILED', build_seconds, None,
+                        'The program compiled but must fail to compile')
+
+            return source, 'ok', build_seconds, None, ''
+
+        if not built:
+            return source, 'FAILED', build_seconds, None, output
+
+        if not update_expected and not os.path.isfile(expected):
+            return source, 'built', build_seconds, None, ''
+
+        run = run_program(binary, input_path(source), time_limit,
+                          memory_limit)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    stderr = run.stderr.decode(errors='replace')
+
+    if run.status == 'timeout':
+        return (source, 'TIMEOUT', build_seconds, run,
+                'Stopped at the time limit of %gs' % time_limit)
+
+    if run.status != 0:
+        return (source, 'FAILED', build_seconds, run,
+                'Exited with status %d\n%s' % (run.status, stderr))
+
+    try:
+        with open(expected, 'rb') as f:
+            wanted = f.read()
+    except IOError:
+        wanted = None
+
+    if update_expected and run.stdout != wanted:
+        try:
+            with open(expected, 'wb') as f:
+                f.write(run.stdout)
+        except IOError as e:
+            return (source, 'FAILED', build_seconds, run,
+                    'Could not write "%s": %s' % (expected, e.strerror))
+
+        return source, 'updated', build_seconds, run, ''
+
+    if run.stdout != wanted:
+        diff = difflib.unified_diff(
+            wanted.decode(errors='replace').splitlines(),
+            run.stdout.decode(errors='replace').splitlines(),
+            expected, 'output', lineterm='')
+
+        return source, 'FAILED', build_seconds, run, '\n'.join(diff)
+
+    return source, 'ok', build_seconds, run, ''
+
+
+def run_tests(sources, workers, time_limit, memory_limit=None,
+              update_expected=False, results=None, **options):
+    """Run Tests
+
+    Compiles and runs many test programs over a pool of worker processes
+    (see run_test()). The result of each test is printed as it completes,
+    with its build and run times, followed by a summary.
+
+    Arguments:
+        sources: A list of source file paths of the tests.
+        workers: The number of worker processes.
+        time_limit: The seconds each program may run.
+        memory_limit: The address space limit of each program in bytes, or
+            None. (Default: None)
+        update_expected: If True, the output of each program which exits
+            with status 0 is written to its .expected file. (Default: False)
+        results: A path to write the status and times of each test to as
+            JSON, or None. (Default: None)
+        options: The run_compiler() arguments of every compile.
+
+    Returns:
+        True if every test passed, False otherwise.
+    """
+    import json
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+
+    if not prepare_toolchain(options):
+        return False
+
+    report = []
+    failed = 0
+    start = time.perf_counter()
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(run_test, source, time_limit,
+                                   memory_limit, update_expected, options)
+                   for source in sources]
+
+        for future in as_completed(futures):
+            source, status, build_seconds, run, details = future.result()
+            failed += status in ['FAILED', 'TIMEOUT']
+
+            print('%-8s %7.3fs build %8s run  %s' % (
+                status, build_seconds,
+                '%.3fs' % run.seconds if run is not None else '-', source))
+
+            for line in details.splitlines():
+                print('    %s' % line)
+
+            report.append(dict(
+                source=source, status=status, build_seconds=build_seconds,
+                exit_status=run.status if run is not None else None,
+                run_seconds=run.seconds if run is not None else None,
+                cpu_seconds=run.cpu if run is not None else None,
+                max_rss_kib=run.max_rss if run is not None else None))
+
+    seconds = time.perf_counter() - start
+    print('Run: %d passed, %d failed in %.3fs (%d workers)' % (
+        len(sources) - failed, failed, seconds, workers))
+
+    if results is not None:
+        try:
+            with open(results, 'w') as f:
+                json.dump(sorted(report, key=lambda test: test['source']),
+                          f, indent=2)
+                f.write('\n')
+        except OSError as e:
+            print('Error: could not write "%s": %s' % (results, e.strerror))
+            return False
+
+    return failed == 0
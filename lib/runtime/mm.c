@@ -0,0 +1,161 @@
+/*
+ * Main memory
+ *
+ * Allocates main memory (MM) with mmap() when the program starts. The number
+ * of cells is MM_DEFAULT_SIZE unless the MM_CELLS environment variable is set
+ * (a count with an optional K, M or G suffix). Pages are only backed by real
+ * memory once touched, so a large size costs nothing until it is used.
+ *
+ * The heap grows up from cell 0 and the stack grows down from the top. A
+ * guard page with no access rights is kept just above the top of the heap, so
+ * a stack which runs into the heap faults at once and is reported. The guard
+ * is moved up whenever the heap grows past it.
+ *
+ * This file is pasted into the generated code after the cell type. When the
+ * code is split into several translation units, the unit header defines
+ * MM_SHARED as empty so the state used by procedures is shared by all units.
+ *
+ * Author: Evan Sneath
+ * License: Open Software License v3.0
+ */
+
+#include <signal.h>
+#include <stdlib.h>
+#include <sys/mman.h>
+#include <unistd.h>
+
+#ifndef MM_SHARED
+#define MM_SHARED static
+#endif
+
+MM_SHARED cell *MM;
+MM_SHARED cell mm_size;
+
+// The first cell above the guard page, or 0 if there is no guard
+MM_SHARED cell mm_stack_limit = 0;
+static cell mm_page_cells = 0;
+static cell mm_guard = -1;
+
+static const char mm_overflow_message[] =
+    "Error: the stack overflowed into the heap "
+    "(MM_CELLS sets the memory size)\n";
+
+// Called outside a signal handler, so it is safe to exit normally and flush
+// the output the program has written so far
+static void mm_fail(const char *message)
+{
+    write(2, message, strlen(message));
+    exit(1);
+}
+
+MM_SHARED void mm_overflow(void)
+{
+    mm_fail(mm_overflow_message);
+}
+
+// A fault may interrupt the C library in the middle of a call, so only
+// async-signal-safe functions are used and buffered output is not flushed
+static void mm_fault(int signum, siginfo_t *info, void *context)
+{
+    char *address = (char*)info->si_addr;
+
+    // Faults outside main memory are real crashes
+    if (address >= (char*)MM && address < (char*)(MM + mm_size)) {
+        write(2, mm_overflow_message, sizeof(mm_overflow_message) - 1);
+        _exit(1);
+    }
+
+    signal(signum, SIG_DFL);
+}
+
+// Moves the guard page to the first page boundary at or above cell top
+static void mm_move_guard(cell top, cell sp)
+{
+    cell guard = (top + mm_page_cells - 1) / mm_page_cells;
+
+    if (guard == mm_guard) {
+        return;
+    }
+
+    if ((guard + 1) * mm_page_cells > sp) {
+        mm_fail("Error: the heap overflowed into the stack "
+                "(MM_CELLS sets the memory size)\n");
+    }
+
+    if (mm_guard >= 0) {
+        mprotect(MM + mm_guard * mm_page_cells,
+                 mm_page_cells * sizeof(cell), PROT_READ | PROT_WRITE);
+    }
+
+    mprotect(MM + guard * mm_page_cells, mm_page_cells * sizeof(cell),
+             PROT_NONE);
+
+    mm_guard = guard;
+    mm_stack_limit = (guard + 1) * mm_page_cells;
+}
+
+// Called before the heap grows to cell top while the stack is at cell sp
+static void mm_heap_reserve(cell top, cell sp)
+{
+    if (mm_page_cells == 0) {
+        if (top > sp) {
+            mm_fail("Error: the heap overflowed into the stack "
+                    "(MM_CELLS sets the memory size)\n");
+        }
+        return;
+    }
+
+    mm_move_guard(top, sp);
+}
+
+static void mm_init(void)
+{
+    const char *setting = getenv("MM_CELLS");
+    long long cells = MM_DEFAULT_SIZE;
+
+    if (setting != NULL && *setting != '\0') {
+        char *end;
+        cells = strtoll(setting, &end, 10);
+
+        if (*end == 'k' || *end == 'K') {
+            cells <<= 10;
+            end++;
+        } else if (*end == 'm' || *end == 'M') {
+            cells <<= 20;
+            end++;
+        } else if (*end == 'g' || *end == 'G') {
+            cells <<= 30;
+            end++;
+        }
+
+        if (*end != '\0' || cells < 16 || (cell)cells != cells) {
+            mm_fail("Error: MM_CELLS must be a cell count such as 65536, "
+                    "64K or 16M\n");
+        }
+    }
+
+    long page = sysconf(_SC_PAGESIZE);
+    size_t bytes = ((size_t)cells * sizeof(cell) + page - 1) / page * page;
+
+    MM = mmap(NULL, bytes, PROT_READ | PROT_WRITE,
+              MAP_PRIVATE | MAP_ANONYMOUS | MAP_NORESERVE, -1, 0);
+
+    if (MM == MAP_FAILED) {
+        mm_fail("Error: could not allocate main memory\n");
+    }
+
+    mm_size = cells;
+
+    // A guard is only kept if there is room for it and a stack page
+    if (bytes >= 4 * (size_t)page) {
+        struct sigaction action;
+
+        memset(&action, 0, sizeof(action));
+        action.sa_sigaction = mm_fault;
+        action.sa_flags = SA_SIGINFO;
+        sigaction(SIGSEGV, &action, NULL);
+
+        mm_page_cells = page / sizeof(cell);
+        mm_move_guard(0, mm_size);
+    }
+}
@@ -0,0 +1,233 @@
+/*
+ * Buffered runtime I/O
+ *
+ * Implements the I/O layer declared in rtio.h. This file is either pasted
+ * into the generated code or compiled once to an object which is linked with
+ * every program ('--io-object').
+ *
+ * Output and input bypass stdio and use read() and write() on large buffers,
+ * so printing or parsing a value never takes a stream lock or interprets a
+ * format string (floats are still formatted by snprintf to match "%g").
+ *
+ * Author: Evan Sneath
+ * License: Open Software License v3.0
+ */
+
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+#include <unistd.h>
+
+#include "rtio.h"
+
+#define RT_OUT_SIZE 65536
+#define RT_IN_SIZE  65536
+#define RT_EOF      (-1)
+
+// Holds pending output and the unread part of the last input block
+static char rt_out[RT_OUT_SIZE];
+static int rt_out_len = 0;
+
+static char rt_in[RT_IN_SIZE];
+static int rt_in_pos = 0;
+static int rt_in_len = 0;
+
+static void rt_write(const char *data, int len)
+{
+    int done = 0;
+
+    while (done < len) {
+        ssize_t n = write(1, data + done, len - done);
+        if (n <= 0) {
+            break;
+        }
+        done += n;
+    }
+}
+
+void rt_flush(void)
+{
+    rt_write(rt_out, rt_out_len);
+    rt_out_len = 0;
+}
+
+// Flush whatever is left once main returns or the program exits
+__attribute__((destructor))
+static void rt_flush_at_exit(void)
+{
+    rt_flush();
+}
+
+static void rt_reserve(int size)
+{
+    if (rt_out_len + size > RT_OUT_SIZE) {
+        rt_flush();
+    }
+}
+
+void rt_put_string(const char *s)
+{
+    rt_put_chars(s, strlen(s));
+}
+
+void rt_put_chars(const char *s, int len)
+{
+    // Strings larger than the buffer are written around it
+    if (len + 1 > RT_OUT_SIZE) {
+        rt_flush();
+        rt_write(s, len);
+        len = 0;
+    }
+
+    rt_reserve(len + 1);
+    memcpy(rt_out + rt_out_len, s, len);
+    rt_out_len += len;
+    rt_out[rt_out_len++] = '\n';
+}
+
+void rt_put_int(int value)
+{
+    char digits[12];
+    int count = 0;
+    unsigned int magnitude = value < 0 ? 0u - (unsigned int)value
+                                       : (unsigned int)value;
+
+    rt_reserve(13);
+
+    if (value < 0) {
+        rt_out[rt_out_len++] = '-';
+    }
+
+    do {
+        digits[count++] = '0' + magnitude % 10;
+        magnitude /= 10;
+    } while (magnitude != 0);
+
+    while (count > 0) {
+        rt_out[rt_out_len++] = digits[--count];
+    }
+
+    rt_out[rt_out_len++] = '\n';
+}
+
+void rt_put_float(float value)
+{
+    rt_reserve(64);
+    rt_out_len += snprintf(rt_out + rt_out_len, 64, "%g\n", value);
+}
+
+void rt_put_bool(int value)
+{
+    rt_put_string(value ? "true" : "false");
+}
+
+// Gets the next input character without consuming it
+static int rt_peek(void)
+{
+    if (rt_in_pos == rt_in_len) {
+        // Prompts must be visible before blocking on input
+        rt_flush();
+
+        ssize_t n = read(0, rt_in, RT_IN_SIZE);
+        rt_in_pos = 0;
+        rt_in_len = n > 0 ? n : 0;
+
+        if (rt_in_len == 0) {
+            return RT_EOF;
+        }
+    }
+
+    return (unsigned char)rt_in[rt_in_pos];
+}
+
+static void rt_skip_space(void)
+{
+    int c = rt_peek();
+
+    while (c == ' ' || c == '\t' || c == '\n' || c == '\r' ||
+           c == '\v' || c == '\f') {
+        rt_in_pos++;
+        c = rt_peek();
+    }
+}
+
+void rt_get_line(char *buf, int size)
+{
+    int len = 0;
+    int c = rt_peek();
+
+    if (c == RT_EOF) {
+        return;
+    }
+
+    // Read up to and including the newline, as fgets() does
+    while (len < size - 1 && c != RT_EOF) {
+        buf[len++] = c;
+        rt_in_pos++;
+
+        if (c == '\n') {
+            break;
+        }
+
+        c = rt_peek();
+    }
+
+    buf[len] = '\0';
+}
+
+void rt_get_int(int *value)
+{
+    unsigned int magnitude = 0;
+    int negative = 0;
+    int c;
+
+    rt_skip_space();
+    c = rt_peek();
+
+    if (c == '-' || c == '+') {
+        negative = c == '-';
+        rt_in_pos++;
+        c = rt_peek();
+    }
+
+    if (c < '0' || c > '9') {
+        return;
+    }
+
+    while (c >= '0' && c <= '9') {
+        magnitude = magnitude * 10 + (c - '0');
+        rt_in_pos++;
+        c = rt_peek();
+    }
+
+    *value = (int)(negative ? 0u - magnitude : magnitude);
+}
+
+void rt_get_float(float *value)
+{
+    char token[64];
+    char *end;
+    int len = 0;
+    int c;
+
+    rt_skip_space();
+    c = rt_peek();
+
+    // Collect the characters of a decimal float and let strtof convert them
+    while (len < (int)sizeof(token) - 1 && c != RT_EOF &&
+           ((c >= '0' && c <= '9') || c == '.' || c == 'e' || c == 'E' ||
+            ((c == '-' || c == '+') &&
+             (len == 0 || token[len - 1] == 'e' || token[len - 1] == 'E')))) {
+        token[len++] = c;
+        rt_in_pos++;
+        c = rt_peek();
+    }
+
+    token[len] = '\0';
+
+    float result = strtof(token, &end);
+
+    if (end != token) {
+        *value = result;
+    }
+}
@@ -0,0 +1,29 @@
+/*
+ * Buffered runtime I/O
+ *
+ * Declares the I/O layer used by the runtime routines when the compiler is
+ * run with '--io buffered'. Output is collected in a large buffer which is
+ * flushed when it fills, before input is read from a terminal, and when the
+ * program exits. Input is read in large blocks and parsed by hand.
+ *
+ * Author: Evan Sneath
+ * License: Open Software License v3.0
+ */
+
+#ifndef RTIO_H
+#define RTIO_H
+
+// Output (each value is followed by a newline)
+void rt_put_string(const char *s);
+void rt_put_chars(const char *s, int len);
+void rt_put_int(int value);
+void rt_put_float(float value);
+void rt_put_bool(int value);
+void rt_flush(void);
+
+// Input (the destination is left unchanged if no value could be read)
+void rt_get_line(char *buf, int size);
+void rt_get_int(int *value);
+void rt_get_float(float *value);
+
+#endif
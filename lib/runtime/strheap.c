@@ -0,0 +1,282 @@
+/*
+ * String heap
+ *
+ * Manages the strings read by getString() in the heap at the bottom of main
+ * memory. Every string is stored in a block of cells with a length prefix:
+ *
+ *     [ block size | string length | characters ... '\0' ]
+ *
+ * String values point at the characters, so they are still C strings and the
+ * length is the cell just before them. String literals are laid out the same
+ * way by the compiler.
+ *
+ * Identical strings are interned: reading a line equal to a string which is
+ * already in the heap returns that string. Once a budget of cells has been
+ * allocated (or the heap comes close to the stack), the stack is scanned for
+ * references to strings and the blocks of all others are put on free lists
+ * for reuse. The budget grows with the live strings and the stack, so the
+ * heap of a program reading strings in a loop stays bounded and the scans
+ * cost a few cells per cell allocated.
+ *
+ * If the MM_STATS environment variable is set, the peak size of the heap and
+ * the number of collections are written to stderr when the program exits.
+ *
+ * This file is pasted into the generated code after mm.c.
+ *
+ * Author: Evan Sneath
+ * License: Open Software License v3.0
+ */
+
+#define SH_MIN_GROWTH 1024
+#define SH_MAX_BLOCK  ((cell)(2 + (BUF_SIZE + sizeof(cell) - 1) / sizeof(cell)))
+#define SH_FREE       (-1)
+
+// The fields of the heap block starting at cell b
+#define SH_SIZE(b)    MM[b]
+#define SH_LENGTH(b)  MM[(b) + 1]
+#define SH_TEXT(b)    ((char*)&MM[(b) + 2])
+#define SH_NEXT(b)    MM[(b) + 2]
+
+// Free lists by block size, blocks larger than SH_MAX_BLOCK are kept in the
+// first list. Links and table entries hold a block plus one, 0 ends a list
+static cell sh_free[SH_MAX_BLOCK + 1];
+
+// The cells allocated since the last collection and the number allowed
+static cell sh_allocated = 0;
+static cell sh_budget = SH_MIN_GROWTH;
+
+// The highest heap top and the number of collections so far
+static cell sh_peak = 0;
+static cell sh_collections = 0;
+
+// Open addressing table of the blocks of interned strings
+static cell *sh_table = NULL;
+static cell sh_table_size = 0;
+static cell sh_table_used = 0;
+
+static unsigned int sh_hash(const char *text, cell length)
+{
+    unsigned int hash = 2166136261u;
+
+    for (cell i = 0; i < length; i++) {
+        hash = (hash ^ (unsigned char)text[i]) * 16777619u;
+    }
+
+    return hash;
+}
+
+// Finds the table slot of a string, or the empty slot where it belongs
+static cell *sh_slot(const char *text, cell length)
+{
+    cell mask = sh_table_size - 1;
+    cell i = sh_hash(text, length) & mask;
+
+    while (sh_table[i] != 0) {
+        cell block = sh_table[i] - 1;
+
+        if (SH_LENGTH(block) == length &&
+            memcmp(SH_TEXT(block), text, length) == 0) {
+            break;
+        }
+
+        i = (i + 1) & mask;
+    }
+
+    return &sh_table[i];
+}
+
+static void sh_table_reset(cell size)
+{
+    free(sh_table);
+
+    sh_table = calloc(size, sizeof(cell));
+    sh_table_size = size;
+    sh_table_used = 0;
+
+    if (sh_table == NULL) {
+        mm_fail("Error: could not allocate the string table\n");
+    }
+}
+
+static void sh_table_add(cell block)
+{
+    // Keep the table at most half full
+    if (2 * (sh_table_used + 1) > sh_table_size) {
+        cell *old = sh_table;
+        cell old_size = sh_table_size;
+
+        sh_table = NULL;
+        sh_table_reset(2 * old_size);
+
+        for (cell i = 0; i < old_size; i++) {
+            if (old[i] != 0) {
+                *sh_slot(SH_TEXT(old[i] - 1), SH_LENGTH(old[i] - 1)) = old[i];
+                sh_table_used++;
+            }
+        }
+
+        free(old);
+    }
+
+    *sh_slot(SH_TEXT(block), SH_LENGTH(block)) = block + 1;
+    sh_table_used++;
+}
+
+static void sh_release(cell block, cell size)
+{
+    cell list = size <= SH_MAX_BLOCK ? size : 0;
+
+    SH_SIZE(block) = size;
+    SH_LENGTH(block) = SH_FREE;
+    SH_NEXT(block) = sh_free[list];
+    sh_free[list] = block + 1;
+}
+
+// Takes a free block of at least size cells, or returns -1 if there is none
+static cell sh_take_free(cell size)
+{
+    cell list = size;
+
+    // Use a block of the exact size, or else split the smallest larger one
+    while (list <= SH_MAX_BLOCK && sh_free[list] == 0) {
+        list++;
+    }
+
+    if (list > SH_MAX_BLOCK) {
+        list = 0;
+    }
+
+    if (sh_free[list] == 0) {
+        return -1;
+    }
+
+    cell block = sh_free[list] - 1;
+    sh_free[list] = SH_NEXT(block);
+
+    // A remainder too small to hold a string stays part of the block
+    if (SH_SIZE(block) - size >= 3) {
+        sh_release(block + size, SH_SIZE(block) - size);
+        SH_SIZE(block) = size;
+    }
+
+    return block;
+}
+
+static void sh_report(void)
+{
+    fprintf(stderr, "String heap: peak %ld cells, %ld collections\n",
+            (long)sh_peak, (long)sh_collections);
+}
+
+// Frees every string which is not referenced from the stack. Between
+// statements every live value is held in main memory rather than only in a
+// register, so the stack from sp up is all that needs to be scanned. Any
+// cell which happens to look like a reference only keeps a string alive.
+static void sh_collect(cell *hp, cell sp)
+{
+    cell top = *hp;
+    cell live = 0;
+    cell run = -1;
+    unsigned char *marks = calloc(top / 8 + 1, 1);
+
+    if (marks == NULL) {
+        mm_fail("Error: could not allocate the string marks\n");
+    }
+
+    for (cell i = sp; i < mm_size; i++) {
+        uintptr_t offset = (uintptr_t)MM[i] - (uintptr_t)MM;
+
+        if (offset % sizeof(cell) == 0 && offset >= 2 * sizeof(cell) &&
+            offset < (uintptr_t)top * sizeof(cell)) {
+            cell block = offset / sizeof(cell) - 2;
+            marks[block / 8] |= 1 << (block % 8);
+        }
+    }
+
+    // Rebuild the free lists and the table, merging neighbouring free blocks
+    memset(sh_free, 0, sizeof(sh_free));
+    sh_table_reset(sh_table_size);
+
+    for (cell block = 0; block < top; block += SH_SIZE(block)) {
+        if (SH_LENGTH(block) != SH_FREE &&
+            (marks[block / 8] & (1 << (block % 8))) != 0) {
+            if (run >= 0) {
+                sh_release(run, block - run);
+                run = -1;
+            }
+
+            sh_table_add(block);
+            live += SH_SIZE(block);
+        } else if (run < 0) {
+            run = block;
+        }
+    }
+
+    // Free blocks at the top are given back to the stack
+    if (run >= 0) {
+        *hp = run;
+    }
+
+    free(marks);
+
+    sh_collections++;
+    sh_allocated = 0;
+    sh_budget = live > SH_MIN_GROWTH ? live : SH_MIN_GROWTH;
+
+    if (sh_budget < (mm_size - sp) / 8) {
+        sh_budget = (mm_size - sp) / 8;
+    }
+}
+
+// Stores a string in the heap (or finds it there) and returns its value
+static cell sh_store(const char *text, cell *hp, cell sp)
+{
+    cell length = strlen(text);
+
+    if (sh_table_size == 0) {
+        sh_table_reset(1024);
+
+        if (getenv("MM_STATS") != NULL) {
+            atexit(sh_report);
+        }
+    }
+
+    cell *slot = sh_slot(text, length);
+
+    if (*slot != 0) {
+        return (cell)SH_TEXT(*slot - 1);
+    }
+
+    cell size = 2 + (length + sizeof(cell)) / sizeof(cell);
+
+    if (sh_allocated + size > sh_budget) {
+        sh_collect(hp, sp);
+    }
+
+    cell block = sh_take_free(size);
+
+    // Collect again rather than let the heap grow up to the guard page
+    if (block < 0 && *hp + size + 2 * mm_page_cells >= sp) {
+        sh_collect(hp, sp);
+        block = sh_take_free(size);
+    }
+
+    sh_allocated += size;
+
+    if (block < 0) {
+        block = *hp;
+        mm_heap_reserve(block + size, sp);
+        *hp = block + size;
+        SH_SIZE(block) = size;
+
+        if (*hp > sh_peak) {
+            sh_peak = *hp;
+        }
+    }
+
+    SH_LENGTH(block) = length;
+    memcpy(SH_TEXT(block), text, length + 1);
+    sh_table_add(block);
+
+    return (cell)SH_TEXT(block);
+}
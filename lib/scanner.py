@@ -14,7 +14,7 @@ Classes:
 
 from os.path import isfile
 
-from lib.datatypes import Token
+from lib.datatypes import Diagnostic, Token
 
 
 class Scanner:
@@ -27,9 +27,14 @@ class Scanner:
     Attributes:
         keywords: A list of valid keywords in the language.
         symbols: A list of valid symbols in the language.
+        diagnostics: A list the errors and warnings are collected in as
+            Diagnostic objects, or None to print them.
+        printed: A list of the text of each error and warning printed, so
+            they can be printed again without scanning the source.
 
     Methods:
         attach_source: Binds a source file to the scanner to begin scanning.
+        attach_text: Binds source text to the scanner to begin scanning.
         next_token: Returns the next token of the attached file. This token
             will be of the Token named tuple class.
     """
@@ -59,6 +64,10 @@ class Scanner:
         self._line_pos = 0
         self._char_pos = 0
 
+        # Holds the list diagnostics are collected in, None to print them
+        self.diagnostics = None
+        self.printed = []
+
         return
 
     def attach_source(self, src_path):
@@ -78,21 +87,36 @@ class Scanner:
             print('    Inputted path is not a file')
             return False
 
-        # Try to read all data from the file and split by line
+        # Try to read all data from the file
         try:
             with open(src_path) as f:
-                keepends = True
-                self._src = f.read().splitlines(keepends)
+                text = f.read()
         except IOError:
             print('Error: "%s"' % src_path)
             print('    Could not read inputted file')
             return False
 
-        # The file was attached and read successfully, store the path
-        self._src_path = src_path
+        # The file was read successfully, split it by line
+        self.attach_text(text, src_path)
 
         return True
 
+    def attach_text(self, text, name='<source>'):
+        """Attach Text
+
+        Attach source text held in memory to the scanner and prepare for token
+        collection.
+
+        Arguments:
+            text: The source code string to scan.
+            name: The name of the source in diagnostics. (Default: '<source>')
+        """
+        # Every line ends in a newline, the last one and CRLF lines included
+        self._src = [line + '\n' for line in text.splitlines()]
+        self._src_path = name
+
+        return
+
     def next_token(self):
         """Scan For Next Token
 
@@ -160,15 +184,44 @@ class Scanner:
             hl: If not -1, there will be an pointer (^) under a
                 character in the line to be highlighted. (Default: -1)
         """
-        line = self._src[self._line_pos][0:-1]
+        column = abs(hl) + 1 if hl != -1 else None
+        self._diagnose('warning', msg, self._line_pos+1, column)
+
+        return
+
+    def _diagnose(self, severity, msg, line, column=None):
+        """Report Diagnostic (Protected)
+
+        Collects an error or warning in the diagnostics list if there is one,
+        and otherwise prints it and keeps the text printed.
+
+        Arguments:
+            severity: The kind of diagnostic, 'error' or 'warning'.
+            msg: The message to display.
+            line: The line number where the problem was found.
+            column: The 1-based column of the character to point (^) at, or
+                None. (Default: None)
+        """
+        text = self._get_line(line)
+        diagnostic = Diagnostic(severity, msg, self._src_path, line, column,
+                                text)
 
-        print('Warning: "', self._src_path, '", ', sep='', end='')
-        print('line ', self._line_pos+1, sep='')
-        print('    ', msg, '\n    ', line.strip(), sep='')
+        if self.diagnostics is not None:
+            self.diagnostics.append(diagnostic)
+            return
 
-        if hl != -1:
-            left_spaces = line.find(line.strip()[0])
-            print('    %s^' % (' '*(abs(hl)-left_spaces)))
+        lines = ['%s: "%s", line %d' % (severity.capitalize(),
+                                        self._src_path, line),
+                 '    %s' % msg,
+                 '    %s' % text]
+
+        if column is not None:
+            source_line = self._src[line-1]
+            left_spaces = len(source_line) - len(source_line.lstrip())
+            lines.append('    %s^' % (' '*(column-1-left_spaces)))
+
+        self.printed.append('\n'.join(lines))
+        print(self.printed[-1])
 
         return
 
@@ -184,6 +237,10 @@ class Scanner:
         """
         char = ''
 
+        # The end of file was already reached, or the source is empty
+        if self._line_pos == len(self._src):
+            return None
+
         while True:
             char = self._src[self._line_pos][self._char_pos]
 
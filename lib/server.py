@@ -0,0 +1,280 @@
+#!/usr/bin/env python3
+
+"""Server module
+
+Keeps the compiler resident behind a Unix domain socket, so a compile does
+not pay for starting an interpreter, importing the compiler and probing the C
+compiler. Requests are sent by the client module (see client.py for the
+format).
+
+Each request is handled in a process forked from the server, which starts
+with every module imported and every cache of the server warm. Compiles run
+concurrently, and none can affect another or the server. A server refuses
+requests once the files of the compiler change, so a client never gets the
+results of an outdated compiler.
+
+Author: Evan Sneath
+License: Open Software License v3.0
+
+Classes:
+    CompileServer: A forking Unix socket server running compile requests.
+
+Functions:
+    serve: Runs a compile server until it is stopped.
+"""
+
+import json
+import os
+import signal
+import socket
+import socketserver
+import sys
+import tempfile
+import traceback
+
+from lib.api import compile_source
+from lib.client import PROTOCOL_VERSION
+
+
+def _stamp(paths):
+    """Stamp Files (Protected)
+
+    Arguments:
+        paths: A list of file paths.
+
+    Returns:
+        A list of the modification time and size of each file, None for any
+        missing file.
+    """
+    stamps = []
+
+    for path in paths:
+        try:
+            stat = os.stat(path)
+            stamps.append((stat.st_mtime_ns, stat.st_size))
+        except OSError:
+            stamps.append(None)
+
+    return stamps
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    """_Handler class
+
+    Reads a request from a client and writes back the response.
+    """
+    def handle(self):
+        line = self.rfile.readline()
+
+        # A connection closed without a request only checked for a server
+        if not line:
+            return
+
+        try:
+            message = json.loads(line.decode())
+        except ValueError:
+            message = None
+
+        response = self.server.run_request(message)
+
+        # A client which went away needs no response
+        try:
+            self.wfile.write(json.dumps(response).encode() + b'\n')
+        except OSError:
+            pass
+
+        return
+
+
+class CompileServer(socketserver.ForkingMixIn, socketserver.UnixStreamServer):
+    """CompileServer class
+
+    A Unix socket server running each compile request in a forked process.
+
+    Attributes:
+        compile_function: The function running a command line, given the
+            list of arguments and the C compiler of the client (or None), and
+            returning True if it succeeded.
+        watched: The list of paths of the files of the compiler.
+
+    Methods:
+        run_request: Runs a compile request and builds its response.
+    """
+    def __init__(self, path, compile_function, watched):
+        self.compile_function = compile_function
+        self.watched = watched
+        self._stamps = _stamp(watched)
+
+        super().__init__(path, _Handler)
+
+        return
+
+    def run_request(self, message):
+        """Run Request
+
+        Runs a compile request in the working directory of the client, or
+        compiles the source text of a request to C code. This is called in
+        the forked process of the request.
+
+        Arguments:
+            message: The decoded request.
+
+        Returns:
+            The response dictionary.
+        """
+        # The handler of the server only stops the server itself
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+
+        if not isinstance(message, dict) or not (
+                isinstance(message.get('args'), list) or
+                isinstance(message.get('source'), str)):
+            return {'error': 'malformed request'}
+
+        if message.get('version') != PROTOCOL_VERSION:
+            return {'error': 'protocol version %s, expected %d' % (
+                message.get('version'), PROTOCOL_VERSION)}
+
+        if _stamp(self.watched) != self._stamps:
+            return {'error': 'the compiler changed since the server started, '
+                             'restart it'}
+
+        if 'source' in message:
+            return self._compile_source(message)
+
+        try:
+            os.chdir(message.get('cwd') or '/')
+        except OSError as e:
+            return {'error': 'could not enter "%s": %s' % (message.get('cwd'),
+                                                          e.strerror)}
+
+        log = tempfile.TemporaryFile()
+        saved = [os.dup(1), os.dup(2)]
+
+        # The C compiler inherits the redirected output when started
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os.dup2(log.fileno(), 1)
+        os.dup2(log.fileno(), 2)
+
+        # A compile ends like it would in a process of its own
+        try:
+            status = int(not self.compile_function(message['args'],
+                                                   message.get('cc')))
+        except SystemExit as e:
+            status = e.code if isinstance(e.code, int) else \
+                int(e.code is not None)
+        except Exception:
+            traceback.print_exc()
+            status = 1
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os.dup2(saved[0], 1)
+            os.dup2(saved[1], 2)
+            os.close(saved[0])
+            os.close(saved[1])
+
+        log.seek(0)
+        output = log.read().decode(errors='replace')
+        log.close()
+
+        return {'status': status, 'output': output}
+
+    def _compile_source(self, message):
+        """Compile Source (Protected)
+
+        Compiles the source text of a request to C code in memory.
+
+        Arguments:
+            message: The decoded request.
+
+        Returns:
+            The response dictionary.
+        """
+        options = message.get('options') or {}
+
+        if not isinstance(options, dict):
+            return {'error': 'malformed request'}
+
+        try:
+            result = compile_source(message['source'],
+                                    str(message.get('name') or '<source>'),
+                                    **options)
+        except (TypeError, ValueError) as e:
+            return {'error': 'invalid options: %s' % e}
+
+        return {'status': int(not result.succeeded), 'code': result.code,
+                'diagnostics': [d._asdict() for d in result.diagnostics]}
+
+
+def serve(path, compile_function, watched):
+    """Serve
+
+    Runs a compile server on a socket until it is interrupted or terminated.
+    A stale socket left by a server which did not stop cleanly is replaced.
+
+    Arguments:
+        path: The path of the socket.
+        compile_function: The function running a command line (see
+            CompileServer).
+        watched: The list of paths of the files of the compiler.
+
+    Returns:
+        True if the server stopped cleanly, False if it could not start.
+    """
+    if os.path.exists(path):
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+
+        try:
+            probe.connect(path)
+            running = True
+        except OSError:
+            running = False
+        finally:
+            probe.close()
+
+        if running:
+            print('Error: a compile server is already running on "%s"' % path)
+            return False
+
+        # Binding reports the socket if it cannot be replaced
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    # Only the user running the server may connect to it
+    umask = os.umask(0o077)
+
+    try:
+        server = CompileServer(path, compile_function, watched)
+    except OSError as e:
+        print('Error: could not listen on "%s": %s' % (path, e.strerror))
+        return False
+    finally:
+        os.umask(umask)
+
+    def terminate(signum, frame):
+        raise KeyboardInterrupt
+
+    signal.signal(signal.SIGTERM, terminate)
+    pid = os.getpid()
+
+    print('Compile server listening on "%s" (pid %d)' % (path, pid))
+    sys.stdout.flush()
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        # Forked requests never remove the socket of the server
+        if os.getpid() == pid:
+            server.server_close()
+
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    return True
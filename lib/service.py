@@ -0,0 +1,342 @@
+#!/usr/bin/env python3
+
+"""Service module
+
+An asyncio front end compiling source text to programs, for a process serving
+many requests which must not block its event loop. Parsing is CPU-bound, so
+it runs in a pool of worker processes using the in-memory compile API (see
+api.py). The C compiler runs as an asyncio subprocess reading the code from
+stdin, and a semaphore bounds how many run at once.
+
+Identical requests in flight share one compile. A request may be cancelled or
+given a timeout, and the compile it waits for is stopped (its C compiler
+killed) once no request waits for it any more.
+
+Author: Evan Sneath
+License: Open Software License v3.0
+
+Classes:
+    ServiceResult: The outcome of a compile request.
+    CompileService: Compiles source text to programs from an event loop.
+"""
+
+import asyncio
+import functools
+import hashlib
+import os
+import shutil
+import signal
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from lib.api import compile_source
+from lib.toolchain import STDIN, Toolchain
+
+
+class ServiceResult:
+    """ServiceResult class
+
+    The outcome of a compile request.
+
+    Attributes:
+        succeeded: True if the program was written to its target, False
+            otherwise.
+        error: None on success, otherwise a message saying why no program
+            was written.
+        diagnostics: A list of the errors and warnings of the source as
+            Diagnostic objects.
+        stats: A dictionary of the statistics of the compile (see api.py).
+        output: The output of the C compiler, empty if it was not run.
+        shared: True if the request shared the compile of an identical
+            request already in flight.
+        seconds: The seconds from the request to its result.
+    """
+    def __init__(self, succeeded, error, diagnostics, stats, output, shared,
+                 seconds):
+        super().__init__()
+
+        self.succeeded = succeeded
+        self.error = error
+        self.diagnostics = diagnostics
+        self.stats = stats
+        self.output = output
+        self.shared = shared
+        self.seconds = seconds
+
+        return
+
+
+class _Build:
+    """_Build class
+
+    A compile in flight and the number of requests waiting for it.
+    """
+    def __init__(self, work_dir):
+        super().__init__()
+
+        self.work_dir = work_dir
+        self.task = None
+        self.waiters = 0
+
+        return
+
+
+class CompileService:
+    """CompileService class
+
+    Compiles source text to programs from an event loop. A service must be
+    closed (or used as an async context manager) to stop its workers.
+
+    Attributes:
+        toolchain: The Toolchain object building the generated code.
+        workers: The number of worker processes parsing sources.
+        gcc_jobs: The most C compilers run at once.
+        counts: A dictionary of the number of 'requests', of 'compiles' run
+            for them, of requests which 'shared' a compile in flight, and of
+            those which 'timed_out' or were 'cancelled'.
+
+    Methods:
+        compile: Compiles source text to a program.
+        in_flight: Returns the number of compiles in flight.
+        close: Stops the compiles in flight and the worker processes.
+    """
+    def __init__(self, toolchain=None, workers=None, gcc_jobs=None):
+        super().__init__()
+
+        self.toolchain = toolchain or Toolchain()
+        self.workers = workers or os.cpu_count() or 1
+        self.gcc_jobs = gcc_jobs or self.workers
+        self.counts = dict(requests=0, compiles=0, shared=0, timed_out=0,
+                           cancelled=0)
+
+        self._pool = ProcessPoolExecutor(max_workers=self.workers)
+        self._gcc = asyncio.Semaphore(self.gcc_jobs)
+
+        # Holds the _Build of each compile in flight by request key
+        self._builds = {}
+
+        return
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+        return False
+
+    async def compile(self, source, target, name='<source>', timeout=None,
+                      **options):
+        """Compile Source
+
+        Compiles source text to a program. If an identical request (the same
+        source, name and options) is in flight, its compile is shared.
+
+        Arguments:
+            source: The source code, as a string or as UTF-8 encoded bytes.
+            target: The path of the program to write.
+            name: The name of the source in diagnostics. (Default: '<source>')
+            timeout: The most seconds to wait for the compile, or None to
+                wait until it ends. (Default: None)
+            options: Keyword arguments of api.compile_source().
+
+        Returns:
+            A ServiceResult object.
+
+        Raises:
+            asyncio.TimeoutError: If the timeout passed first.
+            asyncio.CancelledError: If the request was cancelled.
+            ValueError: If an option has an invalid value.
+        """
+        start = time.perf_counter()
+        loop = asyncio.get_running_loop()
+        code_model = options.get('code_model', '32')
+        self.counts['requests'] += 1
+
+        # Probing the C compiler runs it, so it is kept off the event loop
+        error = await loop.run_in_executor(None, self.toolchain.check,
+                                           code_model)
+
+        if error is not None:
+            return ServiceResult(False, error, [], {}, '', False,
+                                 time.perf_counter() - start)
+
+        key = self._request_key(source, name, options)
+        build = self._builds.get(key)
+        shared = build is not None and not build.task.done()
+
+        if shared:
+            self.counts['shared'] += 1
+        else:
+            build = _Build(tempfile.mkdtemp(prefix='compiler-service-'))
+            build.task = loop.create_task(self._build(build, source, name,
+                                                      options))
+            self._builds[key] = build
+            self.counts['compiles'] += 1
+
+        build.waiters += 1
+
+        try:
+            # Another request may still wait for the compile
+            result, binary, output = await asyncio.wait_for(
+                asyncio.shield(build.task), timeout)
+
+            if binary is not None:
+                await loop.run_in_executor(None, self._install, binary,
+                                           target)
+        except asyncio.TimeoutError:
+            self.counts['timed_out'] += 1
+            raise
+        except asyncio.CancelledError:
+            self.counts['cancelled'] += 1
+            raise
+        finally:
+            self._release(key, build)
+
+        if not result.succeeded:
+            error = 'the source has errors'
+        elif binary is None:
+            error = 'the C compiler failed'
+
+        return ServiceResult(error is None, error, result.diagnostics,
+                             result.stats, output, shared,
+                             time.perf_counter() - start)
+
+    def in_flight(self):
+        """In Flight
+
+        Returns:
+            The number of compiles in flight.
+        """
+        return sum(1 for build in self._builds.values()
+                   if not build.task.done())
+
+    async def close(self):
+        """Close Service
+
+        Stops the compiles in flight, removing their files, and the worker
+        processes.
+        """
+        tasks = [build.task for build in self._builds.values()]
+
+        for task in tasks:
+            task.cancel()
+
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+        for build in self._builds.values():
+            shutil.rmtree(build.work_dir, ignore_errors=True)
+
+        self._builds = {}
+        self._pool.shutdown(wait=True, cancel_futures=True)
+
+        return
+
+    def _request_key(self, source, name, options):
+        """Request Key (Protected)
+
+        Returns:
+            A digest identifying the compile of a request.
+        """
+        digest = hashlib.sha256(source if isinstance(source, bytes) else
+                                source.encode())
+        digest.update(repr((name, sorted(options.items()))).encode())
+
+        return digest.hexdigest()
+
+    async def _build(self, build, source, name, options):
+        """Build Program (Protected)
+
+        Parses the source in a worker process and builds its code with the C
+        compiler, killed if the compile is cancelled.
+
+        Returns:
+            A tuple of the CompileResult of the parse, the path of the program
+            in the work directory of the build (None if it was not built) and
+            the output of the C compiler.
+        """
+        loop = asyncio.get_running_loop()
+        result = await loop.run_in_executor(
+            self._pool, functools.partial(compile_source, source, name,
+                                          **options))
+
+        if not result.succeeded:
+            return result, None, ''
+
+        binary = os.path.join(build.work_dir, 'program')
+        command = self.toolchain.compile_command(
+            options.get('code_model', '32'), [STDIN], binary)
+
+        async with self._gcc:
+            # The C compiler gets its own process group to be stopped whole
+            process = await asyncio.create_subprocess_exec(
+                *command, stdin=asyncio.subprocess.PIPE,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.STDOUT, start_new_session=True)
+
+            try:
+                output, _ = await process.communicate(result.code.encode())
+            except asyncio.CancelledError:
+                try:
+                    os.killpg(process.pid, signal.SIGKILL)
+                except ProcessLookupError:
+                    pass
+
+                await process.wait()
+                raise
+
+        if process.returncode != 0:
+            binary = None
+
+        return result, binary, output.decode(errors='replace')
+
+    def _install(self, binary, target):
+        """Install Program (Protected)
+
+        Copies a built program to its target, which is replaced at once so
+        it is never seen partly written. Each copy has a private temporary
+        file, so requests sharing a compile may install the same target at
+        once.
+        """
+        handle, partial = tempfile.mkstemp(
+            dir=os.path.dirname(os.path.abspath(target)),
+            prefix='.%s.' % os.path.basename(target), suffix='.tmp')
+        os.close(handle)
+
+        try:
+            shutil.copy(binary, partial)
+            os.replace(partial, target)
+        except BaseException:
+            try:
+                os.remove(partial)
+            except OSError:
+                pass
+
+            raise
+
+        return
+
+    def _release(self, key, build):
+        """Release Build (Protected)
+
+        Ends the wait of a request for a compile. The last request waiting
+        stops the compile if it is still running and removes its files.
+        """
+        build.waiters -= 1
+
+        if build.waiters > 0:
+            return
+
+        if self._builds.get(key) is build:
+            del self._builds[key]
+
+        if not build.task.done():
+            build.task.cancel()
+            build.task.add_done_callback(
+                lambda task: shutil.rmtree(build.work_dir,
+                                           ignore_errors=True))
+        else:
+            shutil.rmtree(build.work_dir, ignore_errors=True)
+
+        return
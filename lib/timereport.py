@@ -0,0 +1,358 @@
+#!/usr/bin/env python3
+
+"""Time report module
+
+Records the wall time, CPU time and peak traced memory of each phase of a
+compile, along with counts of what it produced. Phases nest, and the times of
+a phase leave out the phases run within it, so the phases of a compile add up
+to its total. The phases inside the parser are timed by wrapping methods of
+the Parser object of the compile, so a compile without a report runs no
+extra code at all.
+
+Memory is traced with tracemalloc while a report is recorded, which slows
+the compiler itself down, so the times are those of a traced compile. The C
+compiler is not traced: its CPU time is that of the child processes waited
+for during the phase. The compiler imports this module for every compile, so
+tracemalloc is only imported by the methods of a report.
+
+Author: Evan Sneath
+License: Open Software License v3.0
+
+Classes:
+    TimeReport: Records the time and memory of the phases of a compile.
+"""
+
+import resource
+import time
+from collections import OrderedDict
+
+
+"""The phases of a compile, in order, with a description of each."""
+PHASES = OrderedDict([
+    ('setup', 'C compiler checks and runtime object'),
+    ('scan', 'reading tokens'),
+    ('parse', 'parsing and IR generation'),
+    ('optimize', 'IR passes and reachability'),
+    ('lower', 'lowering IR to C'),
+    ('peephole', 'peephole optimizer'),
+    ('write', 'writing the C code'),
+    ('gcc', 'C compiler, after the code is written'),
+])
+
+"""The counts of a report, with a description of each."""
+COUNTS = OrderedDict([
+    ('tokens', 'tokens read'),
+    ('c_lines', 'lines of C written'),
+    ('c_bytes', 'bytes of C written'),
+    ('registers', 'registers allocated'),
+    ('labels', 'labels in the IR'),
+])
+
+
+class _Phase:
+    """_Phase class
+
+    A context manager timing one run of a phase of a TimeReport.
+    """
+    def __init__(self, report, name, memory, children):
+        super().__init__()
+
+        self._report = report
+        self._name = name
+        self._memory = memory
+        self._children = children
+
+        return
+
+    def __enter__(self):
+        self._report._enter(self._name, self._memory, self._children)
+
+        return self
+
+    def __exit__(self, *exc):
+        self._report._exit()
+
+        return False
+
+
+class TimeReport:
+    """TimeReport class
+
+    Records the time and memory of the phases of a compile.
+
+    Attributes:
+        phases: A dictionary of the 'wall' and 'cpu' seconds and the 'peak'
+            traced bytes of each phase by name. The peak is None for phases
+            whose memory is not traced.
+        counts: A dictionary of the counts of the compile by name.
+        total: A dictionary of the 'wall' and 'cpu' seconds and the 'peak'
+            traced bytes of the whole compile.
+
+    Methods:
+        start: Starts recording the compile.
+        stop: Stops recording the compile.
+        phase: Returns a context manager timing a phase.
+        instrument: Times the phases run by a Parser object.
+        count_code: Records the counts of the code of a Parser object.
+        table: Formats the report as a table.
+        as_dict: Returns the report as a dictionary for JSON.
+    """
+    def __init__(self):
+        super().__init__()
+
+        self.phases = OrderedDict(
+            (name, {'wall': 0.0, 'cpu': 0.0, 'peak': None})
+            for name in PHASES)
+        self.counts = OrderedDict((name, 0) for name in COUNTS)
+        self.total = {'wall': 0.0, 'cpu': 0.0, 'peak': 0}
+
+        # Holds the phases being run, innermost last
+        self._stack = []
+        self._started = None
+        self._tracing = False
+
+        return
+
+    def start(self):
+        """Start Report
+
+        Starts recording the compile and tracing memory.
+        """
+        import tracemalloc
+
+        self._tracing = not tracemalloc.is_tracing()
+
+        if self._tracing:
+            tracemalloc.start()
+
+        tracemalloc.reset_peak()
+        self._started = (self._clock(False), self._clock(True))
+
+        return
+
+    def stop(self):
+        """Stop Report
+
+        Stops recording the compile, and tracing memory if it was started
+        by the report. The total CPU time is that of this process and of the
+        child processes waited for.
+        """
+        import tracemalloc
+
+        wall, cpu = self._clock(False)
+        self.total['wall'] = wall - self._started[0][0]
+        self.total['cpu'] = cpu - self._started[0][1] + \
+            self._clock(True)[1] - self._started[1][1]
+        self.total['peak'] = max([tracemalloc.get_traced_memory()[1]] +
+                                 [p['peak'] or 0
+                                  for p in self.phases.values()])
+
+        if self._tracing:
+            tracemalloc.stop()
+            self._tracing = False
+
+        return
+
+    def phase(self, name, children=False):
+        """Time Phase
+
+        Arguments:
+            name: The name of the phase, one of PHASES.
+            children: If True, the CPU time is that of the child processes
+                waited for during the phase, whose memory is not traced.
+                (Default: False)
+
+        Returns:
+            A context manager timing a run of the phase.
+        """
+        return _Phase(self, name, not children, children)
+
+    def instrument(self, parser):
+        """Instrument Parser
+
+        Times the phases run by a Parser object, and counts the tokens it
+        reads and the C code it writes. Only this object is changed.
+
+        Arguments:
+            parser: The Parser object of the compile.
+        """
+        counts = self.counts
+
+        def count_token(token):
+            counts['tokens'] += 1
+
+        def count_code(path, code):
+            counts['c_lines'] += len(code)
+            counts['c_bytes'] += sum(4 * tabs + len(line) + 1
+                                     for tabs, line in code)
+
+        # Reading a token is too short to trace memory over
+        self._wrap(parser, 'next_token', 'scan', False, after=count_token)
+        self._wrap(parser, 'parse', 'parse')
+        self._wrap(parser, 'parse_text', 'parse')
+        self._wrap(parser, 'commit', 'optimize')
+        self._wrap(parser, '_lower', 'lower')
+        self._wrap(parser, '_write_code', 'write', before=count_code)
+
+        if parser.peephole is not None:
+            self._wrap(parser.peephole, 'optimize', 'peephole')
+
+        return
+
+    def count_code(self, parser):
+        """Count Code
+
+        Records the counts of the code generated by a Parser object once it
+        has committed.
+
+        Arguments:
+            parser: The Parser object of the compile.
+        """
+        self.counts.update(parser.code_counts())
+
+        return
+
+    def table(self):
+        """Format Table
+
+        Returns:
+            A multi-line string of the time and memory of each phase and of
+            the counts of the compile.
+        """
+        lines = ['Time report:',
+                 '    %-10s %10s %10s %12s  %s' % ('phase', 'wall', 'cpu',
+                                                   'peak mem', '')]
+
+        for name, description in PHASES.items():
+            phase = self.phases[name]
+            peak = '-' if phase['peak'] is None else \
+                '%.1f KiB' % (phase['peak'] / 1024.0)
+            lines.append('    %-10s %9.1fms %9.1fms %12s  %s' % (
+                name, phase['wall'] * 1000, phase['cpu'] * 1000, peak,
+                description))
+
+        lines.append('    %-10s %9.1fms %9.1fms %8.1f KiB' % (
+            'total', self.total['wall'] * 1000, self.total['cpu'] * 1000,
+            self.total['peak'] / 1024.0))
+
+        for name, description in COUNTS.items():
+            lines.append('    %-20s %10d' % (description, self.counts[name]))
+
+        return '\n'.join(lines)
+
+    def as_dict(self):
+        """Get Dictionary
+
+        Returns:
+            A dictionary of the 'phases', 'total' and 'counts' of the report,
+            with times in seconds and memory in bytes.
+        """
+        return {'phases': self.phases, 'total': self.total,
+                'counts': self.counts}
+
+    def _wrap(self, obj, method, name, memory=True, before=None,
+              after=None):
+        """Wrap Method (Protected)
+
+        Replaces a method of an object with one timing it as a phase.
+
+        Arguments:
+            obj: The object whose method is wrapped.
+            method: The name of the method.
+            name: The name of the phase.
+            memory: If True, memory is traced over the phase. (Default: True)
+            before: A function given the arguments of each call, or None.
+                (Default: None)
+            after: A function given the result of each call, or None.
+                (Default: None)
+        """
+        function = getattr(obj, method)
+
+        def timed(*args, **kwargs):
+            if before is not None:
+                before(*args, **kwargs)
+
+            with _Phase(self, name, memory, False):
+                result = function(*args, **kwargs)
+
+            if after is not None:
+                after(result)
+
+            return result
+
+        setattr(obj, method, timed)
+
+        return
+
+    def _clock(self, children):
+        """Read Clock (Protected)
+
+        Arguments:
+            children: If True, the CPU time is that of the child processes
+                waited for so far, otherwise that of this process.
+
+        Returns:
+            A tuple of the wall and CPU seconds.
+        """
+        if children:
+            usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+            cpu = usage.ru_utime + usage.ru_stime
+        else:
+            cpu = time.process_time()
+
+        return time.perf_counter(), cpu
+
+    def _enter(self, name, memory, children):
+        """Enter Phase (Protected)
+
+        Starts a run of a phase within the current one.
+        """
+        # The peak reached so far belongs to the enclosing phase
+        if memory:
+            import tracemalloc
+
+            peak = tracemalloc.get_traced_memory()[1]
+
+            if self._stack and self._stack[-1][1]:
+                outer = self.phases[self._stack[-1][0]]
+                outer['peak'] = max(outer['peak'] or 0, peak)
+
+            tracemalloc.reset_peak()
+
+        self._stack.append((name, memory, children, self._clock(children),
+                            [0.0, 0.0]))
+
+        return
+
+    def _exit(self):
+        """Exit Phase (Protected)
+
+        Ends the run of the current phase, adding its time to it less that of
+        the phases run within it.
+        """
+        name, memory, children, start, inner = self._stack.pop()
+        wall, cpu = self._clock(children)
+        phase = self.phases[name]
+
+        phase['wall'] += wall - start[0] - inner[0]
+
+        # Phases timing child processes do not take time from this process
+        if children:
+            phase['cpu'] += cpu - start[1]
+        else:
+            phase['cpu'] += cpu - start[1] - inner[1]
+
+        if memory:
+            import tracemalloc
+
+            phase['peak'] = max(phase['peak'] or 0,
+                                tracemalloc.get_traced_memory()[1])
+
+        if self._stack:
+            outer = self._stack[-1][4]
+            outer[0] += wall - start[0]
+
+            if not children:
+                outer[1] += cpu - start[1]
+
+        return
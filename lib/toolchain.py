@@ -0,0 +1,406 @@
+#!/usr/bin/env python3
+
+"""Toolchain module
+
+Describes the C compiler which builds the generated code and the flags it is
+given. A Toolchain object assembles the compile, object and link commands
+from an optimization level, a target processor, link time optimization and
+extra CFLAGS/LDFLAGS, optionally starting from a named build profile.
+
+The capabilities of a C compiler (which code models it can build, whether it
+accepts -march=native and -flto) are probed by compiling a tiny program. The
+result is kept for the life of the process and in a cache file, so each
+compiler is only probed again once its executable changes.
+
+Author: Evan Sneath
+License: Open Software License v3.0
+
+Classes:
+    Profile: A named tuple object describing a build profile.
+    Toolchain: Builds the C compiler commands of a compilation.
+
+Functions:
+    probe: Probes the capabilities of a C compiler.
+"""
+
+import json
+import os
+import shutil
+import subprocess
+from collections import namedtuple
+
+
+"""Profile class
+
+A named tuple object factory describing a build profile.
+
+Attributes:
+    opt_level: The C optimization level ('0', '1', '2', '3' or 's'), or None
+        to pass no level.
+    native: If True, the code is tuned for the processor of the host.
+    lto: If True, split units are linked with link time optimization.
+    ir_opt: If True, the IR optimization passes are run.
+    inline: If True, small procedures are inlined.
+    peephole: If True, the peephole optimizer is run.
+    description: A short description of the profile.
+"""
+Profile = namedtuple('Profile', ['opt_level', 'native', 'lto', 'ir_opt',
+                                 'inline', 'peephole', 'description'])
+
+
+"""The build profiles by name."""
+PROFILES = {
+    'fast-build': Profile('0', False, False, False, False, False,
+                          'no optimization, shortest build'),
+    'fast-run': Profile('2', True, True, True, True, True,
+                        'every optimizer, -O2 tuned for this processor'),
+}
+
+"""The default C compiler, overridden by the CC environment variable."""
+DEFAULT_CC = os.environ.get('CC', 'gcc')
+
+"""The directory of the files cached by the compiler."""
+CACHE_ROOT = os.path.join(os.environ.get('XDG_CACHE_HOME') or
+                          os.path.join(os.path.expanduser('~'), '.cache'),
+                          'evansneath-compiler')
+
+"""The default directory of the build cache."""
+DEFAULT_CACHE_DIR = os.path.join(CACHE_ROOT, 'builds')
+
+"""The default size cap of the build cache in bytes."""
+DEFAULT_CACHE_SIZE = 512 * 2**20
+
+"""The file holding the probed capabilities of each C compiler."""
+CACHE_FILE = os.path.join(CACHE_ROOT, 'toolchain.json')
+
+"""The source name standing for C code read from stdin."""
+STDIN = '-'
+
+"""The program compiled to probe a C compiler."""
+PROBE_PROGRAM = 'int main(void) { return 0; }\n'
+
+"""The flags tried by a probe, by capability name."""
+PROBE_FLAGS = {
+    'm32': ['-m32'],
+    'm64': ['-m64'],
+    'march_native': ['-march=native'],
+    'lto': ['-flto'],
+}
+
+# Holds the capabilities probed by this process, by compiler path
+_probed = {}
+
+
+def _run_probe(path):
+    """Run Probe (Protected)
+
+    Arguments:
+        path: The full path of the C compiler executable.
+
+    Returns:
+        A dictionary of the compiler version and of each capability of
+        PROBE_FLAGS to True if a program could be built with its flags.
+    """
+    import tempfile
+
+    try:
+        version = subprocess.run([path, '--version'], capture_output=True,
+                                 text=True).stdout.split('\n')[0]
+    except OSError:
+        version = ''
+
+    capabilities = {'version': version}
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        source = os.path.join(work_dir, 'probe.c')
+
+        with open(source, 'w') as f:
+            f.write(PROBE_PROGRAM)
+
+        for name, flags in sorted(PROBE_FLAGS.items()):
+            cmd = [path] + flags + ['-o', os.path.join(work_dir, name), source]
+
+            try:
+                capabilities[name] = subprocess.call(
+                    cmd, stdout=subprocess.DEVNULL,
+                    stderr=subprocess.DEVNULL) == 0
+            except OSError:
+                capabilities[name] = False
+
+    return capabilities
+
+
+def probe(cc):
+    """Probe Compiler
+
+    Probes the capabilities of a C compiler. Results are reused from this
+    process or from the cache file as long as the compiler executable has the
+    same modification time and size.
+
+    Arguments:
+        cc: The name or path of the C compiler.
+
+    Returns:
+        A dictionary with the 'version' line of the compiler and a boolean
+        for each capability of PROBE_FLAGS, or None if the compiler was not
+        found.
+    """
+    path = shutil.which(cc)
+
+    if path is None:
+        return None
+
+    path = os.path.realpath(path)
+
+    if path in _probed:
+        return _probed[path]
+
+    stat = os.stat(path)
+    stamp = [stat.st_mtime, stat.st_size]
+
+    try:
+        with open(CACHE_FILE) as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        cache = {}
+
+    entry = cache.get(path)
+
+    if entry is not None and entry.get('stamp') == stamp:
+        capabilities = entry['capabilities']
+    else:
+        capabilities = _run_probe(path)
+        cache[path] = {'stamp': stamp, 'capabilities': capabilities}
+
+        # The cache is only an optimization, so failing to write it is fine
+        try:
+            os.makedirs(os.path.dirname(CACHE_FILE), exist_ok=True)
+            temp_path = '%s.%d' % (CACHE_FILE, os.getpid())
+
+            with open(temp_path, 'w') as f:
+                json.dump(cache, f, indent=1, sort_keys=True)
+
+            os.replace(temp_path, CACHE_FILE)
+        except OSError:
+            pass
+
+    _probed[path] = capabilities
+
+    return capabilities
+
+
+class Toolchain:
+    """Toolchain class
+
+    Builds the C compiler commands of a compilation. Settings which are not
+    given are taken from the build profile, if any. Tuning for the host
+    processor and link time optimization are dropped if the compiler does
+    not support them.
+
+    Attributes:
+        cc: The name or path of the C compiler.
+        profile: The name of the build profile, or None.
+        opt_level: The C optimization level, or None to pass no level.
+        march: The processor to generate code for, or None.
+        lto: If True, objects are compiled and linked with link time
+            optimization.
+        cflags: A list of extra flags for every compile.
+        ldflags: A list of extra flags for every link.
+
+    Methods:
+        capabilities: Returns the probed capabilities of the compiler.
+        check: Checks the compiler can build a code model.
+        compile_command: Builds a command compiling sources to a binary.
+        object_command: Builds a command compiling a source to an object.
+        link_command: Builds a command linking objects to a binary.
+        identity: Identifies the compiler executable and its flags.
+        describe: Describes the compiler and its flags for display.
+    """
+    def __init__(self, cc=DEFAULT_CC, profile=None, opt_level=None,
+                 march=None, lto=False, cflags=None, ldflags=None):
+        super().__init__()
+
+        settings = PROFILES[profile] if profile is not None else None
+
+        self.cc = cc
+        self.profile = profile
+        self.opt_level = opt_level
+        self.march = march
+        self.lto = lto
+        self.cflags = list(cflags or [])
+        self.ldflags = list(ldflags or [])
+
+        if settings is not None:
+            if self.opt_level is None:
+                self.opt_level = settings.opt_level
+
+            if self.march is None and settings.native:
+                self.march = 'native'
+
+            self.lto = self.lto or settings.lto
+
+        return
+
+    def capabilities(self):
+        """Get Capabilities
+
+        Returns:
+            The capabilities dictionary of the compiler (see probe()), or
+            None if the compiler was not found.
+        """
+        return probe(self.cc)
+
+    def check(self, code_model):
+        """Check Code Model
+
+        Arguments:
+            code_model: The target code model, '32' or '64'.
+
+        Returns:
+            None if the compiler can build the code model, an error message
+            otherwise.
+        """
+        capabilities = self.capabilities()
+
+        if capabilities is None:
+            return 'C compiler "%s" was not found' % self.cc
+
+        if not capabilities['m%s' % code_model]:
+            message = 'C compiler "%s" cannot build %s-bit programs' % (
+                self.cc, code_model)
+
+            if code_model == '32':
+                message += ' (is 32-bit multilib support installed? ' \
+                           '-t 64 does not need it)'
+
+            return message
+
+        return None
+
+    def compile_command(self, code_model, sources, target):
+        """Build Compile Command
+
+        Arguments:
+            code_model: The target code model, '32' or '64'.
+            sources: A list of C sources and objects to build from. STDIN
+                stands for C code read from stdin.
+            target: The path of the binary to build.
+
+        Returns:
+            The command as a list of arguments.
+        """
+        lto = len(sources) > 1
+        inputs = []
+
+        # The language of stdin must be given, and reset for any objects
+        for source in sources:
+            if source == STDIN:
+                inputs.extend(['-x', 'c', STDIN, '-x', 'none'])
+            else:
+                inputs.append(source)
+
+        return [self.cc] + self._cflags(code_model, lto) + \
+            ['-o', target] + inputs + self.ldflags
+
+    def object_command(self, code_model, source, target, opt_level=None):
+        """Build Object Command
+
+        Arguments:
+            code_model: The target code model, '32' or '64'.
+            source: The C source to compile.
+            target: The path of the object to build.
+            opt_level: The optimization level to use when the toolchain has
+                none. (Default: None)
+
+        Returns:
+            The command as a list of arguments.
+        """
+        return [self.cc] + self._cflags(code_model, True, opt_level) + \
+            ['-c', '-o', target, source]
+
+    def link_command(self, code_model, objects, target):
+        """Build Link Command
+
+        Arguments:
+            code_model: The target code model, '32' or '64'.
+            objects: A list of objects to link.
+            target: The path of the binary to build.
+
+        Returns:
+            The command as a list of arguments.
+        """
+        return [self.cc] + self._cflags(code_model, True) + \
+            ['-o', target] + objects + self.ldflags
+
+    def identity(self, code_model):
+        """Get Identity
+
+        Arguments:
+            code_model: The target code model, '32' or '64'.
+
+        Returns:
+            A string which changes whenever the compiler executable or any
+            flag of its commands changes. Tuning for the host processor also
+            names the host.
+        """
+        path = shutil.which(self.cc)
+        stat = os.stat(path) if path is not None else None
+
+        return json.dumps([
+            os.path.realpath(path) if path is not None else self.cc,
+            [stat.st_mtime, stat.st_size] if stat is not None else None,
+            (self.capabilities() or {}).get('version'),
+            os.uname().nodename if self.march == 'native' else None,
+            self.compile_command(code_model, [STDIN], 'a.out'),
+            self.object_command(code_model, 'a.c', 'a.o', '2'),
+            self.link_command(code_model, ['a.o'], 'a.out'),
+        ])
+
+    def describe(self):
+        """Describe Toolchain
+
+        Returns:
+            A string naming the compiler, its version and the flags of the
+            toolchain.
+        """
+        capabilities = self.capabilities() or {}
+        flags = ' '.join(self._cflags(None, True) + self.ldflags)
+
+        return 'Toolchain: %s (%s)%s%s' % (
+            self.cc, capabilities.get('version') or 'not found',
+            ' profile %s' % self.profile if self.profile else '',
+            ', flags: %s' % flags if flags else '')
+
+    def _cflags(self, code_model, lto, opt_level=None):
+        """Get Compile Flags (Protected)
+
+        Arguments:
+            code_model: The target code model, or None to leave it out.
+            lto: If True, link time optimization is used when enabled.
+            opt_level: The optimization level to use when the toolchain has
+                none. (Default: None)
+
+        Returns:
+            A list of the flags of a compile.
+        """
+        capabilities = self.capabilities() or {}
+        flags = []
+
+        if code_model is not None:
+            flags.append('-m%s' % code_model)
+
+        if self.opt_level is not None:
+            flags.append('-O%s' % self.opt_level)
+        elif opt_level is not None:
+            flags.append('-O%s' % opt_level)
+
+        # Native tuning is dropped where unsupported, other targets are not
+        if self.march is not None and (self.march != 'native' or
+                                       capabilities.get('march_native')):
+            flags.append('-march=%s' % self.march)
+
+        if lto and self.lto and capabilities.get('lto'):
+            flags.append('-flto')
+
+        return flags + self.cflags
+
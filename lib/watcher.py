@@ -0,0 +1,364 @@
+#!/usr/bin/env python3
+
+"""Watcher module
+
+Waits for changes to a set of files. On Linux the directories of the files
+are watched with inotify (through ctypes, so no package is needed), which
+also catches editors saving a file by renaming a new one over it. Elsewhere,
+or if inotify is not available, the files are polled with stat(). The watch
+mode of the command line compiles source files again whenever they change.
+
+Author: Evan Sneath
+License: Open Software License v3.0
+
+Classes:
+    Watcher: Waits for changes to a set of files.
+
+Functions:
+    run_watch: Compiles source files again whenever they change.
+"""
+
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import sys
+import time
+
+from lib.batch import run_batch
+from lib.build import run_compiler
+
+
+"""The seconds between two polls of the files when inotify is not used."""
+POLL_INTERVAL = 0.2
+
+"""The seconds without changes which end a burst of changes."""
+DEBOUNCE = 0.05
+
+# Flags of inotify_init1() and events of inotify_add_watch() (inotify.h)
+_IN_NONBLOCK = 0o4000
+_IN_CLOEXEC = 0o2000000
+_IN_CLOSE_WRITE = 0x8
+_IN_MOVED_TO = 0x80
+_IN_CREATE = 0x100
+_IN_Q_OVERFLOW = 0x4000
+
+"""The header of an inotify event: wd, mask, cookie and name length."""
+_EVENT = struct.Struct('iIII')
+
+
+class Watcher:
+    """Watcher class
+
+    Waits for changes to a set of files, debouncing bursts of changes such
+    as an editor writing a file in several steps.
+
+    Attributes:
+        paths: The set of absolute paths of the watched files.
+        method: The name of the way the files are watched, 'inotify' or
+            'polling'.
+
+    Methods:
+        wait: Waits for a burst of changes to the files.
+        close: Stops watching the files.
+    """
+    def __init__(self, paths, use_inotify=True):
+        super().__init__()
+
+        self.paths = set(os.path.abspath(path) for path in paths)
+        self.method = 'polling'
+
+        self._fd = None
+        self._directories = {}
+        self._stamps = self._stat_all()
+
+        if use_inotify:
+            self._start_inotify()
+
+        return
+
+    def wait(self, timeout=None):
+        """Wait for Changes
+
+        Waits until at least one file changes, then until no file has changed
+        for DEBOUNCE seconds.
+
+        Arguments:
+            timeout: The most seconds to wait for a first change, or None to
+                wait for ever. (Default: None)
+
+        Returns:
+            A tuple of the set of paths of the changed files and the time
+            (from time.perf_counter()) the first change was seen. The set is
+            empty if the timeout passed first.
+        """
+        changed = self._changes(timeout)
+        first_seen = time.perf_counter()
+
+        # Files may change more than once in a burst
+        while changed:
+            more = self._changes(DEBOUNCE)
+
+            if not more:
+                break
+
+            changed |= more
+
+        return changed, first_seen
+
+    def close(self):
+        """Close Watcher
+
+        Stops watching the files.
+        """
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+        return
+
+    def _start_inotify(self):
+        """Start Inotify (Protected)
+
+        Watches the directories of the files with inotify, if the C library
+        provides it. The watcher stays in polling mode otherwise.
+        """
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6',
+                               use_errno=True)
+            init = libc.inotify_init1
+            add_watch = libc.inotify_add_watch
+        except (OSError, AttributeError):
+            return
+
+        add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        fd = init(_IN_NONBLOCK | _IN_CLOEXEC)
+
+        if fd < 0:
+            return
+
+        mask = _IN_CLOSE_WRITE | _IN_MOVED_TO | _IN_CREATE
+
+        for directory in set(os.path.dirname(path) for path in self.paths):
+            wd = add_watch(fd, os.fsencode(directory), mask)
+
+            if wd < 0:
+                os.close(fd)
+                self._directories = {}
+                return
+
+            self._directories[wd] = directory
+
+        self._fd = fd
+        self.method = 'inotify'
+
+        return
+
+    def _changes(self, timeout):
+        """Get Changes (Protected)
+
+        Arguments:
+            timeout: The most seconds to wait for a change, or None to wait
+                for ever.
+
+        Returns:
+            The set of paths of the files changed, empty if none changed
+            before the timeout.
+        """
+        if self._fd is not None:
+            return self._read_events(timeout)
+
+        deadline = time.perf_counter() + timeout if timeout is not None \
+            else None
+
+        while True:
+            stamps = self._stat_all()
+            changed = set(path for path in self.paths
+                          if stamps[path] != self._stamps[path])
+            self._stamps = stamps
+
+            if changed:
+                return changed
+
+            if deadline is not None and time.perf_counter() >= deadline:
+                return set()
+
+            delay = POLL_INTERVAL if deadline is None else \
+                max(0, min(POLL_INTERVAL, deadline - time.perf_counter()))
+            time.sleep(delay)
+
+    def _read_events(self, timeout):
+        """Read Events (Protected)
+
+        Arguments:
+            timeout: The most seconds to wait for an event, or None to wait
+                for ever.
+
+        Returns:
+            The set of paths of the watched files named by the events read.
+        """
+        readable, _, _ = select.select([self._fd], [], [], timeout)
+
+        if not readable:
+            return set()
+
+        try:
+            data = os.read(self._fd, 65536)
+        except BlockingIOError:
+            return set()
+
+        changed = set()
+        offset = 0
+
+        while offset + _EVENT.size <= len(data):
+            wd, mask, _, length = _EVENT.unpack_from(data, offset)
+            name = data[offset + _EVENT.size:offset + _EVENT.size + length]
+            offset += _EVENT.size + length
+
+            # Events were lost, so any file may have changed
+            if mask & _IN_Q_OVERFLOW:
+                changed |= self.paths
+                continue
+
+            if wd in self._directories:
+                path = os.path.join(self._directories[wd],
+                                    os.fsdecode(name.rstrip(b'\0')))
+
+                if path in self.paths:
+                    changed.add(path)
+
+        return changed
+
+    def _stat_all(self):
+        """Stat Files (Protected)
+
+        Returns:
+            A dictionary of the modification time, size and inode of each
+            file by path, None for any missing file.
+        """
+        stamps = {}
+
+        for path in self.paths:
+            try:
+                stat = os.stat(path)
+                stamps[path] = (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+            except OSError:
+                stamps[path] = None
+
+        return stamps
+
+
+def run_watch(sources, out, out_dir, workers, use_inotify=True,
+              keep_ir=None, **options):
+    """Run Watch
+
+    Compiles source files, then compiles each again whenever it changes
+    until interrupted. The compiler stays loaded, the C compiler probed and
+    the runtime object built between compiles, and a source saved without a
+    change to its contents is not compiled again. Split units are kept
+    between the compiles of a program, so only the units whose code changed
+    are compiled again. The result of each compile is printed with the
+    seconds from the change being seen to the program being written.
+
+    Arguments:
+        sources: A list of source file paths.
+        out: The path of the program of a single source file.
+        out_dir: The directory of the programs of several source files.
+        workers: The number of worker processes of the first batch.
+        use_inotify: If True, changes are watched with inotify where it is
+            available. (Default: True)
+        keep_ir: The path to write the generated code of a single source
+            file to, or None. (Default: None)
+        options: The run_compiler() arguments of every compile.
+
+    Returns:
+        True once interrupted or terminated.
+    """
+    import hashlib
+    import shutil
+    import signal
+    import tempfile
+
+    if len(sources) == 1:
+        jobs = {os.path.abspath(sources[0]): (sources[0], out)}
+    else:
+        jobs = dict((os.path.abspath(source), (source, os.path.join(
+            out_dir, os.path.splitext(os.path.basename(source))[0])))
+            for source in sources)
+
+    # The contents each program was last compiled from
+    digests = {}
+
+    # The split units of each program, kept between its compiles
+    unit_dirs = {}
+
+    if options.get('jobs', 1) > 1 and keep_ir is None:
+        for path in jobs:
+            unit_dirs[path] = tempfile.mkdtemp(prefix='compiler-watch-')
+
+    def digest(path):
+        try:
+            with open(path, 'rb') as f:
+                return hashlib.sha1(f.read()).hexdigest()
+        except IOError:
+            return None
+
+    def build(path, first_seen=None):
+        source, target = jobs[path]
+        start = time.perf_counter()
+        succeeded = run_compiler(source, target, keep_ir=keep_ir,
+                                 unit_dir=unit_dirs.get(path), **options)
+        end = time.perf_counter()
+
+        print('%-6s %7.3fs  %s%s' % (
+            'ok' if succeeded else 'FAILED', end - start, source,
+            ' (%.3fs after the change)' % (end - first_seen)
+            if first_seen is not None else ''))
+        sys.stdout.flush()
+
+        return
+
+    watcher = Watcher(jobs, use_inotify)
+
+    for path in jobs:
+        digests[path] = digest(path)
+
+    # Being terminated stops watching like an interrupt, cleaning up
+    def terminate(signum, frame):
+        raise KeyboardInterrupt
+
+    signal.signal(signal.SIGTERM, terminate)
+
+    try:
+        # The first compile of several source files runs as a batch, and
+        # any failure is fixed by a change like any other
+        if len(jobs) > 1:
+            run_batch(sources, out_dir, workers, **options)
+        else:
+            build(list(jobs)[0])
+
+        print('Watching %d source file%s (%s), press Ctrl-C to stop' % (
+            len(jobs), 's' if len(jobs) > 1 else '', watcher.method))
+        sys.stdout.flush()
+
+        while True:
+            changed, first_seen = watcher.wait()
+
+            for path in sorted(changed):
+                contents = digest(path)
+
+                if contents is not None and contents == digests[path]:
+                    continue
+
+                digests[path] = contents
+                build(path, first_seen)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        watcher.close()
+
+        for unit_dir in unit_dirs.values():
+            shutil.rmtree(unit_dir, ignore_errors=True)
+
+    return True
@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+
+"""Compile API test module
+
+Compiles every tests/*.src program with the command line interface, keeping
+the generated C code, and then with the in-memory compile API (see
+lib/api.py) on several threads at once, each program twice. Every API compile
+must generate the same code and report the same errors and warnings as the
+command line did, and print nothing.
+
+Author: Evan Sneath
+License: Open Software License v3.0
+
+Functions:
+    parse_arguments: Parses incoming command line arguments.
+    compile_program: Runs the compiler on a program in a subprocess.
+    parse_diagnostics: Reads the diagnostics printed by the compiler.
+    run_test: Compiles the programs both ways and compares them.
+"""
+
+# Import standard libraries
+import argparse
+import contextlib
+import glob
+import io
+import os
+import re
+import subprocess
+import sys
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+# Make the compiler importable when run from the tools directory
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from lib.api import compile_source
+
+"""The compiler command line interface."""
+COMPILER = os.path.join(ROOT, 'compiler.py')
+
+"""The compiler arguments of each build and the matching API options."""
+BUILDS = [
+    ([], {}),
+    (['-p', '-i', '-n'], dict(peephole=True, ir_opt=True, inline=True)),
+    (['-c', 'native', '--io', 'buffered'],
+     dict(call_model='native', io='buffered')),
+]
+
+"""The first line of a diagnostic printed by the compiler."""
+DIAGNOSTIC = re.compile(r'^(Error|Warning): "(.*)", line (\d+)$')
+
+
+def parse_arguments():
+    """Parse Arguments
+
+    Parses all command line arguments for the compile API test.
+
+    Returns:
+        An object containing all expected command line arguments.
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', '--threads',
+                        help='threads compiling at once (default: 8)',
+                        type=int,
+                        default=8)
+    parser.add_argument('-t', '--target',
+                        help='code model of the builds (default: 32)',
+                        choices=['32', '64'],
+                        default='32')
+    parser.add_argument('tests',
+                        help='test programs to compile (default: '
+                             'tests/*.src)',
+                        nargs='*')
+    args = parser.parse_args()
+
+    return args
+
+
+def compile_program(source, code_path, target, build):
+    """Compile Program
+
+    Arguments:
+        source: The source file to compile.
+        code_path: The path the generated C code is kept at.
+        target: The code model of the build.
+        build: A list of extra compiler arguments.
+
+    Returns:
+        A (code, output) tuple of the generated code, None if the source did
+        not parse, and the output of the compiler run.
+    """
+    binary = os.path.splitext(code_path)[0]
+    result = subprocess.run([sys.executable, COMPILER, '-t', target,
+                             '--keep-ir', code_path, '-o', binary, source] +
+                            build, stdout=subprocess.PIPE,
+                            stderr=subprocess.STDOUT, text=True)
+    code = None
+
+    if os.path.isfile(code_path):
+        with open(code_path) as f:
+            code = f.read()
+
+    return code, result.stdout
+
+
+def parse_diagnostics(output):
+    """Parse Diagnostics
+
+    Arguments:
+        output: The output of a compiler run.
+
+    Returns:
+        A list of (severity, path, line, message, text) tuples of each
+        diagnostic printed.
+    """
+    lines = output.splitlines()
+    diagnostics = []
+
+    for index, line in enumerate(lines):
+        match = DIAGNOSTIC.match(line)
+
+        if match is not None:
+            diagnostics.append((match.group(1).lower(), match.group(2),
+                                int(match.group(3)), lines[index + 1][4:],
+                                lines[index + 2][4:]))
+
+    return diagnostics
+
+
+def run_test(tests, threads, target):
+    """Run Compile API Test
+
+    Arguments:
+        tests: A list of source file paths to compile.
+        threads: The number of threads compiling at once.
+        target: The code model of the builds.
+
+    Returns:
+        True if every API compile matched the command line and printed
+        nothing, False otherwise.
+    """
+    passed = True
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        expected = {}
+
+        for source in tests:
+            for index, (build, _) in enumerate(BUILDS):
+                code_path = os.path.join(work_dir, '%d_%s.c' % (
+                    index, os.path.splitext(os.path.basename(source))[0]))
+                expected[source, index] = compile_program(
+                    source, code_path, target, build)
+
+    jobs = sorted(expected) * 2
+
+    def compile_job(job):
+        source, index = job
+
+        with open(source) as f:
+            text = f.read()
+
+        return compile_source(text, source, code_model=target,
+                              **BUILDS[index][1])
+
+    # Anything printed by any thread is caught
+    printed = io.StringIO()
+
+    with contextlib.redirect_stdout(printed):
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            results = list(executor.map(compile_job, jobs))
+
+    for (source, index), result in zip(jobs, results):
+        code, output = expected[source, index]
+        label = '%-24s %-28s' % (os.path.splitext(os.path.basename(source))[0],
+                                 ' '.join(BUILDS[index][0]) or 'stream')
+        diagnostics = [(d.severity, d.path, d.line, d.message, d.text)
+                       for d in result.diagnostics]
+
+        if result.code != code:
+            print('%s FAIL (code differs)' % label)
+            passed = False
+        elif diagnostics != parse_diagnostics(output):
+            print('%s FAIL (diagnostics differ)' % label)
+            passed = False
+        else:
+            print('%s ok' % label)
+
+    if printed.getvalue():
+        print('FAIL: the API printed:\n%s' % printed.getvalue())
+        passed = False
+
+    return passed
+
+
+if __name__ == '__main__':
+    args = parse_arguments()
+
+    tests = [os.path.abspath(t) for t in args.tests]
+    if not tests:
+        tests = sorted(glob.glob(os.path.join(ROOT, 'tests', '*.src')))
+
+    sys.exit(not run_test(tests, args.threads, args.target))
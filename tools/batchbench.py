@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+
+"""Batch compile benchmark module
+
+Generates a number of small programs (1000 by default) and compiles them
+twice: once with a loop of single compiler invocations, one Python
+interpreter per program, and once as a single batch over a pool of worker
+processes. The wall clock time and throughput of both are reported, and every
+pair of programs must print the same result.
+
+Author: Evan Sneath
+License: Open Software License v3.0
+
+Functions:
+    parse_arguments: Parses incoming command line arguments.
+    write_programs: Writes the sources of the benchmark programs.
+    run_benchmark: Compiles the programs both ways and times them.
+"""
+
+# Import standard libraries
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+# Make the compiler importable when run from the tools directory
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+"""The compiler command line interface."""
+COMPILER = os.path.join(ROOT, 'compiler.py')
+
+
+def parse_arguments():
+    """Parse Arguments
+
+    Parses all command line arguments for the batch compile benchmark.
+
+    Returns:
+        An object containing all expected command line arguments.
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', '--programs',
+                        help='number of programs (default: 1000)',
+                        type=int,
+                        default=1000)
+    parser.add_argument('-w', '--workers',
+                        help='worker processes of the batch (default: the '
+                             'number of cores)',
+                        type=int,
+                        default=os.cpu_count() or 1)
+    parser.add_argument('-t', '--target',
+                        help='code model of the builds (default: 32)',
+                        choices=['32', '64'],
+                        default='32')
+    args = parser.parse_args()
+
+    return args
+
+
+def write_programs(directory, count):
+    """Write Programs
+
+    Writes small programs which each sum a range of integers through a
+    procedure and print the sum.
+
+    Arguments:
+        directory: The directory to write the sources to.
+        count: The number of programs.
+
+    Returns:
+        The list of source file paths.
+    """
+    sources = []
+
+    for k in range(count):
+        path = os.path.join(directory, 'prog%d.src' % k)
+
+        with open(path, 'w') as f:
+            f.write('program prog%d is\n\n'
+                    '    integer i;\n'
+                    '    integer sum;\n\n'
+                    '    procedure add(integer a in, integer b in, '
+                    'integer r out)\n'
+                    '    begin\n'
+                    '        r := a + b;\n'
+                    '    end procedure;\n\n'
+                    'begin\n\n'
+                    '    sum := 0;\n'
+                    '    i := 0;\n\n'
+                    '    for (i := i + 1; i <= %d)\n'
+                    '        add(sum, i, sum);\n'
+                    '    end for;\n\n'
+                    '    putInteger(sum);\n\n'
+                    'end program\n' % (k, k + 10))
+
+        sources.append(path)
+
+    return sources
+
+
+def run_benchmark(count, workers, target):
+    """Run Benchmark
+
+    Arguments:
+        count: The number of programs.
+        workers: The number of worker processes of the batch.
+        target: The code model of the builds.
+
+    Returns:
+        True if both ways built every program and the programs print the
+        same results, False otherwise.
+    """
+    with tempfile.TemporaryDirectory() as work_dir:
+        os.chdir(work_dir)
+
+        sources = write_programs(work_dir, count)
+        single_dir = os.path.join(work_dir, 'single')
+        batch_dir = os.path.join(work_dir, 'batch')
+        os.mkdir(single_dir)
+
+        print('%d programs, %d cores' % (count, os.cpu_count() or 1))
+
+        start = time.perf_counter()
+        for source in sources:
+            binary = os.path.join(single_dir, os.path.splitext(
+                os.path.basename(source))[0])
+
+            if subprocess.call([sys.executable, COMPILER, '-t', target,
+                                '-o', binary, source]) != 0:
+                return False
+        single = time.perf_counter() - start
+
+        print('%-28s %9.3fs %8.1f programs/s' % ('single invocations', single,
+                                                 count / single))
+
+        manifest = os.path.join(work_dir, 'manifest.txt')
+        with open(manifest, 'w') as f:
+            f.write(''.join(source + '\n' for source in sources))
+
+        start = time.perf_counter()
+        result = subprocess.run([sys.executable, COMPILER, '-t', target,
+                                 '--manifest', manifest, '--out-dir',
+                                 batch_dir, '-w', str(workers)],
+                                stdout=subprocess.DEVNULL)
+        batch = time.perf_counter() - start
+
+        if result.returncode != 0:
+            return False
+
+        print('%-28s %9.3fs %8.1f programs/s' % (
+            'batch (%d workers)' % workers, batch, count / batch))
+        print('speedup %.2fx' % (single / batch))
+
+        for name in sorted(os.listdir(single_dir)):
+            outputs = [subprocess.check_output([os.path.join(d, name)])
+                       for d in [single_dir, batch_dir]]
+
+            if outputs[0] != outputs[1]:
+                print('FAIL: the outputs of %s differ' % name)
+                return False
+
+    return True
+
+
+if __name__ == '__main__':
+    args = parse_arguments()
+
+    sys.exit(not run_benchmark(args.programs, args.workers, args.target))
@@ -0,0 +1,537 @@
+#!/usr/bin/env python3
+
+"""Runtime benchmark module
+
+Builds every benchmarks/*.src program with each build of a matrix of call
+models, I/O layers and optimizations, and runs each program built several
+times. For every build it records the compile time, the size of the
+generated C code and of the binary, the best and median run time, the CPU
+time and, when perf is installed, the number of user space instructions run.
+Every program built must print its benchmarks/<name>.expected file, or else
+the same output as the first build of the program.
+
+The results are appended to a JSON history (benchmarks/history.json), and
+compared with the last record of the same host and code model, so a change
+to the code generator which makes programs slower or larger shows up as a
+regression.
+
+Author: Evan Sneath
+License: Open Software License v3.0
+
+Functions:
+    parse_arguments: Parses incoming command line arguments.
+    build_matrix: Returns the builds of the benchmark.
+    count_instructions: Counts the instructions a program runs with perf.
+    git_revision: Returns the commit of the compiler being measured.
+    load_history: Reads the history of earlier results.
+    save_history: Writes the history of results.
+    run_build: Builds, checks and runs a program with one build.
+    compare: Compares a result with the one of an earlier record.
+    run_benchmark: Runs every program with every build.
+"""
+
+# Import standard libraries
+import argparse
+import fnmatch
+import glob
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+# Make the compiler importable when run from the tools directory
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from lib.build import run_compiler
+from lib.runner import expected_path, input_path, run_program
+from lib.toolchain import PROFILES, Toolchain
+
+"""The directory of the benchmark programs."""
+BENCHMARKS = os.path.join(ROOT, 'benchmarks')
+
+"""The default file of the history of results."""
+HISTORY = os.path.join(BENCHMARKS, 'history.json')
+
+"""The optimizations of the matrix, as the run_compiler() arguments of each
+but the toolchain, and the C optimization level and build profile of its
+toolchain."""
+OPTIMIZATIONS = [
+    ('none', {}, None, None),
+    ('ir', {'ir_opt': True, 'peephole': True, 'inline': True}, None, None),
+    ('O2', {}, '2', None),
+    ('fast-run', {'ir_opt': PROFILES['fast-run'].ir_opt,
+                  'peephole': PROFILES['fast-run'].peephole,
+                  'inline': PROFILES['fast-run'].inline}, None, 'fast-run'),
+]
+
+"""The share of instructions or bytes a result may grow by before it is a
+regression. Unlike run times, these hardly vary between runs."""
+GROWTH_THRESHOLD = 0.01
+
+
+def parse_arguments():
+    """Parse Arguments
+
+    Parses all command line arguments for the runtime benchmark.
+
+    Returns:
+        An object containing all expected command line arguments.
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-r', '--repeat',
+                        help='runs of each program built (default: 5)',
+                        type=int,
+                        default=5)
+    parser.add_argument('--timeout',
+                        help='seconds before a program is stopped '
+                             '(default: 60)',
+                        type=float,
+                        default=60.0)
+    parser.add_argument('-t', '--target',
+                        help='code model of the builds (default: 32)',
+                        choices=['32', '64'],
+                        default='32')
+    parser.add_argument('-b', '--builds',
+                        help='comma separated patterns of the builds to run, '
+                             'such as "native/*/fast-run" (default: all)',
+                        default='*')
+    parser.add_argument('--threshold',
+                        help='share of run time a build may lose before it '
+                             'is a regression (default: 0.10)',
+                        type=float,
+                        default=0.10)
+    parser.add_argument('--history',
+                        help='JSON history of the results (default: '
+                             'benchmarks/history.json)',
+                        default=HISTORY)
+    parser.add_argument('--no-history',
+                        help='compare with the history but do not add the '
+                             'results to it',
+                        action='store_true')
+    parser.add_argument('--fail-on-regression',
+                        help='exit with an error status on any regression',
+                        action='store_true')
+    parser.add_argument('programs',
+                        help='benchmark programs to run (default: '
+                             'benchmarks/*.src)',
+                        nargs='*')
+    args = parser.parse_args()
+
+    return args
+
+
+def build_matrix(patterns):
+    """Build Matrix
+
+    Arguments:
+        patterns: A list of shell patterns of build names.
+
+    Returns:
+        A list of (name, run_compiler() arguments) tuples of the builds
+        whose name, <call model>/<I/O layer>/<optimization>, matches a
+        pattern.
+    """
+    builds = []
+
+    for call_model in ['goto', 'native']:
+        for io in ['stdio', 'buffered']:
+            for level, options, opt_level, profile in OPTIMIZATIONS:
+                name = '%s/%s/%s' % (call_model, io, level)
+
+                if not any(fnmatch.fnmatch(name, pattern)
+                           for pattern in patterns):
+                    continue
+
+                arguments = dict(options, call_model=call_model, io=io)
+                arguments['toolchain'] = Toolchain(profile=profile,
+                                                   opt_level=opt_level)
+                builds.append((name, arguments))
+
+    return builds
+
+
+def count_instructions(binary, stdin_path, timeout):
+    """Count Instructions
+
+    Arguments:
+        binary: The path of the program.
+        stdin_path: A file to use as stdin, or None for no input.
+        timeout: The number of seconds before the program is stopped.
+
+    Returns:
+        The number of user space instructions the program ran, as counted by
+        perf stat, or None if perf is not installed or cannot count them.
+    """
+    if shutil.which('perf') is None:
+        return None
+
+    with tempfile.NamedTemporaryFile('r', suffix='.perf') as report:
+        stdin = open(stdin_path or os.devnull, 'rb')
+
+        try:
+            subprocess.run(['perf', 'stat', '-x', ',', '-e', 'instructions:u',
+                            '-o', report.name, binary], stdin=stdin,
+                           stdout=subprocess.DEVNULL,
+                           stderr=subprocess.DEVNULL, timeout=timeout)
+        except (OSError, subprocess.TimeoutExpired):
+            return None
+        finally:
+            stdin.close()
+
+        # Each counter is a line of its count, unit and event name
+        for line in report.read().splitlines():
+            fields = line.split(',')
+
+            if len(fields) > 2 and fields[2].startswith('instructions'):
+                return int(fields[0]) if fields[0].isdigit() else None
+
+    return None
+
+
+def git_revision():
+    """Git Revision
+
+    Returns:
+        A tuple of the commit of the repository of the compiler and True if
+        its working tree has changes, or (None, None) if it is not a git
+        repository.
+    """
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=ROOT,
+                                capture_output=True, text=True)
+        status = subprocess.run(['git', 'status', '--porcelain',
+                                 '--untracked-files=no'], cwd=ROOT,
+                                capture_output=True, text=True)
+    except OSError:
+        return None, None
+
+    if commit.returncode != 0:
+        return None, None
+
+    return commit.stdout.strip(), bool(status.stdout.strip())
+
+
+def load_history(path):
+    """Load History
+
+    Arguments:
+        path: The path of the history file.
+
+    Returns:
+        The list of records of the history, empty if the file does not exist
+        yet, or None if it could not be read.
+    """
+    try:
+        with open(path) as f:
+            history = json.load(f)
+    except FileNotFoundError:
+        return []
+    except (OSError, ValueError) as e:
+        print('Error: could not read history "%s": %s' % (path, e))
+        return None
+
+    if not isinstance(history, list):
+        print('Error: history "%s" is not a list of records' % path)
+        return None
+
+    return history
+
+
+def save_history(path, history):
+    """Save History
+
+    Writes the history to a temporary file which is then renamed, so the
+    file is never left partly written.
+
+    Arguments:
+        path: The path of the history file.
+        history: The list of records of the history.
+
+    Returns:
+        True if the history was written, False otherwise.
+    """
+    temp_path = '%s.%d' % (path, os.getpid())
+
+    try:
+        with open(temp_path, 'w') as f:
+            json.dump(history, f, indent=1, sort_keys=True)
+            f.write('\n')
+
+        os.replace(temp_path, path)
+    except OSError as e:
+        print('Error: could not write history "%s": %s' % (path, e.strerror))
+
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+
+        return False
+
+    return True
+
+
+def run_build(source, binary, arguments, target, repeat, timeout, expected):
+    """Run Build
+
+    Builds a program, checks its output and then runs it repeat times.
+
+    Arguments:
+        source: The path of the program.
+        binary: The path of the program to build.
+        arguments: The run_compiler() arguments of the build.
+        target: The code model of the build.
+        repeat: The number of runs of the program.
+        timeout: The number of seconds before the program is stopped.
+        expected: The output the program must print, or None if any output
+            is accepted.
+
+    Returns:
+        A tuple of the result dictionary of the build and the output of its
+        first run (None if it was not run). The result has a 'status' of
+        'ok', 'compile error', 'timeout', 'failed' (a nonzero exit status) or
+        'wrong output', and the measures taken before the build failed.
+    """
+    code = binary + '.c'
+    stdin_path = input_path(source)
+
+    start = time.perf_counter()
+    built = run_compiler(source, binary, code_model=target, keep_ir=code,
+                         **arguments)
+    result = {'compile': time.perf_counter() - start}
+
+    if not built:
+        result['status'] = 'compile error'
+        return result, None
+
+    result['c_bytes'] = os.path.getsize(code)
+    result['binary_bytes'] = os.path.getsize(binary)
+
+    runs = []
+
+    for _ in range(repeat):
+        run = run_program(binary, stdin_path, timeout)
+        runs.append(run)
+
+        if run.status != 0:
+            break
+
+    if runs[-1].status != 0:
+        result['status'] = 'timeout' if runs[-1].status == 'timeout' \
+            else 'failed'
+        return result, runs[0].stdout
+
+    if expected is not None and runs[0].stdout != expected:
+        result['status'] = 'wrong output'
+        return result, runs[0].stdout
+
+    walls = [run.seconds for run in runs]
+    result.update(status='ok', run_min=min(walls),
+                  run_median=statistics.median(walls),
+                  cpu_min=min(run.cpu for run in runs),
+                  instructions=count_instructions(binary, stdin_path,
+                                                  timeout))
+
+    return result, runs[0].stdout
+
+
+def compare(result, earlier, threshold):
+    """Compare Results
+
+    Arguments:
+        result: The result dictionary of a build.
+        earlier: The result dictionary of the same build in an earlier
+            record, or None.
+        threshold: The share of run time the build may lose.
+
+    Returns:
+        A tuple of the change of the best run time as a share of the earlier
+        one (None if either build failed), and a list of descriptions of the
+        regressions of the build.
+    """
+    if earlier is None or result['status'] != 'ok' or \
+            earlier.get('status') != 'ok':
+        return None, []
+
+    regressions = []
+    change = result['run_min'] / earlier['run_min'] - 1 \
+        if earlier['run_min'] > 0 else 0.0
+
+    if change > threshold:
+        regressions.append('run time %.3fs -> %.3fs (%+.1f%%)' % (
+            earlier['run_min'], result['run_min'], change * 100))
+
+    for key, label in [('instructions', 'instructions'),
+                       ('c_bytes', 'C code bytes'),
+                       ('binary_bytes', 'binary bytes')]:
+        old, new = earlier.get(key), result.get(key)
+
+        if old and new is not None and new / old - 1 > GROWTH_THRESHOLD:
+            regressions.append('%s %d -> %d (%+.1f%%)' % (
+                label, old, new, (new / old - 1) * 100))
+
+    return change, regressions
+
+
+def run_benchmark(programs, builds, repeat, timeout, target, threshold,
+                  history_path, record_history, fail_on_regression):
+    """Run Benchmark
+
+    Arguments:
+        programs: A list of source file paths to build.
+        builds: A list of (name, run_compiler() arguments) tuples.
+        repeat: The number of runs of each program built.
+        timeout: The number of seconds before a program is stopped.
+        target: The code model of the builds.
+        threshold: The share of run time a build may lose before it is a
+            regression.
+        history_path: The path of the history file.
+        record_history: If True, the results are added to the history.
+        fail_on_regression: If True, a regression fails the benchmark.
+
+    Returns:
+        True if every build printed the expected output (and, with
+        fail_on_regression, nothing regressed), False otherwise.
+    """
+    history = load_history(history_path)
+
+    if history is None:
+        return False
+
+    toolchain = Toolchain()
+    error = toolchain.check(target)
+
+    if error is not None:
+        print('Error: %s' % error)
+        return False
+
+    commit, dirty = git_revision()
+    record = {
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'commit': commit,
+        'dirty': dirty,
+        'host': platform.node(),
+        'machine': platform.machine(),
+        'cpus': os.cpu_count(),
+        'python': platform.python_version(),
+        'cc': toolchain.capabilities()['version'],
+        'target': target,
+        'repeat': repeat,
+        'results': {},
+    }
+
+    # The latest record of this host and code model is the baseline
+    baseline = None
+    for earlier in reversed(history):
+        if earlier.get('host') == record['host'] and \
+                earlier.get('target') == target:
+            baseline = earlier
+            break
+
+    if baseline is not None:
+        print('Comparing with %s (commit %s%s)' % (
+            baseline['time'], (baseline.get('commit') or 'unknown')[:10],
+            ', dirty' if baseline.get('dirty') else ''))
+    else:
+        print('No earlier results of this host and code model')
+
+    passed = True
+    regressions = []
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        # The compiler writes its intermediate code to the working directory
+        os.chdir(work_dir)
+
+        for source in programs:
+            name = os.path.splitext(os.path.basename(source))[0]
+            results = record['results'].setdefault(name, {})
+            earlier_results = (baseline or {}).get('results', {}).get(name,
+                                                                      {})
+
+            try:
+                with open(expected_path(source), 'rb') as f:
+                    expected = f.read()
+            except FileNotFoundError:
+                expected = None
+
+            print('\n%s' % name)
+            print('  %-24s %9s %9s %9s %9s %14s %9s %9s %8s' % (
+                'build', 'compile', 'run min', 'median', 'cpu',
+                'instructions', 'C bytes', 'binary', 'change'))
+
+            for index, (build, arguments) in enumerate(builds):
+                binary = os.path.join(work_dir, '%s_%d' % (name, index))
+                result, output = run_build(source, binary, arguments, target,
+                                           repeat, timeout, expected)
+                results[build] = result
+
+                # Without an expected output, every build must print the same
+                if expected is None and result['status'] == 'ok':
+                    expected = output
+
+                if result['status'] != 'ok':
+                    passed = False
+                    print('  %-24s %8.3fs  %s' % (build, result['compile'],
+                                                   result['status'].upper()))
+                    continue
+
+                change, found = compare(result, earlier_results.get(build),
+                                        threshold)
+                regressions.extend('%s %s: %s' % (name, build, regression)
+                                   for regression in found)
+
+                print('  %-24s %8.3fs %8.3fs %8.3fs %8.3fs %14s %9d '
+                      '%9d %8s' % (
+                          build, result['compile'], result['run_min'],
+                          result['run_median'], result['cpu_min'],
+                          result['instructions'] if result['instructions']
+                          is not None else '-',
+                          result['c_bytes'], result['binary_bytes'],
+                          '%+.1f%%' % (change * 100) if change is not None
+                          else '-'))
+
+    print('')
+
+    for regression in regressions:
+        print('REGRESSION: %s' % regression)
+
+    print('%d programs, %d builds, %d regressions%s' % (
+        len(programs), len(builds), len(regressions),
+        '' if passed else ', some builds FAILED'))
+
+    if record_history:
+        history.append(record)
+
+        if not save_history(history_path, history):
+            return False
+
+        print('Results added to %s' % history_path)
+
+    if fail_on_regression and regressions:
+        return False
+
+    return passed
+
+
+if __name__ == '__main__':
+    args = parse_arguments()
+
+    programs = [os.path.abspath(p) for p in args.programs]
+    if not programs:
+        programs = sorted(glob.glob(os.path.join(BENCHMARKS, '*.src')))
+
+    builds = build_matrix(args.builds.split(','))
+    if not builds:
+        print('Error: no build matches "%s"' % args.builds)
+        sys.exit(1)
+
+    sys.exit(not run_benchmark(programs, builds, args.repeat, args.timeout,
+                               args.target, args.threshold,
+                               os.path.abspath(args.history),
+                               not args.no_history, args.fail_on_regression))
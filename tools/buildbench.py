@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+
+"""Build benchmark module
+
+Generates a program with a large number of procedures (10000 by default) and
+builds it with the native call model split over a growing number of
+translation units, each compiled by its own gcc process. The wall clock time
+of parsing and of gcc (compiling every unit and linking) is reported for each
+build along with the number of cores of the machine, and every binary must
+print the same result.
+
+Author: Evan Sneath
+License: Open Software License v3.0
+
+Functions:
+    parse_arguments: Parses incoming command line arguments.
+    write_program: Writes the source of the benchmark program.
+    run_benchmark: Builds, runs and times each job count.
+"""
+
+# Import standard libraries
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+# Make the compiler importable when run from the tools directory
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from lib.build import compile_units
+from lib.parser import Parser
+from lib.toolchain import Toolchain
+
+
+def parse_arguments():
+    """Parse Arguments
+
+    Parses all command line arguments for the build benchmark.
+
+    Returns:
+        An object containing all expected command line arguments.
+    """
+    cores = os.cpu_count() or 1
+    jobs = sorted(set([1 << i for i in range(cores.bit_length())] + [cores]))
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', '--procedures',
+                        help='number of procedures (default: 10000)',
+                        type=int,
+                        default=10000)
+    parser.add_argument('-j', '--jobs',
+                        help='comma separated job counts to build with '
+                             '(default: powers of 2 up to the core count)',
+                        type=lambda text: [int(n) for n in text.split(',')],
+                        default=jobs)
+    parser.add_argument('-t', '--target',
+                        help='code model of the builds (default: 32)',
+                        choices=['32', '64'],
+                        default='32')
+    args = parser.parse_args()
+
+    return args
+
+
+def write_program(path, procedures):
+    """Write Program
+
+    Writes a program whose procedures each do a little arithmetic and call
+    the procedure declared before them, so every procedure is reachable.
+
+    Arguments:
+        path: The path of the source file to write.
+        procedures: The number of procedures.
+    """
+    with open(path, 'w') as f:
+        f.write('program buildbench is\n\n    integer result;\n\n')
+
+        for k in range(procedures):
+            f.write('    global procedure p%d (integer x in, integer r out)\n'
+                    '        integer a;\n'
+                    '        integer t;\n'
+                    '    begin\n'
+                    '        a := x * 3 + %d;\n'
+                    '        if (a > 1000) then\n'
+                    '            a := a / 7;\n'
+                    '        else\n'
+                    '            a := a + x;\n'
+                    '        end if;\n' % (k, k))
+
+            if k > 0:
+                f.write('        p%d(a, t);\n'
+                        '        r := t + a;\n' % (k - 1))
+            else:
+                f.write('        r := a;\n')
+
+            f.write('    end procedure;\n\n')
+
+        f.write('begin\n\n'
+                '    p%d(1, result);\n'
+                '    putInteger(result);\n\n'
+                'end program\n' % (procedures - 1))
+
+    return
+
+
+def run_benchmark(procedures, jobs, target):
+    """Run Benchmark
+
+    Arguments:
+        procedures: The number of procedures of the program.
+        jobs: The list of job counts to build with.
+        target: The code model of the builds.
+
+    Returns:
+        True if every build printed the same result, False otherwise.
+    """
+    outputs = []
+    toolchain = Toolchain()
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        # The compiler writes its intermediate code to the working directory
+        os.chdir(work_dir)
+
+        source = os.path.join(work_dir, 'buildbench.src')
+        write_program(source, procedures)
+
+        print('%d procedures, %d cores' % (procedures, os.cpu_count() or 1))
+        print('%6s %10s %10s' % ('jobs', 'parse', 'gcc'))
+
+        for count in jobs:
+            binary = os.path.join(work_dir, 'buildbench_%d' % count)
+
+            parser = Parser()
+            parser.target = target
+            parser.call_model = 'native'
+            parser.units = count
+
+            start = time.perf_counter()
+            if not parser.parse(source, os.path.join(work_dir, 'ir.c')):
+                return False
+            parsed = time.perf_counter()
+
+            objects = compile_units(parser.unit_paths, target, count,
+                                    toolchain)
+            if objects is None or subprocess.call(
+                    toolchain.link_command(target, objects, binary)) != 0:
+                return False
+            built = time.perf_counter()
+
+            print('%6d %9.3fs %9.3fs' % (count, parsed - start,
+                                         built - parsed))
+            outputs.append(subprocess.check_output([binary]))
+
+    if any(output != outputs[0] for output in outputs):
+        print('FAIL: the outputs of the builds differ')
+        return False
+
+    return True
+
+
+if __name__ == '__main__':
+    args = parse_arguments()
+
+    sys.exit(not run_benchmark(args.procedures, args.jobs, args.target))
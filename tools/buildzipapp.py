@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+
+"""Zipapp build module
+
+Builds the compiler into a single executable zipapp, which runs anywhere
+with Python 3 and a C compiler. The modules are precompiled and stored next
+to their sources as unchecked hash based .pyc files, which zipimport loads
+without compiling anything or comparing them with their sources, so the
+zipapp starts without ever writing a cache. The runtime C sources are read
+from the archive, and written out once to the toolchain cache when the C
+compiler needs them as files (see codegenerator.runtime_path()).
+
+Author: Evan Sneath
+License: Open Software License v3.0
+
+Functions:
+    parse_arguments: Parses incoming command line arguments.
+    build_zipapp: Builds the zipapp of the compiler.
+"""
+
+# Import standard libraries
+import argparse
+import os
+import py_compile
+import shutil
+import sys
+import tempfile
+import zipapp
+
+# Make the compiler importable when run from the tools directory
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from lib.cache import compiler_files
+
+"""The entry point of the zipapp, running the command line like compiler.py.
+A compile handed to a compile server still imports nothing else."""
+MAIN = '''import sys
+
+from lib.client import run_client
+
+status = run_client(sys.argv[1:])
+
+if status is None:
+    from compiler import main
+
+    status = not main()
+
+sys.exit(status)
+'''
+
+
+def parse_arguments():
+    """Parse Arguments
+
+    Parses all command line arguments for the zipapp build.
+
+    Returns:
+        An object containing all expected command line arguments.
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-o', '--out',
+                        help='path of the zipapp (default: compiler.pyz)',
+                        default='compiler.pyz')
+    parser.add_argument('--python',
+                        help='interpreter of the zipapp (default: '
+                             '/usr/bin/env python3)',
+                        default='/usr/bin/env python3')
+    args = parser.parse_args()
+
+    return args
+
+
+def build_zipapp(target, interpreter):
+    """Build Zipapp
+
+    Arguments:
+        target: The path of the zipapp to write.
+        interpreter: The interpreter the zipapp is run with.
+
+    Returns:
+        True if the zipapp was written, False otherwise.
+    """
+    paths = [os.path.join(ROOT, 'compiler.py')] + compiler_files()
+
+    with tempfile.TemporaryDirectory() as stage:
+        for path in paths:
+            staged = os.path.join(stage, os.path.relpath(path, ROOT))
+            os.makedirs(os.path.dirname(staged), exist_ok=True)
+            shutil.copy(path, staged)
+
+        with open(os.path.join(stage, '__main__.py'), 'w') as f:
+            f.write(MAIN)
+
+        for directory, _, files in os.walk(stage):
+            for name in files:
+                if name.endswith('.py'):
+                    path = os.path.join(directory, name)
+
+                    try:
+                        py_compile.compile(
+                            path, cfile=path + 'c', doraise=True,
+                            dfile=os.path.relpath(path, stage),
+                            invalidation_mode=py_compile.
+                            PycInvalidationMode.UNCHECKED_HASH)
+                    except py_compile.PyCompileError as e:
+                        print('Error: %s' % e.msg)
+                        return False
+
+        try:
+            zipapp.create_archive(stage, target, interpreter)
+        except OSError as e:
+            print('Error: could not write "%s": %s' % (target, e.strerror))
+            return False
+
+    print('Wrote %s (%d bytes, %d modules)' % (
+        target, os.path.getsize(target),
+        sum(1 for path in paths if path.endswith('.py')) + 1))
+
+    return True
+
+
+if __name__ == '__main__':
+    args = parse_arguments()
+
+    sys.exit(not build_zipapp(args.out, args.python))
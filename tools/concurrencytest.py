@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+
+"""Concurrent compile test module
+
+Starts 32 compiles (by default) at once in one working directory, cycling
+through the tests/*_good.src programs and through builds which stream the
+code to the C compiler, link the shared I/O object and split the code into
+translation units. Every binary must print the same output as a build of the
+same program made alone, and no intermediate files may be left in the
+directory. If a tests/<name>.in file exists next to a program, it is used as
+stdin.
+
+Author: Evan Sneath
+License: Open Software License v3.0
+
+Functions:
+    parse_arguments: Parses incoming command line arguments.
+    compile_program: Runs the compiler on a program in a subprocess.
+    run_test: Runs the concurrent compiles and checks their binaries.
+"""
+
+# Import standard libraries
+import argparse
+import glob
+import os
+import subprocess
+import sys
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+# Make the compiler importable when run from the tools directory
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from difftest import run_binary
+
+"""The compiler command line interface."""
+COMPILER = os.path.join(ROOT, 'compiler.py')
+
+"""The compiler arguments of each kind of build, cycled through."""
+BUILDS = [
+    [],
+    ['--io', 'buffered', '--io-object'],
+    ['-c', 'native', '-j', '2'],
+]
+
+
+def parse_arguments():
+    """Parse Arguments
+
+    Parses all command line arguments for the concurrent compile test.
+
+    Returns:
+        An object containing all expected command line arguments.
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', '--compiles',
+                        help='number of compiles run at once (default: 32)',
+                        type=int,
+                        default=32)
+    parser.add_argument('--timeout',
+                        help='seconds before a test program is stopped',
+                        type=float,
+                        default=5.0)
+    parser.add_argument('-t', '--target',
+                        help='code model of the builds (default: 32)',
+                        choices=['32', '64'],
+                        default='32')
+    parser.add_argument('tests',
+                        help='test programs to run (default: tests/*_good.src)',
+                        nargs='*')
+    args = parser.parse_args()
+
+    return args
+
+
+def compile_program(source, binary, target, build):
+    """Compile Program
+
+    Arguments:
+        source: The source file to compile.
+        binary: The path of the binary to build.
+        target: The code model of the build.
+        build: A list of extra compiler arguments.
+
+    Returns:
+        A (succeeded, output) tuple of the compiler run.
+    """
+    result = subprocess.run([sys.executable, COMPILER, '-t', target, '-o',
+                             binary, source] + build,
+                            stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+
+    return result.returncode == 0, result.stdout.decode()
+
+
+def run_test(tests, compiles, timeout, target):
+    """Run Concurrent Compile Test
+
+    Arguments:
+        tests: A list of source file paths to compile.
+        compiles: The number of compiles to run at once.
+        timeout: The number of seconds before a test binary is stopped.
+        target: The code model of the builds.
+
+    Returns:
+        True if every binary printed the expected output and no intermediate
+        files were left, False otherwise.
+    """
+    passed = True
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        # Every compile shares the working directory
+        os.chdir(work_dir)
+
+        jobs = []
+        for index in range(compiles):
+            source = tests[index % len(tests)]
+            build = BUILDS[index % len(BUILDS)]
+            jobs.append((source, os.path.join(work_dir, 'bin_%d' % index),
+                         target, build))
+
+        # The expected output of each program comes from a build made alone
+        expected = {}
+
+        for source in tests:
+            binary = os.path.join(work_dir, 'expected')
+            stdin_path = os.path.splitext(source)[0] + '.in'
+            stdin_path = stdin_path if os.path.isfile(stdin_path) else None
+
+            if not compile_program(source, binary, target, [])[0]:
+                print('%-24s SKIP (compile error)' % os.path.basename(source))
+                continue
+
+            expected[source] = run_binary(binary, stdin_path, timeout)[:2]
+            os.remove(binary)
+
+        with ThreadPoolExecutor(max_workers=compiles) as executor:
+            results = list(executor.map(lambda job: compile_program(*job),
+                                        jobs))
+
+        for (source, binary, _, build), (built, output) in zip(jobs, results):
+            name = os.path.splitext(os.path.basename(source))[0]
+            label = '%-24s %-28s' % (name, ' '.join(build) or 'stream')
+            stdin_path = os.path.splitext(source)[0] + '.in'
+            stdin_path = stdin_path if os.path.isfile(stdin_path) else None
+
+            if source not in expected:
+                continue
+
+            if not built:
+                print('%s FAIL (compile error)\n%s' % (label, output))
+                passed = False
+            elif run_binary(binary, stdin_path, timeout)[:2] != \
+                    expected[source]:
+                print('%s FAIL (output differs)' % label)
+                passed = False
+            else:
+                print('%s ok' % label)
+
+            if built:
+                os.remove(binary)
+
+        # Nothing may be left behind, not even the shared I/O objects
+        leftovers = os.listdir(work_dir)
+
+        if leftovers:
+            print('FAIL: files left in the working directory: %s' %
+                  ', '.join(sorted(leftovers)))
+            passed = False
+
+    return passed
+
+
+if __name__ == '__main__':
+    args = parse_arguments()
+
+    tests = [os.path.abspath(t) for t in args.tests]
+    if not tests:
+        tests = sorted(glob.glob(os.path.join(ROOT, 'tests', '*_good.src')))
+
+    sys.exit(not run_test(tests, args.compiles, args.timeout, args.target))
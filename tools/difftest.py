@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+
+"""Differential test module
+
+Compiles every tests/*_good.src program once per build configuration, runs
+the binaries and compares their output and run time. The first build, the
+code as generated, is the reference every other configuration must match:
+the optimizers, the IR passes, the native call model, buffered runtime I/O,
+split translation units and all of them together. Alternatively, the 32-bit
+and 64-bit targets may be compared. If a tests/<name>.in file exists next to
+a program, it is used as stdin. Every build is compiled with
+-Werror=overflow, so generated code may not overflow an int in a constant
+expression.
+
+Author: Evan Sneath
+License: Open Software License v3.0
+
+Functions:
+    parse_arguments: Parses incoming command line arguments.
+    run_binary: Runs a compiled binary and captures its result.
+    run_difftest: Runs the differential test over all test programs.
+"""
+
+# Import standard libraries
+import argparse
+import glob
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+# Make the compiler importable when run from the tools directory
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from lib.build import run_compiler
+from lib.toolchain import Toolchain
+
+"""The C compiler flags of every build."""
+CFLAGS = ['-Werror=overflow']
+
+"""The build configurations compared, by name. The first is the reference and
+split units need the native call model."""
+BUILDS = [
+    ('plain', {}),
+    ('opt', {'peephole': True, 'inline': True}),
+    ('ir', {'ir_opt': True}),
+    ('native', {'call_model': 'native'}),
+    ('buffered', {'io': 'buffered', 'io_object': True}),
+    ('units', {'call_model': 'native', 'jobs': 4}),
+    ('all', {'peephole': True, 'inline': True, 'ir_opt': True,
+             'call_model': 'native', 'io': 'buffered', 'io_object': True,
+             'jobs': 4}),
+]
+
+
+def parse_arguments():
+    """Parse Arguments
+
+    Parses all command line arguments for the differential test.
+
+    Returns:
+        An object containing all expected command line arguments.
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--timeout',
+                        help='seconds before a test program is stopped',
+                        action='store',
+                        type=float,
+                        default=5.0)
+    parser.add_argument('-t', '--target',
+                        help='code model of every build (default: 32)',
+                        choices=['32', '64'],
+                        default='32')
+    parser.add_argument('-b', '--builds',
+                        help='comma separated configurations compared with '
+                             'the plain build (default: %s)' %
+                             ','.join(name for name, _ in BUILDS[1:]),
+                        action='store',
+                        default=','.join(name for name, _ in BUILDS[1:]))
+    parser.add_argument('--compare-targets',
+                        help='compare the 32-bit and 64-bit targets instead',
+                        action='store_true')
+    parser.add_argument('tests',
+                        help='test programs to run (default: tests/*_good.src)',
+                        nargs='*')
+    args = parser.parse_args()
+
+    names = [name for name, _ in BUILDS]
+    for name in args.builds.split(','):
+        if name not in names[1:]:
+            parser.error('unknown build "%s" (choose from %s)' %
+                         (name, ', '.join(names[1:])))
+
+    return args
+
+
+def run_binary(binary, stdin_path, timeout):
+    """Run Binary
+
+    Runs a compiled test binary and captures its exit status and output.
+
+    Arguments:
+        binary: The path of the binary to run.
+        stdin_path: A file to use as stdin, or None for no input.
+        timeout: The number of seconds before the binary is stopped.
+
+    Returns:
+        A (status, stdout, seconds) tuple. The status is the exit code of the
+        binary or 'timeout' if it had to be stopped.
+    """
+    stdin = open(stdin_path) if stdin_path else subprocess.DEVNULL
+    start = time.perf_counter()
+
+    try:
+        proc = subprocess.run([binary], stdin=stdin, stdout=subprocess.PIPE,
+                              timeout=timeout)
+        return proc.returncode, proc.stdout, time.perf_counter() - start
+    except subprocess.TimeoutExpired:
+        return 'timeout', b'', timeout
+    finally:
+        if stdin_path:
+            stdin.close()
+
+
+def run_difftest(tests, timeout, builds):
+    """Run Differential Test
+
+    Compiles and runs each test program once per build configuration and
+    compares the result of every build with that of the first.
+
+    Arguments:
+        tests: A list of source file paths to test.
+        timeout: The number of seconds before a test binary is stopped.
+        builds: A list of (name, dictionary of run_compiler() arguments)
+            tuples, the reference build first.
+
+    Returns:
+        True if every program built and behaved identically, False
+        otherwise.
+    """
+    passed = True
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        # The compiler writes its intermediate code to the working directory
+        os.chdir(work_dir)
+
+        for source in tests:
+            name = os.path.splitext(os.path.basename(source))[0]
+            stdin_path = os.path.splitext(source)[0] + '.in'
+            stdin_path = stdin_path if os.path.isfile(stdin_path) else None
+
+            results = []
+
+            for build_name, build in builds:
+                binary = os.path.join(work_dir, '%s_%s' % (name, build_name))
+
+                if not run_compiler(source, binary,
+                                    toolchain=Toolchain(cflags=CFLAGS),
+                                    **build):
+                    results.append(('compile error', b'', 0.0))
+                    continue
+
+                results.append(run_binary(binary, stdin_path, timeout))
+
+            times = ' '.join('%8.3fs' % result[2] for result in results)
+
+            # Every good program must build, so a compile error always fails
+            errors = [build[0] for build, result in zip(builds, results)
+                      if result[0] == 'compile error']
+            differ = [build[0] for build, result in zip(builds, results)
+                      if result[:2] != results[0][:2]]
+
+            if errors:
+                status = 'FAIL (compile error: %s)' % ', '.join(errors)
+                passed = False
+            elif differ:
+                status = 'FAIL (%s)' % ', '.join(differ)
+                passed = False
+            elif results[0][0] == 'timeout':
+                status = 'SKIP (timeout)'
+            else:
+                status = 'ok'
+
+            print('%-24s %s %s' % (name, times, status))
+
+    return passed
+
+
+if __name__ == '__main__':
+    args = parse_arguments()
+
+    tests = [os.path.abspath(t) for t in args.tests]
+    if not tests:
+        tests = sorted(glob.glob(os.path.join(ROOT, 'tests', '*_good.src')))
+
+    if args.compare_targets:
+        builds = [('32', {'code_model': '32'}), ('64', {'code_model': '64'})]
+    else:
+        chosen = args.builds.split(',')
+        builds = [(name, dict(build, code_model=args.target))
+                  for name, build in BUILDS
+                  if name == BUILDS[0][0] or name in chosen]
+
+        print('%-24s %s' % ('', ' '.join('%9s' % name for name, _ in builds)))
+
+    sys.exit(not run_difftest(tests, args.timeout, builds))
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+
+"""I/O benchmark module
+
+Builds tests/iobench_good.src with each runtime I/O layer, feeds every build
+the same stream of integers and compares their output and run time. By
+default 10 million integers are read and written back.
+
+Author: Evan Sneath
+License: Open Software License v3.0
+
+Functions:
+    parse_arguments: Parses incoming command line arguments.
+    write_input: Writes the integer input stream of the benchmark.
+    run_benchmark: Builds, runs and times each I/O layer.
+"""
+
+# Import standard libraries
+import argparse
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+# Make the compiler importable when run from the tools directory
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from lib.build import run_compiler
+
+"""The benchmark program source."""
+SOURCE = os.path.join(ROOT, 'tests', 'iobench_good.src')
+
+"""The builds compared by the benchmark as (name, run_compiler arguments)."""
+BUILDS = [
+    ('stdio', {'io': 'stdio'}),
+    ('buffered', {'io': 'buffered'}),
+    ('buffered object', {'io': 'buffered', 'io_object': True}),
+]
+
+
+def parse_arguments():
+    """Parse Arguments
+
+    Parses all command line arguments for the I/O benchmark.
+
+    Returns:
+        An object containing all expected command line arguments.
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', '--count',
+                        help='number of integers (default: 10000000)',
+                        type=int,
+                        default=10000000)
+    parser.add_argument('-t', '--target',
+                        help='code model of the builds (default: 32)',
+                        choices=['32', '64'],
+                        default='32')
+    args = parser.parse_args()
+
+    return args
+
+
+def write_input(path, count):
+    """Write Input
+
+    Writes the integer count followed by that many random integers.
+
+    Arguments:
+        path: The path of the input file to write.
+        count: The number of integers.
+    """
+    generator = random.Random(count)
+
+    with open(path, 'w') as f:
+        f.write('%d\n' % count)
+
+        for start in range(0, count, 100000):
+            chunk = min(100000, count - start)
+            f.write('\n'.join(str(generator.randint(-10**9, 10**9))
+                              for _ in range(chunk)))
+            f.write('\n')
+
+    return
+
+
+def run_benchmark(count, target):
+    """Run Benchmark
+
+    Arguments:
+        count: The number of integers to read and write.
+        target: The code model of the builds.
+
+    Returns:
+        True if every build produced the same output, False otherwise.
+    """
+    outputs = []
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        # The compiler writes its intermediate code to the working directory
+        os.chdir(work_dir)
+
+        input_path = os.path.join(work_dir, 'input.txt')
+        write_input(input_path, count)
+
+        for index, (name, build) in enumerate(BUILDS):
+            binary = os.path.join(work_dir, 'iobench_%d' % index)
+            output_path = os.path.join(work_dir, 'output_%d.txt' % index)
+
+            if not run_compiler(SOURCE, binary, code_model=target, **build):
+                return False
+
+            with open(input_path) as stdin, open(output_path, 'w') as stdout:
+                start = time.perf_counter()
+                subprocess.call([binary], stdin=stdin, stdout=stdout)
+                seconds = time.perf_counter() - start
+
+            with open(output_path, 'rb') as f:
+                outputs.append(f.read())
+
+            print('%-16s %8.3fs' % (name, seconds))
+
+    if any(output != outputs[0] for output in outputs):
+        print('FAIL: the outputs of the builds differ')
+        return False
+
+    return True
+
+
+if __name__ == '__main__':
+    args = parse_arguments()
+
+    sys.exit(not run_benchmark(args.count, args.target))
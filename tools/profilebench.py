@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+
+"""Build profile benchmark module
+
+Builds every tests/*_good.src program with no profile and with each build
+profile, and prints a matrix of the compile time (parsing, optimizers and the
+C compiler) against the run time (best of several runs) of each program and
+profile. If a tests/<name>.in file exists next to a program, it is used as
+stdin. Every profile must produce a program printing the same output.
+
+Author: Evan Sneath
+License: Open Software License v3.0
+
+Functions:
+    parse_arguments: Parses incoming command line arguments.
+    profile_arguments: Builds the run_compiler() arguments of a profile.
+    run_benchmark: Builds and runs each program with each profile.
+"""
+
+# Import standard libraries
+import argparse
+import glob
+import os
+import sys
+import tempfile
+import time
+
+# Make the compiler importable when run from the tools directory
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from lib.build import run_compiler
+from difftest import run_binary
+from lib.toolchain import PROFILES, Toolchain
+
+
+def parse_arguments():
+    """Parse Arguments
+
+    Parses all command line arguments for the build profile benchmark.
+
+    Returns:
+        An object containing all expected command line arguments.
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-r', '--repeat',
+                        help='runs of each program, the best is kept '
+                             '(default: 3)',
+                        type=int,
+                        default=3)
+    parser.add_argument('--timeout',
+                        help='seconds before a test program is stopped',
+                        type=float,
+                        default=20.0)
+    parser.add_argument('-t', '--target',
+                        help='code model of the builds (default: 32)',
+                        choices=['32', '64'],
+                        default='32')
+    parser.add_argument('-c', '--call-model',
+                        help='procedure call model of the builds '
+                             '(default: goto)',
+                        choices=['goto', 'native'],
+                        default='goto')
+    parser.add_argument('tests',
+                        help='test programs to run (default: tests/*_good.src)',
+                        nargs='*')
+    args = parser.parse_args()
+
+    return args
+
+
+def profile_arguments(profile):
+    """Profile Arguments
+
+    Arguments:
+        profile: The name of the build profile, or None for none.
+
+    Returns:
+        A dictionary of run_compiler() arguments building with the profile.
+    """
+    arguments = {'toolchain': Toolchain(profile=profile)}
+
+    if profile is not None:
+        arguments['peephole'] = PROFILES[profile].peephole
+        arguments['ir_opt'] = PROFILES[profile].ir_opt
+        arguments['inline'] = PROFILES[profile].inline
+
+    return arguments
+
+
+def run_benchmark(tests, repeat, timeout, target, call_model):
+    """Run Benchmark
+
+    Arguments:
+        tests: A list of source file paths to build.
+        repeat: The number of runs of each program.
+        timeout: The number of seconds before a test binary is stopped.
+        target: The code model of the builds.
+        call_model: The procedure call model of the builds.
+
+    Returns:
+        True if every profile built programs with the same output, False
+        otherwise.
+    """
+    profiles = [None] + sorted(PROFILES)
+    passed = True
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        # The compiler writes its intermediate code to the working directory
+        os.chdir(work_dir)
+
+        print('%-20s' % 'compile / run' + ''.join(
+            '%22s' % (name or 'none') for name in profiles))
+
+        totals = [[0.0, 0.0] for _ in profiles]
+
+        for source in tests:
+            name = os.path.splitext(os.path.basename(source))[0]
+            stdin_path = os.path.splitext(source)[0] + '.in'
+            stdin_path = stdin_path if os.path.isfile(stdin_path) else None
+
+            cells = []
+            outputs = []
+
+            for index, profile in enumerate(profiles):
+                binary = os.path.join(work_dir, '%s_%d' % (name, index))
+
+                start = time.perf_counter()
+                built = run_compiler(source, binary, code_model=target,
+                                     call_model=call_model,
+                                     **profile_arguments(profile))
+                compile_time = time.perf_counter() - start
+
+                if not built:
+                    cells.append('%22s' % 'compile error')
+                    outputs.append(None)
+                    continue
+
+                runs = [run_binary(binary, stdin_path, timeout)]
+                outputs.append(runs[0][:2])
+
+                # A program stopped by the timeout is left out of the totals
+                if runs[0][0] == 'timeout':
+                    cells.append('%10.3fs /%9s' % (compile_time, 'timeout'))
+                    continue
+
+                runs.extend(run_binary(binary, stdin_path, timeout)
+                            for _ in range(repeat - 1))
+                run_time = min(run[2] for run in runs)
+
+                totals[index][0] += compile_time
+                totals[index][1] += run_time
+
+                cells.append('%10.3fs /%8.3fs' % (compile_time, run_time))
+
+            status = ''
+            if any(output != outputs[0] for output in outputs):
+                status = '  FAIL'
+                passed = False
+
+            print('%-20s' % name[:20] + ''.join(cells) + status)
+
+        print('%-20s' % 'total' + ''.join(
+            '%10.3fs /%8.3fs' % tuple(total) for total in totals))
+
+    return passed
+
+
+if __name__ == '__main__':
+    args = parse_arguments()
+
+    tests = [os.path.abspath(t) for t in args.tests]
+    if not tests:
+        tests = sorted(glob.glob(os.path.join(ROOT, 'tests', '*_good.src')))
+
+    sys.exit(not run_benchmark(tests, args.repeat, args.timeout, args.target,
+                               args.call_model))
@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+
+"""Compile server benchmark module
+
+Compiles a small program (tests/simpleadd_good.src by default) a number of
+times with a compiler process of its own, then as clients of a compile server
+started on a private socket: with a client process per compile, with
+requests sent by this process as an editor would, and with several client
+processes at once. The median and best latency and the throughput of each way
+are reported, and every program must print the same result.
+
+Author: Evan Sneath
+License: Open Software License v3.0
+
+Functions:
+    parse_arguments: Parses incoming command line arguments.
+    time_compiles: Times compiles of a program.
+    run_benchmark: Compiles the program each way and times them.
+"""
+
+# Import standard libraries
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# Make the compiler importable when run from the tools directory
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from lib.client import request
+
+"""The compiler command line interface."""
+COMPILER = os.path.join(ROOT, 'compiler.py')
+
+
+def parse_arguments():
+    """Parse Arguments
+
+    Parses all command line arguments for the compile server benchmark.
+
+    Returns:
+        An object containing all expected command line arguments.
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', '--compiles',
+                        help='compiles of each way (default: 20)',
+                        type=int,
+                        default=20)
+    parser.add_argument('-c', '--clients',
+                        help='clients compiling at once (default: 4)',
+                        type=int,
+                        default=4)
+    parser.add_argument('-t', '--target',
+                        help='code model of the builds (default: 32)',
+                        choices=['32', '64'],
+                        default='32')
+    parser.add_argument('source',
+                        help='program to compile (default: '
+                             'tests/simpleadd_good.src)',
+                        nargs='?',
+                        default=os.path.join(ROOT, 'tests',
+                                             'simpleadd_good.src'))
+    args = parser.parse_args()
+
+    return args
+
+
+def time_compiles(compile_function, compiles, clients):
+    """Time Compiles
+
+    Arguments:
+        compile_function: The function compiling the program to a numbered
+            binary, returning True if it succeeded.
+        compiles: The number of compiles.
+        clients: The number of compiles run at once.
+
+    Returns:
+        A tuple of the list of the seconds of each compile and the seconds of
+        all of them, or None if any failed.
+    """
+    def run(k):
+        start = time.perf_counter()
+        succeeded = compile_function(k)
+
+        return time.perf_counter() - start if succeeded else None
+
+    start = time.perf_counter()
+
+    with ThreadPoolExecutor(max_workers=clients) as executor:
+        seconds = list(executor.map(run, range(compiles)))
+
+    if None in seconds:
+        return None
+
+    return seconds, time.perf_counter() - start
+
+
+def run_benchmark(source, compiles, clients, target):
+    """Run Benchmark
+
+    Arguments:
+        source: The path of the program to compile.
+        compiles: The number of compiles of each way.
+        clients: The number of clients compiling at once.
+        target: The code model of the builds.
+
+    Returns:
+        True if every compile succeeded and the programs print the same
+        result, False otherwise.
+    """
+    with tempfile.TemporaryDirectory() as work_dir:
+        socket_path = os.path.join(work_dir, 'server.sock')
+        server = subprocess.Popen([sys.executable, COMPILER, '--serve',
+                                   '--socket', socket_path],
+                                  stdout=subprocess.PIPE, text=True)
+
+        try:
+            # The server reports when it listens
+            if not server.stdout.readline():
+                print('FAIL: the compile server did not start')
+                return False
+
+            client = ['--client', '--socket', socket_path]
+            ways = [('own process', 'process', [], 1),
+                    ('client process', 'process', client, 1),
+                    ('editor request', 'request', [], 1),
+                    ('%d client processes' % clients, 'process', client,
+                     clients)]
+            binaries = []
+
+            print('%d compiles of %s, %d cores' % (
+                compiles, os.path.basename(source), os.cpu_count() or 1))
+            print('%-20s %10s %10s %12s' % ('', 'median', 'best',
+                                            'programs/s'))
+
+            for index, (name, kind, flags, count) in enumerate(ways):
+                binary = os.path.join(work_dir, 'way%d' % index)
+                args = ['-t', target] + flags + ['-o', binary + '_%d', source]
+
+                def compile_function(k):
+                    numbered = [arg.replace('%d', str(k)) for arg in args]
+
+                    if kind == 'request':
+                        response = request(socket_path, numbered)
+                        return response is not None and \
+                            response.get('status') == 0
+
+                    return subprocess.call([sys.executable, COMPILER] +
+                                           numbered,
+                                           stdout=subprocess.DEVNULL) == 0
+
+                timing = time_compiles(compile_function, compiles, count)
+
+                if timing is None:
+                    print('FAIL: a compile of %s failed' % name)
+                    return False
+
+                seconds, total = timing
+                print('%-20s %9.1fms %9.1fms %12.1f' % (
+                    name, statistics.median(seconds) * 1000,
+                    min(seconds) * 1000, compiles / total))
+                binaries.extend('%s_%d' % (binary, k)
+                                for k in range(compiles))
+        finally:
+            server.terminate()
+            server.wait()
+
+        outputs = set(subprocess.run([binary], input=b'1\n2\n',
+                                     capture_output=True).stdout
+                      for binary in binaries)
+
+        if len(outputs) != 1:
+            print('FAIL: the outputs of the programs differ')
+            return False
+
+        if os.path.exists(socket_path):
+            print('FAIL: the compile server left its socket behind')
+            return False
+
+    return True
+
+
+if __name__ == '__main__':
+    args = parse_arguments()
+
+    sys.exit(not run_benchmark(os.path.abspath(args.source), args.compiles,
+                               args.clients, args.target))
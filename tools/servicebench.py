@@ -0,0 +1,355 @@
+#!/usr/bin/env python3
+
+"""Compile service load test module
+
+Sends compile requests to an asyncio compile service (see lib/service.py) at
+several levels of concurrency and reports the p50 and p99 latency, the
+throughput and the longest stall of the event loop at each level. Requests
+cycle through the tests/*_good.src programs (the benchmarks left out), each
+made distinct by a comment, except a share of duplicates repeating the
+request before them, which may share its compile. Every program built must print what a build of its source made
+alone by the command line prints. A request for a large program with a short
+timeout then checks that a timed out compile is stopped and cleaned up, and
+identical requests sent at once for the same target must all install it.
+
+Author: Evan Sneath
+License: Open Software License v3.0
+
+Functions:
+    parse_arguments: Parses incoming command line arguments.
+    percentile: Returns a percentile of a list of latencies.
+    run_level: Sends the requests of one level of concurrency.
+    check_identical: Checks identical requests for one target.
+    check_timeout: Checks that a timed out compile is stopped.
+    run_benchmark: Runs every level and checks the programs built.
+"""
+
+# Import standard libraries
+import argparse
+import asyncio
+import glob
+import math
+import os
+import sys
+import tempfile
+import time
+
+# Make the compiler importable when run from the tools directory
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from buildbench import write_program
+from concurrencytest import compile_program
+from difftest import run_binary
+from lib.service import CompileService
+
+
+def parse_arguments():
+    """Parse Arguments
+
+    Parses all command line arguments for the compile service load test.
+
+    Returns:
+        An object containing all expected command line arguments.
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', '--requests',
+                        help='requests sent at each level (default: 64)',
+                        type=int,
+                        default=64)
+    parser.add_argument('-l', '--levels',
+                        help='comma separated levels of concurrency '
+                             '(default: 1,4,16,64)',
+                        default='1,4,16,64')
+    parser.add_argument('-d', '--duplicates',
+                        help='share of requests repeating the one before '
+                             'them (default: 0.25)',
+                        type=float,
+                        default=0.25)
+    parser.add_argument('-w', '--workers',
+                        help='worker processes of the service (default: the '
+                             'number of cores)',
+                        type=int)
+    parser.add_argument('-g', '--gcc-jobs',
+                        help='C compilers run at once (default: the number '
+                             'of workers)',
+                        type=int)
+    parser.add_argument('-t', '--target',
+                        help='code model of the builds (default: 32)',
+                        choices=['32', '64'],
+                        default='32')
+    parser.add_argument('tests',
+                        help='test programs to compile (default: '
+                             'tests/*_good.src but the benchmarks)',
+                        nargs='*')
+    args = parser.parse_args()
+
+    return args
+
+
+def percentile(latencies, rank):
+    """Percentile
+
+    Arguments:
+        latencies: A list of latencies.
+        rank: The percentile to return, from 0 to 100.
+
+    Returns:
+        The smallest latency which is at least rank percent of them
+        (nearest rank method).
+    """
+    ordered = sorted(latencies)
+    index = max(0, math.ceil(rank / 100.0 * len(ordered)) - 1)
+
+    return ordered[index]
+
+
+async def run_level(service, requests, level, work_dir, target):
+    """Run Level
+
+    Arguments:
+        service: The CompileService object.
+        requests: A list of (source path, source text) tuples to send.
+        level: The number of requests in flight at once.
+        work_dir: The directory of the programs built.
+        target: The code model of the builds.
+
+    Returns:
+        A tuple of the list of (source path, program path, ServiceResult)
+        tuples of each request, the seconds of all of them and the longest
+        seconds a 10ms timer of the event loop was late.
+    """
+    limit = asyncio.Semaphore(level)
+    lag = [0.0]
+
+    async def tick():
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(0.01)
+            lag[0] = max(lag[0], time.perf_counter() - start - 0.01)
+
+    async def send(index, path, text):
+        binary = os.path.join(work_dir, 'level%d_%d' % (level, index))
+
+        async with limit:
+            result = await service.compile(text, binary, name=path,
+                                           code_model=target)
+
+        return path, binary, result
+
+    ticker = asyncio.ensure_future(tick())
+    start = time.perf_counter()
+
+    try:
+        results = await asyncio.gather(*[send(index, path, text)
+                                         for index, (path, text)
+                                         in enumerate(requests)])
+    finally:
+        ticker.cancel()
+
+    return results, time.perf_counter() - start, lag[0]
+
+
+async def check_identical(service, source, text, expected, work_dir, target,
+                          count=8):
+    """Check Identical Requests
+
+    Sends identical requests for the same program at once, which share one
+    compile and then each install the program at the same target.
+
+    Arguments:
+        service: The CompileService object.
+        source: The path of the program.
+        text: The source text of the program.
+        expected: The (status, stdout) of a build of the program made alone.
+        work_dir: The directory of the programs built.
+        target: The code model of the build.
+        count: The number of requests. (Default: 8)
+
+    Returns:
+        True if every request succeeded, the program prints the expected
+        output and no temporary file was left, False otherwise.
+    """
+    binary = os.path.join(work_dir, 'identical')
+    before = set(os.listdir(work_dir))
+
+    results = await asyncio.gather(
+        *[service.compile(text + '// identical\n', binary, name=source,
+                          code_model=target) for _ in range(count)],
+        return_exceptions=True)
+
+    for result in results:
+        if isinstance(result, BaseException):
+            print('FAIL: an identical request raised %r' % result)
+            return False
+
+        if not result.succeeded:
+            print('FAIL: an identical request failed: %s' % result.error)
+            return False
+
+    if set(os.listdir(work_dir)) - before != {'identical'}:
+        print('FAIL: identical requests left %s' % sorted(
+            set(os.listdir(work_dir)) - before - {'identical'}))
+        return False
+
+    stdin_path = os.path.splitext(source)[0] + '.in'
+    stdin_path = stdin_path if os.path.isfile(stdin_path) else None
+
+    return run_binary(binary, stdin_path, 10.0)[:2] == expected
+
+
+async def check_timeout(service, work_dir, target):
+    """Check Timeout
+
+    Sends a request for a large program with a timeout too short for it.
+
+    Arguments:
+        service: The CompileService object.
+        work_dir: The directory of the programs built.
+        target: The code model of the build.
+
+    Returns:
+        True if the request timed out and its compile was stopped with its
+        files removed, False otherwise.
+    """
+    source = os.path.join(work_dir, 'large.src')
+    write_program(source, 2000)
+
+    with open(source) as f:
+        text = f.read()
+
+    pattern = os.path.join(tempfile.gettempdir(), 'compiler-service-*')
+    before = set(glob.glob(pattern))
+
+    try:
+        await service.compile(text, os.path.join(work_dir, 'large'),
+                              timeout=0.5, code_model=target)
+        return False
+    except asyncio.TimeoutError:
+        pass
+
+    # The cancelled compile removes its files once it has stopped
+    for _ in range(50):
+        if not service.in_flight() and set(glob.glob(pattern)) <= before:
+            return not os.path.exists(os.path.join(work_dir, 'large'))
+
+        await asyncio.sleep(0.1)
+
+    return False
+
+
+async def run_benchmark(tests, count, levels, duplicates, workers, gcc_jobs,
+                        target):
+    """Run Benchmark
+
+    Arguments:
+        tests: A list of source file paths to compile.
+        count: The number of requests sent at each level.
+        levels: A list of levels of concurrency.
+        duplicates: The share of requests repeating the one before them.
+        workers: The number of worker processes of the service, or None.
+        gcc_jobs: The most C compilers run at once, or None.
+        target: The code model of the builds.
+
+    Returns:
+        True if every program built printed the expected output and the
+        timed out compile was stopped, False otherwise.
+    """
+    passed = True
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        # The expected output of each program comes from a build made alone
+        expected = {}
+        texts = {}
+
+        for source in tests:
+            binary = os.path.join(work_dir, 'expected')
+            stdin_path = os.path.splitext(source)[0] + '.in'
+            stdin_path = stdin_path if os.path.isfile(stdin_path) else None
+
+            if not compile_program(source, binary, target, [])[0]:
+                print('%-24s SKIP (compile error)' % os.path.basename(source))
+                continue
+
+            expected[source] = run_binary(binary, stdin_path, 10.0)[:2]
+
+            with open(source) as f:
+                texts[source] = f.read()
+
+        sources = sorted(expected)
+        period = round(1 / duplicates) if duplicates > 0 else 0
+        requests = []
+
+        for index in range(count):
+            if period and index % period == period - 1:
+                requests.append(requests[-1])
+            else:
+                source = sources[index % len(sources)]
+                requests.append((source, texts[source] +
+                                 '// request %d\n' % index))
+
+        async with CompileService(workers=workers,
+                                  gcc_jobs=gcc_jobs) as service:
+            print('%d requests at each level, %d worker processes, %d C '
+                  'compilers at once, %d cores' % (
+                      count, service.workers, service.gcc_jobs,
+                      os.cpu_count() or 1))
+            print('%-8s %10s %10s %12s %8s %10s' % (
+                'level', 'p50', 'p99', 'programs/s', 'shared', 'loop lag'))
+
+            for level in levels:
+                shared = service.counts['shared']
+                results, seconds, lag = await run_level(
+                    service, requests, level, work_dir, target)
+                latencies = [result.seconds for _, _, result in results]
+
+                print('%-8d %9.1fms %9.1fms %12.1f %8d %8.1fms' % (
+                    level, percentile(latencies, 50) * 1000,
+                    percentile(latencies, 99) * 1000, count / seconds,
+                    service.counts['shared'] - shared, lag * 1000))
+
+                for source, binary, result in results:
+                    stdin_path = os.path.splitext(source)[0] + '.in'
+                    stdin_path = stdin_path if os.path.isfile(stdin_path) \
+                        else None
+
+                    if not result.succeeded:
+                        print('FAIL: %s: %s' % (source, result.error))
+                        passed = False
+                    elif run_binary(binary, stdin_path, 10.0)[:2] != \
+                            expected[source]:
+                        print('FAIL: %s printed other results' % binary)
+                        passed = False
+
+            if not await check_identical(service, sources[0],
+                                         texts[sources[0]],
+                                         expected[sources[0]], work_dir,
+                                         target):
+                print('FAIL: identical requests for one target failed')
+                passed = False
+            else:
+                print('Identical requests for one target were all installed')
+
+            if not await check_timeout(service, work_dir, target):
+                print('FAIL: a timed out compile was not stopped')
+                passed = False
+            else:
+                print('A timed out compile was stopped and cleaned up')
+
+    return passed
+
+
+if __name__ == '__main__':
+    args = parse_arguments()
+
+    tests = [os.path.abspath(t) for t in args.tests]
+    if not tests:
+        tests = sorted(t for t in glob.glob(os.path.join(ROOT, 'tests',
+                                                         '*_good.src'))
+                       if 'bench' not in os.path.basename(t))
+
+    levels = [int(level) for level in args.levels.split(',')]
+
+    sys.exit(not asyncio.run(run_benchmark(
+        tests, args.requests, levels, args.duplicates, args.workers,
+        args.gcc_jobs, args.target)))
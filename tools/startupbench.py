@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+
+"""Start-up benchmark module
+
+Measures the start-up of the compiler on a tiny program: the time spent
+importing modules, from python -X importtime, and the wall time of the whole
+compile, next to those of an interpreter running nothing. The imports of the
+compiler are those beyond the interpreter's own, and they must take less
+than a target number of milliseconds, so the test fails when a change makes
+the compiler import more on every compile. The test also fails if the compile
+imports any of the modules only some commands or options use, such as the
+optimizers, the build cache and the time report. A zipapp of the compiler (see
+tools/buildzipapp.py) may be measured as well.
+
+Author: Evan Sneath
+License: Open Software License v3.0
+
+Functions:
+    parse_arguments: Parses incoming command line arguments.
+    import_times: Runs a command with -X importtime and reads its imports.
+    eager_imports: Returns the modules used only by some commands imported.
+    wall_time: Returns the seconds a command takes to run.
+    measure: Measures the imports and wall time of a compile.
+    run_benchmark: Measures the compiler and checks its import time.
+"""
+
+# Import standard libraries
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+# The compiler is run from the root of the repository
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+"""The compiler command line interface."""
+COMPILER = os.path.join(ROOT, 'compiler.py')
+
+"""The default program compiled."""
+SOURCE = os.path.join(ROOT, 'tests', 'simpleadd_good.src')
+
+"""The default milliseconds the imports of the compiler may take."""
+TARGET_MS = 60.0
+
+"""The modules a compile without options must not import."""
+LAZY_MODULES = ['concurrent.futures', 'glob', 'lib.api', 'lib.batch',
+                'lib.cache', 'lib.inliner', 'lib.passes', 'lib.peephole',
+                'lib.runner', 'lib.server', 'lib.timereport', 'lib.watcher',
+                'tempfile']
+
+
+def parse_arguments():
+    """Parse Arguments
+
+    Parses all command line arguments for the start-up benchmark.
+
+    Returns:
+        An object containing all expected command line arguments.
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', '--runs',
+                        help='runs of each command, the median is kept '
+                             '(default: 10)',
+                        type=int,
+                        default=10)
+    parser.add_argument('--max-ms',
+                        help='milliseconds the imports of the compiler may '
+                             'take (default: %g)' % TARGET_MS,
+                        type=float,
+                        default=TARGET_MS)
+    parser.add_argument('--zipapp',
+                        help='also measure this zipapp of the compiler')
+    parser.add_argument('-t', '--target',
+                        help='code model of the builds (default: 32)',
+                        choices=['32', '64'],
+                        default='32')
+    parser.add_argument('source',
+                        help='program to compile (default: '
+                             'tests/simpleadd_good.src)',
+                        nargs='?',
+                        default=SOURCE)
+    args = parser.parse_args()
+
+    return args
+
+
+def import_times(command):
+    """Import Times
+
+    Arguments:
+        command: The command line of a Python program, without the
+            interpreter.
+
+    Returns:
+        A dictionary of the cumulative microseconds of each module imported
+        at the top level, that is not by another module.
+    """
+    result = subprocess.run([sys.executable, '-X', 'importtime'] + command,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                            text=True)
+    times = {}
+
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+
+        _, cumulative, name = line[len('import time:'):].split('|')
+
+        # Modules imported by other modules are indented
+        if cumulative.strip().isdigit() and not name[1:].startswith(' '):
+            times[name.strip()] = int(cumulative)
+
+    return times
+
+
+def eager_imports(command):
+    """Eager Imports
+
+    Arguments:
+        command: The command line of a Python program, without the
+            interpreter.
+
+    Returns:
+        The list of the modules of LAZY_MODULES which the program imported,
+        by any module.
+    """
+    result = subprocess.run([sys.executable, '-X', 'importtime'] + command,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                            text=True)
+    names = set(line.split('|')[-1].strip()
+                for line in result.stderr.splitlines()
+                if line.startswith('import time:'))
+
+    return [name for name in LAZY_MODULES if name in names]
+
+
+def wall_time(command):
+    """Wall Time
+
+    Arguments:
+        command: The command line of a Python program, without the
+            interpreter.
+
+    Returns:
+        The seconds the program took to run.
+    """
+    start = time.perf_counter()
+    subprocess.run([sys.executable] + command, stdout=subprocess.DEVNULL,
+                   stderr=subprocess.DEVNULL)
+
+    return time.perf_counter() - start
+
+
+def measure(command, runs):
+    """Measure Command
+
+    Arguments:
+        command: The command line of a Python program, without the
+            interpreter.
+        runs: The number of runs of the command.
+
+    Returns:
+        A tuple of the median milliseconds of the imports, the median seconds
+        of a run and a dictionary of the median microseconds of each module
+        imported at the top level.
+    """
+    imports = [import_times(command) for _ in range(runs)]
+    walls = [wall_time(command) for _ in range(runs)]
+    modules = dict((name, statistics.median(run.get(name, 0)
+                                            for run in imports))
+                   for name in set().union(*imports))
+
+    return (statistics.median(sum(run.values()) for run in imports) / 1000.0,
+            statistics.median(walls), modules)
+
+
+def run_benchmark(source, runs, max_ms, target, zipapp=None):
+    """Run Start-up Benchmark
+
+    Arguments:
+        source: The program to compile.
+        runs: The number of runs of each command.
+        max_ms: The milliseconds the imports of the compiler may take.
+        target: The code model of the builds.
+        zipapp: The path of a zipapp of the compiler to measure as well, or
+            None. (Default: None)
+
+    Returns:
+        True if the imports of every compiler measured took less than the
+        target and left out LAZY_MODULES, False otherwise.
+    """
+    passed = True
+    base_ms, base_wall, base_modules = measure(['-c', 'pass'], runs)
+    print('%-12s %10s %10s %10s' % ('', 'imports', 'compiler', 'wall'))
+    print('%-12s %8.1fms %10s %8.1fms' % ('interpreter', base_ms, '-',
+                                          base_wall * 1000))
+
+    entry_points = [('compiler.py', COMPILER)]
+
+    if zipapp is not None:
+        entry_points.append(('zipapp', os.path.abspath(zipapp)))
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        binary = os.path.join(work_dir, 'program')
+
+        for label, path in entry_points:
+            command = [path, '-t', target, '-o', binary, source]
+            total_ms, wall, modules = measure(command, runs)
+            own_ms = total_ms - base_ms
+
+            print('%-12s %8.1fms %8.1fms %8.1fms' % (
+                label, total_ms, own_ms, wall * 1000))
+
+            heaviest = sorted((name for name in modules
+                               if name not in base_modules),
+                              key=lambda name: -modules[name])
+
+            for name in heaviest[:8]:
+                print('    %-28s %7.1fms' % (name, modules[name] / 1000.0))
+
+            if own_ms > max_ms:
+                print('FAIL: the imports of %s took %.1fms, more than %gms' %
+                      (label, own_ms, max_ms))
+                passed = False
+
+            eager = eager_imports(command)
+
+            if eager:
+                print('FAIL: %s imported %s' % (label, ', '.join(eager)))
+                passed = False
+
+    return passed
+
+
+if __name__ == '__main__':
+    args = parse_arguments()
+
+    sys.exit(not run_benchmark(args.source, args.runs, args.max_ms,
+                               args.target, args.zipapp))
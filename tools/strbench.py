@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+
+"""String heap benchmark module
+
+Builds tests/strbench_good.src and feeds it growing streams of distinct
+lines, reporting the run time, peak heap size and number of string heap
+collections of each run (from the MM_STATS report of the program). By default
+up to 1 million lines are read. Since each line is garbage once the next one
+is read, the peak heap size should not grow with the number of lines.
+
+Author: Evan Sneath
+License: Open Software License v3.0
+
+Functions:
+    parse_arguments: Parses incoming command line arguments.
+    write_input: Writes the line input stream of the benchmark.
+    run_benchmark: Builds the benchmark and runs it for each line count.
+"""
+
+# Import standard libraries
+import argparse
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import time
+
+# Make the compiler importable when run from the tools directory
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from lib.build import run_compiler
+
+"""The benchmark program source."""
+SOURCE = os.path.join(ROOT, 'tests', 'strbench_good.src')
+
+"""The fractions of the line count run before the full count."""
+STEPS = [0.01, 0.1, 1]
+
+
+def parse_arguments():
+    """Parse Arguments
+
+    Parses all command line arguments for the string heap benchmark.
+
+    Returns:
+        An object containing all expected command line arguments.
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', '--count',
+                        help='number of lines of the largest run '
+                             '(default: 1000000)',
+                        type=int,
+                        default=1000000)
+    parser.add_argument('-t', '--target',
+                        help='code model of the build (default: 32)',
+                        choices=['32', '64'],
+                        default='32')
+    parser.add_argument('--io',
+                        help='I/O layer of the build (default: buffered)',
+                        choices=['stdio', 'buffered'],
+                        default='buffered')
+    args = parser.parse_args()
+
+    return args
+
+
+def write_input(path, count):
+    """Write Input
+
+    Writes the line count followed by that many distinct lines.
+
+    Arguments:
+        path: The path of the input file to write.
+        count: The number of lines.
+    """
+    with open(path, 'w') as f:
+        f.write('%d\n' % count)
+
+        for start in range(1, count + 1, 100000):
+            end = min(start + 100000, count + 1)
+            f.write(''.join('string %d of the input\n' % k
+                            for k in range(start, end)))
+
+    return
+
+
+def run_benchmark(count, target, io):
+    """Run Benchmark
+
+    Arguments:
+        count: The number of lines of the largest run.
+        target: The code model of the build.
+        io: The I/O layer of the build.
+
+    Returns:
+        True if every run printed the expected lines, False otherwise.
+    """
+    with tempfile.TemporaryDirectory() as work_dir:
+        # The compiler writes its intermediate code to the working directory
+        os.chdir(work_dir)
+
+        binary = os.path.join(work_dir, 'strbench')
+
+        if not run_compiler(SOURCE, binary, code_model=target, io=io):
+            return False
+
+        print('%10s %10s %12s %12s' % ('lines', 'time', 'peak heap',
+                                       'collections'))
+
+        for step in STEPS:
+            lines = max(int(count * step), 1)
+            input_path = os.path.join(work_dir, 'input.txt')
+            write_input(input_path, lines)
+
+            with open(input_path) as stdin:
+                start = time.perf_counter()
+                result = subprocess.run([binary], stdin=stdin,
+                                        capture_output=True,
+                                        env=dict(os.environ, MM_STATS='1'))
+                seconds = time.perf_counter() - start
+
+            stats = re.search(r'peak (\d+) cells, (\d+) collections',
+                              result.stderr.decode())
+            peak, collections = stats.groups() if stats else ('?', '?')
+
+            print('%10d %9.3fs %6s cells %12s' % (lines, seconds, peak,
+                                                  collections))
+
+            expected = 'string %d of the input' % lines
+            if result.returncode != 0 or \
+                    expected not in result.stdout.decode().split('\n'):
+                print('FAIL: the last line read was not "%s"' % expected)
+                return False
+
+    return True
+
+
+if __name__ == '__main__':
+    args = parse_arguments()
+
+    sys.exit(not run_benchmark(args.count, args.target, args.io))
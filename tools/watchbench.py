@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+
+"""Watch mode benchmark module
+
+Generates a large program (2000 procedures by default, see buildbench.py)
+and measures the latency from saving a one-line change to the program being
+rebuilt: with a new compiler invocation after each save, and with a compiler
+left running with --watch. Both are timed with the code in one unit, and
+split over several units with the native call model, where --watch only
+compiles the units which changed; the split watch mode is timed using
+inotify and using polling. Each edit changes the number printed by the
+program, and every rebuilt program must print the result of its edit.
+
+Author: Evan Sneath
+License: Open Software License v3.0
+
+Functions:
+    parse_arguments: Parses incoming command line arguments.
+    edit_program: Saves a one-line change to the program.
+    watch_latencies: Times the rebuilds of a running watch mode.
+    run_benchmark: Times each way of rebuilding after an edit.
+"""
+
+# Import standard libraries
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+# Make the compiler importable when run from the tools directory
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from buildbench import write_program
+
+"""The compiler command line interface."""
+COMPILER = os.path.join(ROOT, 'compiler.py')
+
+
+def parse_arguments():
+    """Parse Arguments
+
+    Parses all command line arguments for the watch mode benchmark.
+
+    Returns:
+        An object containing all expected command line arguments.
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', '--procedures',
+                        help='number of procedures (default: 2000)',
+                        type=int,
+                        default=2000)
+    parser.add_argument('-e', '--edits',
+                        help='edits timed for each way (default: 3)',
+                        type=int,
+                        default=3)
+    parser.add_argument('-j', '--jobs',
+                        help='translation units of the split builds '
+                             '(default: 8)',
+                        type=int,
+                        default=8)
+    parser.add_argument('-t', '--target',
+                        help='code model of the builds (default: 32)',
+                        choices=['32', '64'],
+                        default='32')
+    args = parser.parse_args()
+
+    return args
+
+
+def edit_program(path, number):
+    """Edit Program
+
+    Saves a one-line change to the program: a number added to the result it
+    prints. The new source is written next to the program and renamed over
+    it, as editors do.
+
+    Arguments:
+        path: The path of the source file.
+        number: The number added to the result.
+    """
+    with open(path) as f:
+        lines = f.readlines()
+
+    for index, line in enumerate(lines):
+        if line.startswith('    putInteger('):
+            lines[index] = '    putInteger(result + %d);\n' % number
+
+    with open(path + '.new', 'w') as f:
+        f.writelines(lines)
+
+    os.replace(path + '.new', path)
+
+    return
+
+
+def watch_latencies(source, binary, edits, target, flags):
+    """Watch Latencies
+
+    Arguments:
+        source: The path of the source file.
+        binary: The path of the program.
+        edits: The number of edits to time.
+        target: The code model of the builds.
+        flags: Extra flags of the compiler.
+
+    Returns:
+        A list of (seconds, output) tuples of each edit, or None if the
+        watch mode failed.
+    """
+    watch = subprocess.Popen([sys.executable, COMPILER, '-t', target,
+                              '--watch', '-o', binary, source] + flags,
+                             stdout=subprocess.PIPE, text=True)
+    results = []
+
+    try:
+        # Wait for the first build
+        for line in watch.stdout:
+            if line.startswith('Watching'):
+                break
+        else:
+            return None
+
+        for edit in range(edits):
+            start = time.perf_counter()
+            edit_program(source, edit + 2)
+
+            line = watch.stdout.readline()
+            seconds = time.perf_counter() - start
+
+            if not line.startswith('ok'):
+                return None
+
+            results.append((seconds, subprocess.check_output([binary])))
+    finally:
+        watch.terminate()
+        watch.wait()
+
+    return results
+
+
+def run_benchmark(procedures, edits, jobs, target):
+    """Run Benchmark
+
+    Arguments:
+        procedures: The number of procedures of the program.
+        edits: The number of edits timed for each way.
+        jobs: The number of translation units of the split builds.
+        target: The code model of the builds.
+
+    Returns:
+        True if every edit was rebuilt into a program printing its result,
+        False otherwise.
+    """
+    with tempfile.TemporaryDirectory() as work_dir:
+        source = os.path.join(work_dir, 'watchbench.src')
+        binary = os.path.join(work_dir, 'watchbench')
+        write_program(source, procedures)
+
+        print('%d procedures, %d edits of one line' % (procedures, edits))
+        print('%-24s %10s %10s' % ('', 'median', 'best'))
+
+        split = ['-c', 'native', '-j', str(jobs)]
+        ways = [('new invocation', [], False),
+                ('--watch', [], True),
+                ('split, new invocation', split, False),
+                ('split, --watch', split, True),
+                ('split, --watch --poll', split + ['--poll'], True)]
+        expected = None
+
+        for name, flags, watch in ways:
+            if watch:
+                results = watch_latencies(source, binary, edits, target,
+                                          flags)
+            else:
+                results = []
+
+                for edit in range(edits):
+                    start = time.perf_counter()
+                    edit_program(source, edit + 2)
+
+                    if subprocess.call([sys.executable, COMPILER, '-t',
+                                        target, '-o', binary, source] +
+                                       flags) != 0:
+                        results = None
+                        break
+
+                    results.append((time.perf_counter() - start,
+                                    subprocess.check_output([binary])))
+
+            if results is None:
+                print('FAIL: %s did not rebuild every edit' % name)
+                return False
+
+            outputs = [output for _, output in results]
+
+            if expected is None:
+                expected = outputs
+            elif outputs != expected:
+                print('FAIL: the programs of %s print other results' % name)
+                return False
+
+            seconds = [seconds for seconds, _ in results]
+            print('%-24s %9.3fs %9.3fs' % (name, statistics.median(seconds),
+                                           min(seconds)))
+
+        if len(set(expected)) != edits:
+            print('FAIL: the edits did not change the result')
+            return False
+
+    return True
+
+
+if __name__ == '__main__':
+    args = parse_arguments()
+
+    sys.exit(not run_benchmark(args.procedures, args.edits, args.jobs,
+                               args.target))